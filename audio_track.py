@@ -0,0 +1,214 @@
+import os
+import re
+import json
+import hashlib
+import logging
+from typing import Callable, Dict, List, Optional, Tuple
+
+from ffmpeg_utils import run_ffmpeg
+
+logger = logging.getLogger(__name__)
+
+# EBU R128 loudness normalisation of the output audio, off by default
+LOUDNESS_NORMALIZATION = os.getenv('LOUDNESS_NORMALIZATION', 'false').lower() == 'true'
+
+# Integrated loudness (LUFS), true peak (dBTP) and loudness range (LU) to normalise to
+LOUDNESS_TARGET = float(os.getenv('LOUDNESS_TARGET', '-23'))
+LOUDNESS_TRUE_PEAK = float(os.getenv('LOUDNESS_TRUE_PEAK', '-1'))
+LOUDNESS_RANGE = float(os.getenv('LOUDNESS_RANGE', '7'))
+
+# Loudness measurements, one JSON file per input hash
+LOUDNESS_CACHE_DIR = os.getenv('LOUDNESS_CACHE_DIR', os.path.join(os.getenv('OUTPUT_DIR', 'output'), 'loudness'))
+
+# Source audio that can go into the output as is
+COPYABLE_AUDIO_CODECS = ("aac",)
+COPYABLE_SAMPLE_RATES = (44100, 48000)
+
+# Source audio up to this much above AUDIO_BITRATE is still copied rather than re-encoded
+COPY_BITRATE_TOLERANCE = 1.25
+
+# Seconds a source may fall short of its range and still be copied
+COPY_DURATION_TOLERANCE = 0.05
+
+# Common format that lets concat join pieces from different sources
+AUDIO_FORMAT = "aformat=sample_fmts=fltp:sample_rates=48000:channel_layouts=stereo"
+
+
+def bits_per_second(rate: str) -> int:
+    """Parse a bitrate such as 128k or 1.5M"""
+    rate = rate.strip().lower()
+    scale = {"k": 1000, "m": 1000 * 1000}.get(rate[-1:], 1)
+    return int(float(rate.rstrip("km")) * scale)
+
+
+def loudness_settings() -> Optional[Dict]:
+    """The loudness targets in effect, or None when normalisation is off"""
+    if not LOUDNESS_NORMALIZATION:
+        return None
+    return {"I": LOUDNESS_TARGET, "TP": LOUDNESS_TRUE_PEAK, "LRA": LOUDNESS_RANGE}
+
+
+def audio_ranges(timeline: Dict, source_info: Dict[str, Dict]) -> List[Dict]:
+    """The timeline's audio ranges whose source has an audio stream"""
+    return [r for r in timeline["audio"] if source_info[r["source"]]["has_audio"]]
+
+
+def copy_source(ranges: List[Dict], source_info: Dict[str, Dict], duration: float,
+                audio_bitrate: str) -> Optional[Dict]:
+    """
+    The range to stream-copy as the whole output audio, if the audio needs no re-encode.
+
+    That is one range starting with the output and lasting as long as it,
+    from AAC source audio with a standard sample rate, at most stereo, no
+    more than COPY_BITRATE_TOLERANCE over AUDIO_BITRATE, and long enough
+    not to need padding. Loudness normalisation always re-encodes.
+    """
+    if LOUDNESS_NORMALIZATION or len(ranges) != 1:
+        return None
+    audio_range = ranges[0]
+    info = source_info[audio_range["source"]]
+    needed = min(audio_range["duration"], duration)
+    if audio_range["start"] > 1e-6 or audio_range["duration"] < duration - COPY_DURATION_TOLERANCE:
+        return None
+    if info["audio_codec"] not in COPYABLE_AUDIO_CODECS or info.get("audio_sample_rate") not in COPYABLE_SAMPLE_RATES:
+        return None
+    if not info.get("audio_channels") or info["audio_channels"] > 2:
+        return None
+    if not info.get("audio_bitrate") or info["audio_bitrate"] > bits_per_second(audio_bitrate) * COPY_BITRATE_TOLERANCE:
+        return None
+    if info["duration"] < audio_range["in"] + needed - COPY_DURATION_TOLERANCE:
+        return None
+    return audio_range
+
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return digest.hexdigest()
+            digest.update(chunk)
+
+
+def measure_loudness(path: str, should_cancel: Optional[Callable[[], bool]] = None,
+                     sha256: Optional[str] = None) -> Dict:
+    """
+    EBU R128 loudness of a file's audio, measured by loudnorm's first pass.
+
+    Measurements are cached under LOUDNESS_CACHE_DIR by the SHA-256 of the
+    file and the targets, so a preview and its full render, or a clip
+    stitched again, are measured only once. Pass sha256 when it is already
+    known, e.g. from the upload, to avoid reading the file to hash it.
+    """
+    targets = {"I": LOUDNESS_TARGET, "TP": LOUDNESS_TRUE_PEAK, "LRA": LOUDNESS_RANGE}
+    cache_path = os.path.join(LOUDNESS_CACHE_DIR, f"{sha256 or file_sha256(path)}.json")
+    try:
+        with open(cache_path) as f:
+            cached = json.load(f)
+        if cached["targets"] == targets:
+            return cached["measured"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    log = run_ffmpeg([
+        '-nostats', '-i', path, '-vn',
+        '-af', f"loudnorm=I={targets['I']}:TP={targets['TP']}:LRA={targets['LRA']}:print_format=json",
+        '-f', 'null', '-'
+    ], should_cancel=should_cancel)
+    match = re.search(r"\{[^{}]*\}", "\n".join(log))
+    if not match:
+        raise RuntimeError(f"Could not measure the loudness of {path}")
+    measured = json.loads(match.group(0))
+
+    os.makedirs(LOUDNESS_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{cache_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"targets": targets, "measured": measured}, f)
+    os.replace(tmp_path, cache_path)
+    logger.info(f"Measured loudness of {path}: {measured['input_i']} LUFS")
+    return measured
+
+
+def loudnorm_filter(measured: Dict) -> str:
+    """Second loudnorm pass: a linear gain to the targets from a first-pass measurement"""
+    return (
+        f"loudnorm=I={LOUDNESS_TARGET}:TP={LOUDNESS_TRUE_PEAK}:LRA={LOUDNESS_RANGE}"
+        f":measured_I={measured['input_i']}:measured_TP={measured['input_tp']}"
+        f":measured_LRA={measured['input_lra']}:measured_thresh={measured['input_thresh']}"
+        f":offset={measured['target_offset']}:linear=true"
+    )
+
+
+def build_audio(timeline: Dict, sources: Dict[str, str], source_info: Dict[str, Dict], first_input: int,
+                duration: float, audio_bitrate: str,
+                should_cancel: Optional[Callable[[], bool]] = None) -> Tuple[List[str], List[str], List[str]]:
+    """
+    Inputs, filters and output maps for the timeline's audio, trimmed or padded to duration.
+
+    Audio that can be used as is (see copy_source) is stream-copied from
+    one input. Otherwise each range is read with -ss/-t, normalised if
+    LOUDNESS_NORMALIZATION is on, padded to its full length so a short
+    source ends in silence, and the ranges are concatenated with silent
+    gaps between them into one AAC encode. Inputs are numbered from
+    first_input. All three lists are empty when nothing has audio.
+    source_info may carry each source's "sha256" to key its loudness.
+    """
+    ranges = audio_ranges(timeline, source_info)
+    if not ranges:
+        return [], [], []
+
+    copied = copy_source(ranges, source_info, duration, audio_bitrate)
+    if copied:
+        length = min(copied["duration"], duration)
+        inputs = ['-ss', f"{copied['in']:.3f}", '-t', f"{length:.3f}", '-i', sources[copied["source"]]]
+        return inputs, [], ['-map', f"{first_input}:a:0", '-c:a', 'copy']
+
+    # Each source is measured once for all of its ranges
+    loudness = {}
+    if LOUDNESS_NORMALIZATION:
+        for name in dict.fromkeys(r["source"] for r in ranges):
+            measured = measure_loudness(sources[name], should_cancel, source_info[name].get("sha256"))
+            loudness[name] = loudnorm_filter(measured)
+
+    inputs: List[str] = []
+    filters: List[str] = []
+    labels: List[str] = []
+    position = 0.0
+    for i, audio_range in enumerate(ranges):
+        if audio_range["start"] > position + 1e-6:
+            filters.append(f"anullsrc=r=48000:cl=stereo,atrim=duration={audio_range['start'] - position:.6f},{AUDIO_FORMAT}[gap{i}]")
+            labels.append(f"[gap{i}]")
+        length = audio_range["duration"]
+        inputs += ['-ss', f"{audio_range['in']:.3f}", '-t', f"{length:.3f}", '-i', sources[audio_range["source"]]]
+        chain = ["asetpts=PTS-STARTPTS"]
+        if audio_range["source"] in loudness:
+            chain.append(loudness[audio_range["source"]])
+        chain += [AUDIO_FORMAT, "apad", f"atrim=duration={length:.6f}"]
+        filters.append(f"[{first_input + i}:a]{','.join(chain)}[a{i}]")
+        labels.append(f"[a{i}]")
+        position = audio_range["start"] + length
+
+    filters.append(f"{''.join(labels)}concat=n={len(labels)}:v=0:a=1,apad,atrim=duration={duration:.6f}[aout]")
+    return inputs, filters, ['-map', '[aout]', '-c:a', 'aac', '-b:a', audio_bitrate]
+
+
+def render_audio(timeline: Dict, sources: Dict[str, str], source_info: Dict[str, Dict], duration: float,
+                 output_path: str, audio_bitrate: str,
+                 should_cancel: Optional[Callable[[], bool]] = None) -> bool:
+    """
+    Write the output audio track to output_path in one ffmpeg run.
+
+    The track is exactly duration seconds long, stream-copied when the
+    source audio allows it. Returns False, writing nothing, when no range
+    has audio.
+    """
+    inputs, filters, maps = build_audio(timeline, sources, source_info, 0, duration, audio_bitrate, should_cancel)
+    if not maps:
+        return False
+    args = inputs
+    if filters:
+        args += ['-filter_complex', ';'.join(filters)]
+    run_ffmpeg(args + maps + ['-vn', '-t', f"{duration:.6f}", '-y', output_path], should_cancel=should_cancel)
+    logger.info(f"{'Copied' if not filters else 'Encoded'} audio track to {output_path}")
+    return True
@@ -0,0 +1,93 @@
+import os
+import json
+import time
+import logging
+import threading
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Most fan clips accepted in one batch
+MAX_BATCH_SIZE = int(os.getenv('MAX_BATCH_SIZE', '50'))
+
+
+class BatchRegistry:
+    """
+    Registry of batches: one WWE source stitched against many fan clips.
+
+    A batch only records its source and the IDs of its item tasks; item
+    state lives on the tasks themselves. Each batch is a JSON record in
+    batches_dir, so batches survive restarts like registered sources do.
+    """
+
+    def __init__(self, batches_dir: str):
+        self.batches_dir = batches_dir
+        self._lock = threading.Lock()
+        os.makedirs(batches_dir, exist_ok=True)
+
+    def _record_path(self, batch_id: str) -> str:
+        return os.path.join(self.batches_dir, f"{batch_id}.json")
+
+    def _save(self, batch: Dict) -> None:
+        tmp_path = f"{self._record_path(batch['id'])}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(batch, f)
+        os.replace(tmp_path, self._record_path(batch["id"]))
+
+    def create_batch(self, batch_id: str, wwe_source_id: str, engine: str, profile: str) -> Dict:
+        """Create an empty batch for a source"""
+        batch = {
+            "id": batch_id,
+            "wwe_source_id": wwe_source_id,
+            "engine": engine,
+            "profile": profile,
+            "task_ids": [],
+            "created_at": time.time(),
+        }
+        with self._lock:
+            self._save(batch)
+        logger.info(f"Created batch {batch_id} for source {wwe_source_id}")
+        return batch
+
+    def add_task(self, batch_id: str, task_id: str) -> Optional[Dict]:
+        """Append an item task to a batch"""
+        with self._lock:
+            batch = self.get_batch(batch_id)
+            if not batch:
+                return None
+            batch["task_ids"].append(task_id)
+            self._save(batch)
+            return batch
+
+    def get_batch(self, batch_id: str) -> Optional[Dict]:
+        """Get a batch by ID"""
+        # IDs are UUIDs; anything else cannot name a record
+        if not batch_id.replace("-", "").isalnum():
+            return None
+        try:
+            with open(self._record_path(batch_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def get_all_batches(self) -> List[Dict]:
+        """Get all batches, newest first"""
+        batches = []
+        for name in os.listdir(self.batches_dir):
+            if name.endswith(".json"):
+                batch = self.get_batch(name[:-5])
+                if batch:
+                    batches.append(batch)
+        return sorted(batches, key=lambda x: x["created_at"], reverse=True)
+
+    def cleanup_old_batches(self, max_age_hours: int = 24) -> None:
+        """Remove batch records older than max_age_hours; their tasks are cleaned up by TaskManager"""
+        cutoff = time.time() - max_age_hours * 3600
+        with self._lock:
+            for batch in self.get_all_batches():
+                if batch["created_at"] < cutoff:
+                    try:
+                        os.remove(self._record_path(batch["id"]))
+                        logger.info(f"Removed old batch: {batch['id']}")
+                    except OSError as e:
+                        logger.error(f"Error removing old batch: {e}")
@@ -0,0 +1,304 @@
+"""
+Benchmark harness for the stitching pipeline.
+
+Generates synthetic fixtures with ffmpeg, stitches each fixture with every
+engine/preset/thread/bitrate combination in a fresh process, and records
+wall time, CPU time, peak RSS, output bitrate and PSNR/SSIM against a
+high-bitrate reference render. Results are written to a JSON report and
+optionally compared with a saved baseline.
+
+    python benchmark.py --engines ffmpeg,smart --presets veryfast,medium
+    python benchmark.py --save-baseline benchmark_baseline.json
+    python benchmark.py --baseline benchmark_baseline.json --tolerance 10
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import subprocess
+from typing import Dict, List
+
+from ffmpeg_utils import get_ffmpeg_binary, probe_media, run_ffmpeg
+
+# Fixtures as WIDTHxHEIGHT@FPS:DURATION[:noaudio]
+DEFAULT_FIXTURES = ["640x360@25:32", "1280x720@30:32", "1920x1080@60:35:noaudio"]
+
+# Metrics compared against the baseline and whether a higher value is better
+COMPARED_METRICS = {
+    "wall_time": False,
+    "cpu_time": False,
+    "peak_rss_mb": False,
+    "bitrate_kbps": False,
+    "psnr": True,
+    "ssim": True,
+}
+
+
+def parse_fixture(spec: str) -> Dict:
+    """Parse a fixture spec such as 1280x720@30:32 or 1920x1080@60:35:noaudio"""
+    match = re.fullmatch(r"(\d+)x(\d+)@(\d+(?:\.\d+)?):(\d+(?:\.\d+)?)(:noaudio)?", spec)
+    if not match:
+        raise argparse.ArgumentTypeError(f"Invalid fixture '{spec}', expected WIDTHxHEIGHT@FPS:DURATION[:noaudio]")
+    width, height, fps, duration, noaudio = match.groups()
+    return {
+        "spec": spec,
+        "width": int(width),
+        "height": int(height),
+        "fps": float(fps),
+        "duration": float(duration),
+        "audio": not noaudio,
+    }
+
+
+def generate_fixture(fixture: Dict, role: str, work_dir: str) -> str:
+    """Render a synthetic input clip, reusing it if it already exists"""
+    name = fixture["spec"].replace(":", "_").replace("@", "_")
+    path = os.path.join(work_dir, "fixtures", f"{role}_{name}.mp4")
+    if os.path.exists(path):
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    size = f"{fixture['width']}x{fixture['height']}"
+    # Different patterns per role so fades between sources are visible to the metrics
+    pattern = "testsrc2" if role == "wwe" else "smptehdbars"
+    args = ['-f', 'lavfi', '-i', f"{pattern}=size={size}:rate={fixture['fps']}:duration={fixture['duration']}"]
+    # The WWE clip's audio is discarded by the stitcher, so only the fan clip may lack it
+    if fixture["audio"] or role == "wwe":
+        frequency = 440 if role == "wwe" else 660
+        args += ['-f', 'lavfi', '-i', f"sine=frequency={frequency}:duration={fixture['duration']}", '-c:a', 'aac']
+    run_ffmpeg(args + ['-c:v', 'libx264', '-preset', 'ultrafast', '-crf', '18', '-pix_fmt', 'yuv420p', '-shortest', '-y', path])
+    return path
+
+
+def run_case_in_process(case: Dict) -> Dict:
+    """Stitch one case inside the current process and measure it"""
+    os.environ.update(case["env"])
+    wwe_path = case["wwe_path"]
+
+    from job_executor import create_stitcher
+
+    start = time.perf_counter()
+    stitcher = create_stitcher(case["engine"], wwe_path, case["fan_path"])
+    stitcher.stitch_videos(case["output_path"])
+    wall_time = time.perf_counter() - start
+
+    # ffmpeg runs in child processes, so count their usage as well
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    rss_per_mb = 1024 * 1024 if platform.system() == "Darwin" else 1024
+    return {
+        "wall_time": wall_time,
+        "cpu_time": own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime,
+        "peak_rss_mb": max(own.ru_maxrss, children.ru_maxrss) / rss_per_mb,
+    }
+
+
+def run_case(case: Dict) -> Dict:
+    """Run a case in a fresh interpreter so timings and RSS are isolated"""
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--run-case", json.dumps(case)],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        env=dict(os.environ, **case["env"])
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.decode("utf-8", errors="replace")[-2000:])
+    return json.loads(result.stdout.decode().strip().splitlines()[-1])
+
+
+def measure_quality(output_path: str, reference_path: str) -> Dict:
+    """PSNR and SSIM of output_path against reference_path"""
+    result = subprocess.run(
+        [get_ffmpeg_binary(), '-hide_banner', '-nostdin', '-i', output_path, '-i', reference_path,
+         '-lavfi', "[0:v]split[a0][a1];[1:v]split[b0][b1];[a0][b0]psnr;[a1][b1]ssim", '-f', 'null', '-'],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE
+    )
+    output = result.stderr.decode("utf-8", errors="replace")
+    psnr = re.search(r"PSNR .*average:([\d.]+|inf)", output)
+    ssim = re.search(r"SSIM .*All:([\d.]+)", output)
+    return {
+        "psnr": float(psnr.group(1)) if psnr and psnr.group(1) != "inf" else None,
+        "ssim": float(ssim.group(1)) if ssim else None,
+    }
+
+
+def compare_with_baseline(report: Dict, baseline: Dict, tolerance: float) -> List[Dict]:
+    """
+    Attach the change against the baseline to every case.
+
+    Returns the metrics that got worse by more than tolerance percent.
+    """
+    baseline_cases = {case["id"]: case for case in baseline.get("cases", [])}
+    regressions = []
+    for case in report["cases"]:
+        previous = baseline_cases.get(case["id"])
+        if not previous or "error" in case or "error" in previous:
+            continue
+        changes = {}
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            old, new = previous.get(metric), case.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100
+            changes[metric] = round(change, 2)
+            worse = -change if higher_is_better else change
+            if worse > tolerance:
+                regressions.append({"case": case["id"], "metric": metric, "baseline": old, "current": new, "change_pct": round(change, 2)})
+        case["baseline_change_pct"] = changes
+    return regressions
+
+
+def build_cases(args, work_dir: str) -> List[Dict]:
+    cases = []
+    for fixture in args.fixtures:
+        wwe_path = generate_fixture(fixture, "wwe", work_dir)
+        fan_path = generate_fixture(fixture, "fan", work_dir)
+        for engine in args.engines:
+            for preset in args.presets:
+                for threads in args.threads:
+                    for bitrate in args.bitrates:
+                        case_id = f"{fixture['spec']}/{engine}/{preset}/t{threads}/{bitrate}"
+                        cases.append({
+                            "id": case_id,
+                            "fixture": fixture,
+                            "engine": engine,
+                            "preset": preset,
+                            "threads": threads,
+                            "bitrate": bitrate,
+                            "wwe_path": wwe_path,
+                            "fan_path": fan_path,
+                            "output_path": os.path.join(work_dir, "outputs", case_id.replace("/", "_").replace(":", "_") + ".mp4"),
+                            "env": {
+                                "TARGET_WIDTH": str(args.width),
+                                "TARGET_HEIGHT": str(args.height),
+                                "TARGET_FPS": str(args.fps),
+                                "ENCODER_PRESET": preset,
+                                "ENCODER_THREADS": str(threads),
+                                "VIDEO_BITRATE": bitrate,
+                            },
+                        })
+    return cases
+
+
+def prepare_mezzanine(case: Dict, work_dir: str, cache: Dict) -> None:
+    """Smart renders read the WWE clip from a normalized copy, made once per fixture and settings"""
+    key = (case["wwe_path"], case["env"]["TARGET_WIDTH"], case["env"]["TARGET_HEIGHT"], case["env"]["TARGET_FPS"])
+    if key not in cache:
+        os.environ.update(case["env"])
+        from source_registry import normalize_source
+        path = os.path.join(work_dir, "mezzanine", os.path.basename(case["wwe_path"]))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        start = time.perf_counter()
+        if not os.path.exists(path):
+            normalize_source(case["wwe_path"], path)
+        cache[key] = {"path": path, "normalize_time": time.perf_counter() - start}
+    case["wwe_path"] = cache[key]["path"]
+    case["normalize_time"] = cache[key]["normalize_time"]
+
+
+def render_reference(case: Dict, args, work_dir: str, cache: Dict) -> str:
+    """High-bitrate render of the fixture that every case of it is scored against"""
+    fixture_key = case["fixture"]["spec"]
+    if fixture_key not in cache:
+        reference = dict(case, engine=args.reference_engine, output_path=os.path.join(
+            work_dir, "references", fixture_key.replace(":", "_").replace("@", "_") + ".mp4"))
+        reference["env"] = dict(case["env"], ENCODER_PRESET="medium", VIDEO_BITRATE=args.reference_bitrate)
+        os.makedirs(os.path.dirname(reference["output_path"]), exist_ok=True)
+        if not os.path.exists(reference["output_path"]):
+            run_case(reference)
+        cache[fixture_key] = reference["output_path"]
+    return cache[fixture_key]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the video stitching pipeline")
+    parser.add_argument("--fixtures", type=parse_fixture, nargs="+",
+                        default=[parse_fixture(spec) for spec in DEFAULT_FIXTURES],
+                        help="Synthetic inputs as WIDTHxHEIGHT@FPS:DURATION[:noaudio]")
+    parser.add_argument("--engines", type=lambda s: s.split(","), default=["frames", "ffmpeg", "smart"])
+    parser.add_argument("--presets", type=lambda s: s.split(","), default=["medium"])
+    parser.add_argument("--threads", type=lambda s: [int(t) for t in s.split(",")], default=[4])
+    parser.add_argument("--bitrates", type=lambda s: s.split(","), default=[os.getenv('VIDEO_BITRATE', '2000k')])
+    parser.add_argument("--width", type=int, default=int(os.getenv('TARGET_WIDTH', '1280')))
+    parser.add_argument("--height", type=int, default=int(os.getenv('TARGET_HEIGHT', '720')))
+    parser.add_argument("--fps", type=int, default=int(os.getenv('TARGET_FPS', '30')))
+    parser.add_argument("--reference-engine", default="ffmpeg")
+    parser.add_argument("--reference-bitrate", default="20000k")
+    parser.add_argument("--no-quality", action="store_true", help="Skip PSNR/SSIM measurement")
+    parser.add_argument("--work-dir", default=".benchmark")
+    parser.add_argument("--output", default="benchmark_report.json")
+    parser.add_argument("--baseline", help="Report to compare against")
+    parser.add_argument("--save-baseline", help="Also write this report to the given baseline path")
+    parser.add_argument("--tolerance", type=float, default=10.0,
+                        help="Percent a metric may get worse before it counts as a regression")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        print(json.dumps(run_case_in_process(json.loads(args.run_case))))
+        return 0
+
+    work_dir = os.path.abspath(args.work_dir)
+    os.makedirs(os.path.join(work_dir, "outputs"), exist_ok=True)
+
+    report = {
+        "created_at": time.time(),
+        "host": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "target": {"width": args.width, "height": args.height, "fps": args.fps},
+        "cases": [],
+    }
+
+    mezzanines, references = {}, {}
+    for case in build_cases(args, work_dir):
+        print(f"Running {case['id']}...", flush=True)
+        entry = {key: case[key] for key in ("id", "engine", "preset", "threads", "bitrate")}
+        entry["fixture"] = case["fixture"]["spec"]
+        try:
+            if case["engine"] == "smart":
+                prepare_mezzanine(case, work_dir, mezzanines)
+                entry["normalize_time"] = round(case["normalize_time"], 3)
+            entry.update(run_case(case))
+
+            info = probe_media(case["output_path"])
+            entry["duration"] = info["duration"]
+            entry["bitrate_kbps"] = round(os.path.getsize(case["output_path"]) * 8 / 1000 / info["duration"], 1)
+
+            if not args.no_quality:
+                entry.update(measure_quality(case["output_path"], render_reference(case, args, work_dir, references)))
+        except Exception as e:
+            entry["error"] = str(e)
+            print(f"  failed: {e}", flush=True)
+        else:
+            print(f"  wall {entry['wall_time']:.2f}s, cpu {entry['cpu_time']:.2f}s, "
+                  f"rss {entry['peak_rss_mb']:.0f}MB, {entry['bitrate_kbps']}kbps, "
+                  f"psnr {entry.get('psnr')}, ssim {entry.get('ssim')}", flush=True)
+        report["cases"].append(entry)
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_with_baseline(report, json.load(f), args.tolerance)
+        report["regressions"] = regressions
+        for regression in regressions:
+            print(f"REGRESSION {regression['case']} {regression['metric']}: "
+                  f"{regression['baseline']} -> {regression['current']} ({regression['change_pct']:+.1f}%)")
+        exit_code = 1 if regressions else 0
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote report to {args.output}")
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {args.save_baseline}")
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,47 @@
+import os
+
+import pytest
+
+import benchmark
+from ffmpeg_utils import get_ffmpeg_binary
+
+
+@pytest.fixture(scope="session")
+def ffmpeg() -> str:
+    """The ffmpeg binary; tests that encode are skipped without one"""
+    try:
+        return get_ffmpeg_binary()
+    except RuntimeError:
+        pytest.skip("ffmpeg is not installed")
+
+
+@pytest.fixture(scope="session")
+def make_clip(ffmpeg, tmp_path_factory):
+    """Render a synthetic lavfi clip from a benchmark fixture spec such as 320x180@25:6"""
+    work_dir = str(tmp_path_factory.mktemp("clips"))
+
+    def make(spec: str, role: str = "wwe") -> str:
+        return benchmark.generate_fixture(benchmark.parse_fixture(spec), role, work_dir)
+    return make
+
+
+@pytest.fixture
+def small_output(monkeypatch):
+    """A small output size so encodes in tests take a moment"""
+    monkeypatch.setenv('TARGET_WIDTH', '320')
+    monkeypatch.setenv('TARGET_HEIGHT', '180')
+    monkeypatch.setenv('TARGET_FPS', '30')
+    monkeypatch.setenv('ENCODER_THREADS', str(min(4, os.cpu_count() or 1)))
+
+
+@pytest.fixture(scope="session")
+def api(tmp_path_factory):
+    """A client for the app, with its storage in a temporary directory, started once per session"""
+    root = tmp_path_factory.mktemp("api")
+    # main reads its settings when it is imported
+    os.environ.update(TEMP_DIR=str(root / "temp"), OUTPUT_DIR=str(root / "output"),
+                      MAX_UPLOAD_SIZE="1", MAX_WORKERS="1")
+    from fastapi.testclient import TestClient
+    import main
+    with TestClient(main.app) as client:
+        yield client
@@ -0,0 +1,181 @@
+import os
+import hashlib
+import logging
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Dict, Optional, Tuple
+from urllib.parse import quote
+
+import anyio
+from fastapi import Request
+from fastapi.responses import Response
+
+logger = logging.getLogger(__name__)
+
+# Hand the transfer to a fronting proxy: "" (serve from Python), "nginx"
+# (X-Accel-Redirect) or "sendfile" (X-Sendfile for Apache/lighttpd)
+DOWNLOAD_ACCEL_MODE = os.getenv('DOWNLOAD_ACCEL_MODE', '').lower()
+
+# Internal location nginx maps to OUTPUT_DIR when using X-Accel-Redirect
+DOWNLOAD_ACCEL_PREFIX = os.getenv('DOWNLOAD_ACCEL_PREFIX', '/protected-output')
+
+# Bytes read per chunk when serving a file from Python
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
+
+def file_etag(stat_result: os.stat_result) -> str:
+    """Strong ETag derived from the file's identity, size and modification time"""
+    base = f"{stat_result.st_ino}-{stat_result.st_size}-{stat_result.st_mtime_ns}"
+    return f'"{hashlib.md5(base.encode()).hexdigest()}"'
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range Range header into an inclusive (start, end) pair.
+
+    Returns None for headers this server ignores (other units, multiple
+    ranges), in which case the whole file is sent. Raises ValueError when
+    the range cannot be satisfied.
+    """
+    unit, _, ranges = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+    start, _, end = ranges.strip().partition("-")
+    try:
+        if start == "":
+            # Suffix range: the last N bytes
+            length = int(end)
+            if length <= 0:
+                raise ValueError("Empty suffix range")
+            return max(size - length, 0), size - 1
+        first = int(start)
+        last = int(end) if end else size - 1
+    except ValueError:
+        raise ValueError(f"Malformed range: {header}")
+    if first >= size or last < first:
+        raise ValueError(f"Range {header} not satisfiable for {size} bytes")
+    return first, min(last, size - 1)
+
+
+def is_not_modified(request: Request, etag: str, mtime: float) -> bool:
+    """Evaluate If-None-Match / If-Modified-Since against the file"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags or f"W/{etag}" in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def if_range_matches(request: Request, etag: str, last_modified: str) -> bool:
+    """A Range is only honoured if If-Range (when sent) still names this file"""
+    if_range = request.headers.get("if-range")
+    return if_range is None or if_range.strip() in (etag, last_modified)
+
+
+class RangeFileResponse(Response):
+    """
+    Streams a byte range of a file, read in chunks off the event loop.
+
+    ASGI servers such as uvicorn do not hand the socket to the app, so
+    Python cannot send the file zero-copy; set DOWNLOAD_ACCEL_MODE to have
+    a fronting proxy do that instead.
+    """
+
+    def __init__(self, path: str, start: int, end: int, status_code: int, headers: Dict[str, str], media_type: str):
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.path = path
+        self.start = start
+        self.count = end - start + 1
+        self.headers["content-length"] = str(self.count)
+
+    async def __call__(self, scope, receive, send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"].upper() == "HEAD" or self.count == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        async with await anyio.open_file(self.path, mode="rb") as f:
+            await f.seek(self.start)
+            remaining = self.count
+            while remaining > 0:
+                chunk = await f.read(min(DOWNLOAD_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def requests_whole_file(request: Request, size: int) -> bool:
+    """Whether the request asks for every byte of the file, with no Range or one covering it all"""
+    range_header = request.headers.get("range")
+    if not range_header:
+        return True
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError:
+        return False
+    return byte_range is None or byte_range == (0, size - 1)
+
+
+def download_response(request: Request, path: str, filename: str, media_type: str = "video/mp4",
+                      accel_path: Optional[str] = None, inline: bool = False) -> Tuple[Response, bool]:
+    """
+    Build the response for downloading path.
+
+    Supports conditional requests (ETag/Last-Modified), single byte ranges
+    and proxy offload. accel_path is the file's path relative to the
+    directory the proxy serves. inline files are meant for a player, not
+    to be saved. Returns the response and whether it
+    transfers the whole file, so callers only count real downloads rather
+    than every seek or partial fetch.
+    """
+    stat_result = os.stat(path)
+    size = stat_result.st_size
+    etag = file_etag(stat_result)
+    last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+
+    quoted = quote(filename)
+    kind = "inline" if inline else "attachment"
+    disposition = (
+        f'{kind}; filename="{filename}"' if quoted == filename
+        else f"{kind}; filename*=utf-8''{quoted}"
+    )
+    headers = {
+        "etag": etag,
+        "last-modified": last_modified,
+        "accept-ranges": "bytes",
+        "content-disposition": disposition,
+        "cache-control": "private, max-age=3600",
+    }
+
+    if is_not_modified(request, etag, stat_result.st_mtime):
+        return Response(status_code=304, headers={k: headers[k] for k in ("etag", "last-modified", "cache-control")}), False
+
+    # A fronting proxy handles ranges and sends the bytes itself
+    if DOWNLOAD_ACCEL_MODE == "nginx":
+        target = f"{DOWNLOAD_ACCEL_PREFIX.rstrip('/')}/{quote(accel_path or os.path.basename(path))}"
+        response = Response(headers=dict(headers, **{"x-accel-redirect": target}), media_type=media_type)
+        return response, requests_whole_file(request, size)
+    if DOWNLOAD_ACCEL_MODE == "sendfile":
+        response = Response(headers=dict(headers, **{"x-sendfile": os.path.abspath(path)}), media_type=media_type)
+        return response, requests_whole_file(request, size)
+
+    range_header = request.headers.get("range")
+    if range_header and if_range_matches(request, etag, last_modified):
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            return Response(status_code=416, headers={"content-range": f"bytes */{size}"}), False
+        if byte_range:
+            start, end = byte_range
+            headers["content-range"] = f"bytes {start}-{end}/{size}"
+            return RangeFileResponse(path, start, end, 206, headers, media_type), byte_range == (0, size - 1)
+
+    return RangeFileResponse(path, 0, size - 1, 200, headers, media_type), True
@@ -0,0 +1,189 @@
+import os
+import logging
+import shutil
+from typing import Callable, List, Optional, Tuple
+
+from audio_track import build_audio
+from ffmpeg_utils import probe_media, run_ffmpeg
+from file_manager import make_scratch_dir
+from metrics import StageTimer
+from stitch_plan import FFMPEG_OUTPUT_PARAMS, default_timeline, output_settings, rate_control_params
+
+logger = logging.getLogger(__name__)
+
+
+def frame_lead(t: float, fps: Optional[float]) -> float:
+    """Seconds from the start of the source frame showing at t to t; 0 when the frame rate is unknown"""
+    if not fps:
+        return 0.0
+    return max(0.0, t - int(t * fps + 0.00001) / fps)
+
+
+class FFmpegStitcher:
+    """
+    Stitcher that compiles the timeline into a single ffmpeg filter_complex.
+
+    Produces the same output as VideoStitcher (trimmed segments scaled to the
+    target size and frame rate, fades between segments, audio ranges laid
+    over the result) but leaves all decoding, filtering and encoding to
+    ffmpeg instead of passing every frame through Python.
+    """
+
+    def __init__(self, wwe_video_path, fan_video_path, profile=None, timeline=None, checksums=None):
+        """
+        Initialize the FFmpegStitcher with paths to input videos, an encoding
+        profile, a compiled timeline (the default plan if omitted) and the
+        known SHA-256 of each input by source name
+        """
+        # Per-stage wall time, reported back with the job
+        self.timer = StageTimer()
+        self.temp_dir = make_scratch_dir()
+        logger.info(f"Created temporary directory: {self.temp_dir}")
+
+        settings = output_settings(profile)
+        self.profile = settings["profile"]
+        self.target_size = settings["target_size"]
+        self.target_fps = settings["target_fps"]
+        self.video_bitrate = settings["video_bitrate"]
+        self.audio_bitrate = settings["audio_bitrate"]
+        self.encoder_threads = settings["encoder_threads"]
+        self.encoder_preset = settings["encoder_preset"]
+        self.rate_control = rate_control_params(settings)
+        self.timeline = timeline or default_timeline()
+
+        self.sources = {"wwe": wwe_video_path, "fan": fan_video_path}
+        self.timer.start("probe")
+        try:
+            self.source_info = {name: probe_media(path) for name, path in self.sources.items()}
+            for name, sha256 in (checksums or {}).items():
+                self.source_info[name]["sha256"] = sha256
+        except Exception as e:
+            logger.error(f"Error probing input videos: {str(e)}")
+            self.cleanup()
+            raise
+        finally:
+            self.timer.stop()
+
+        logger.info(f"WWE Video Duration: {self.source_info['wwe']['duration']:.2f} seconds")
+        logger.info(f"Fan Video Duration: {self.source_info['fan']['duration']:.2f} seconds")
+
+    def cleanup(self):
+        """Clean up temporary files"""
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir, ignore_errors=True)
+            logger.info("Cleaned up temporary directory")
+
+    def build_audio(self, first_input: int, duration: float,
+                    should_cancel: Optional[Callable[[], bool]] = None) -> Tuple[List[str], List[str], List[str]]:
+        """Inputs, filters and output maps for the timeline's audio (see audio_track.build_audio)"""
+        return build_audio(self.timeline, self.sources, self.source_info, first_input, duration,
+                           self.audio_bitrate, should_cancel)
+
+    def build_command(self, output_path: str, should_cancel: Optional[Callable[[], bool]] = None) -> List[str]:
+        """
+        Build the ffmpeg arguments for the whole timeline.
+
+        Each segment gets its own input seeked with -ss/-t so ffmpeg only
+        decodes the frames it keeps, and every audio range is added as one
+        more input.
+        """
+        width, height = self.target_size
+        inputs: List[str] = []
+        filters: List[str] = []
+        labels: List[str] = []
+        total_duration = 0.0
+
+        for i, segment in enumerate(self.timeline["segments"]):
+            source_duration = self.source_info[segment["source"]]["duration"]
+            end_time = min(segment["out"], source_duration)
+            duration = end_time - segment["in"]
+            if duration <= 0:
+                raise ValueError(
+                    f"{segment['source']} video is too short for segment {i + 1} "
+                    f"({source_duration:.2f}s, segment starts at {segment['in']}s)"
+                )
+            total_duration += duration
+
+            # Seek to the start of the source frame showing at the in point, then shift it back to
+            # that point, so a cut between source frames keeps the frame on screen there
+            lead = frame_lead(segment["in"], self.source_info[segment["source"]].get("fps"))
+            inputs += ['-ss', f"{segment['in'] - lead:.6f}", '-t', f"{duration + lead:.6f}",
+                       '-i', self.sources[segment["source"]]]
+
+            chain = [
+                f"setpts=PTS-STARTPTS-{lead:.6f}/TB",
+                f"scale={width}:{height}",
+                'setsar=1',
+                # A source frame first shows in the output frame at or after its time, so every
+                # output frame holds the source frame showing at its time, as in the frame path
+                f"fps={self.target_fps}:round=up",
+                # As many frames as the frame path renders for the segment
+                f"trim=end_frame={round(duration * self.target_fps)}",
+            ]
+            if segment["fade_in"]:
+                chain.append(f"fade=t=in:st=0:d={segment['fade_in']}")
+            if segment["fade_out"]:
+                chain.append(f"fade=t=out:st={duration - segment['fade_out']:.3f}:d={segment['fade_out']}")
+
+            filters.append(f"[{i}:v]{','.join(chain)}[v{i}]")
+            labels.append(f"[v{i}]")
+
+        self.total_duration = total_duration
+        filters.append(f"{''.join(labels)}concat=n={len(labels)}:v=1:a=0[vout]")
+        maps = ['-map', '[vout]']
+
+        # Audio ranges, padded with silence where the timeline has none, or the source audio as is
+        audio_inputs, audio_filters, audio_maps = self.build_audio(len(labels), total_duration, should_cancel)
+        inputs += audio_inputs
+        filters += audio_filters
+        maps += audio_maps
+
+        return inputs + [
+            '-filter_complex', ';'.join(filters),
+            *maps,
+            '-t', f"{total_duration:.3f}",
+            '-r', str(self.target_fps),
+            '-c:v', 'libx264',
+            '-preset', self.encoder_preset,
+            *self.rate_control,
+            '-threads', str(self.encoder_threads),
+            *FFMPEG_OUTPUT_PARAMS,
+            output_path
+        ]
+
+    def stitch_videos(self, output_path, should_cancel: Optional[Callable[[], bool]] = None,
+                      on_progress: Optional[Callable] = None):
+        """
+        Stitch all video segments together with commentary audio in one ffmpeg run.
+
+        on_progress(stage, done, total) receives frame progress.
+        """
+        try:
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+            temp_output = os.path.join(self.temp_dir, "temp_output.mp4")
+            self.timer.start("segments")
+            command = self.build_command(temp_output, should_cancel)
+            total_frames = round(self.total_duration * self.target_fps)
+
+            def _progress(block):
+                if block.get("frame", "").isdigit():
+                    on_progress("encode", int(block["frame"]), total_frames)
+
+            logger.info(f"Writing final video to: {temp_output}")
+            self.timer.start("encode")
+            run_ffmpeg(command, should_cancel=should_cancel, on_progress=_progress if on_progress else None)
+
+            self.timer.start("mux")
+            if on_progress:
+                on_progress("mux")
+            shutil.move(temp_output, output_path)
+            logger.info(f"Moved processed video to: {output_path}")
+            logger.info("Video processing completed successfully")
+
+        except Exception as e:
+            logger.error(f"Error stitching videos: {str(e)}")
+            raise
+        finally:
+            self.timer.stop()
+            self.cleanup()
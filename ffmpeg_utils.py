@@ -0,0 +1,222 @@
+import os
+import re
+import json
+import shutil
+import logging
+import threading
+import subprocess
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Seconds a metadata probe may take before the input is treated as unreadable
+PROBE_TIMEOUT = float(os.getenv('PROBE_TIMEOUT', '30'))
+
+
+def get_ffmpeg_binary() -> str:
+    """Locate ffmpeg: FFMPEG_BINARY, then the copy bundled with imageio, then PATH"""
+    binary = os.getenv('FFMPEG_BINARY')
+    if binary and binary != 'ffmpeg-imageio':
+        return binary
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        pass
+    binary = shutil.which('ffmpeg')
+    if not binary:
+        raise RuntimeError("ffmpeg binary not found, set FFMPEG_BINARY")
+    return binary
+
+
+def get_ffprobe_binary() -> Optional[str]:
+    """Locate ffprobe: FFPROBE_BINARY, next to ffmpeg, then PATH. None if there is none"""
+    binary = os.getenv('FFPROBE_BINARY')
+    if binary:
+        return binary
+    try:
+        sibling = os.path.join(os.path.dirname(get_ffmpeg_binary()), 'ffprobe')
+        if os.path.isfile(sibling):
+            return sibling
+    except RuntimeError:
+        pass
+    return shutil.which('ffprobe')
+
+
+def run_ffmpeg(args: List[str], should_cancel: Optional[Callable[[], bool]] = None,
+               on_progress: Optional[Callable[[Dict], None]] = None) -> List[str]:
+    """
+    Run ffmpeg with the given arguments and wait for it to finish.
+
+    should_cancel is polled while ffmpeg runs; when it returns True the
+    process is killed and JobCancelledError is raised. on_progress, if
+    given, receives each block of ffmpeg's -progress output as a dict
+    (frame, out_time_us, progress, ...). Returns the last lines of
+    ffmpeg's log. A non-zero exit raises RuntimeError carrying them.
+    """
+    command = [get_ffmpeg_binary(), '-hide_banner', '-nostdin']
+    if on_progress:
+        command += ['-progress', 'pipe:1', '-nostats']
+    command += args
+    logger.debug(f"Running: {' '.join(command)}")
+
+    process = subprocess.Popen(
+        command,
+        stdout=subprocess.PIPE if on_progress else subprocess.DEVNULL,
+        stderr=subprocess.PIPE
+    )
+
+    # Drain stderr in the background so a chatty ffmpeg never blocks on a full pipe
+    log_tail = deque(maxlen=20)
+
+    def _drain():
+        for line in process.stderr:
+            log_tail.append(line.decode('utf-8', errors='replace').rstrip())
+
+    def _read_progress():
+        block = {}
+        for line in process.stdout:
+            key, _, value = line.decode('utf-8', errors='replace').strip().partition('=')
+            block[key] = value
+            # Every block of -progress output ends with a progress= line
+            if key == 'progress':
+                try:
+                    on_progress(block)
+                except Exception as e:
+                    logger.error(f"Error in ffmpeg progress handler: {e}")
+                block = {}
+
+    readers = [threading.Thread(target=_drain, daemon=True)]
+    if on_progress:
+        readers.append(threading.Thread(target=_read_progress, daemon=True))
+    for reader in readers:
+        reader.start()
+
+    try:
+        while True:
+            try:
+                process.wait(timeout=0.5)
+                break
+            except subprocess.TimeoutExpired:
+                if should_cancel and should_cancel():
+                    process.kill()
+                    process.wait()
+                    from job_executor import JobCancelledError
+                    raise JobCancelledError("ffmpeg cancelled")
+    finally:
+        for reader in readers:
+            reader.join(timeout=5)
+
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with code {process.returncode}: {' | '.join(log_tail)}")
+    return list(log_tail)
+
+
+def probe_media(path: str) -> Dict:
+    """
+    Read container and stream metadata without decoding any frames.
+
+    Returns the duration, whether there is an audio stream and its codec,
+    sample rate, channel count and bitrate (bits/s), the first video
+    stream's codec, pixel format, size and frame rate, and the container's
+    comment tag. Uses ffprobe when it is installed and falls back to
+    parsing ffmpeg's input banner (imageio only bundles ffmpeg).
+    """
+    ffprobe = get_ffprobe_binary()
+    if ffprobe:
+        return _probe_with_ffprobe(ffprobe, path)
+    return _probe_with_ffmpeg(path)
+
+
+def _empty_probe(duration: float) -> Dict:
+    return {
+        "duration": duration,
+        "has_audio": False,
+        "audio_codec": None,
+        "audio_sample_rate": None,
+        "audio_channels": None,
+        "audio_bitrate": None,
+        "video_codec": None,
+        "pix_fmt": None,
+        "width": None,
+        "height": None,
+        "fps": None,
+        "comment": None,
+    }
+
+
+def _probe_with_ffprobe(ffprobe: str, path: str) -> Dict:
+    result = subprocess.run(
+        [ffprobe, '-v', 'error', '-print_format', 'json', '-show_format', '-show_streams', path],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        timeout=PROBE_TIMEOUT
+    )
+    try:
+        data = json.loads(result.stdout or b'{}')
+        container = data["format"]
+        info = _empty_probe(float(container["duration"]))
+    except (ValueError, KeyError):
+        raise ValueError(f"Could not read duration of {path}")
+
+    info["comment"] = (container.get("tags") or {}).get("comment")
+    for stream in data.get("streams", []):
+        if stream.get("codec_type") == "audio" and not info["has_audio"]:
+            info["has_audio"], info["audio_codec"] = True, stream.get("codec_name")
+            info["audio_channels"] = stream.get("channels")
+            for field, key in (("audio_sample_rate", "sample_rate"), ("audio_bitrate", "bit_rate")):
+                if str(stream.get(key) or "").isdigit():
+                    info[field] = int(stream[key])
+        elif stream.get("codec_type") == "video" and info["video_codec"] is None:
+            info["video_codec"], info["pix_fmt"] = stream.get("codec_name"), stream.get("pix_fmt")
+            info["width"], info["height"] = stream.get("width"), stream.get("height")
+            numerator, _, denominator = (stream.get("avg_frame_rate") or "0/0").partition("/")
+            if denominator and float(denominator):
+                info["fps"] = round(float(numerator) / float(denominator), 3)
+    return info
+
+
+def _probe_with_ffmpeg(path: str) -> Dict:
+    result = subprocess.run(
+        [get_ffmpeg_binary(), '-hide_banner', '-nostdin', '-i', path],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        timeout=PROBE_TIMEOUT
+    )
+    output = result.stderr.decode('utf-8', errors='replace')
+
+    match = re.search(r"Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)", output)
+    if not match:
+        raise ValueError(f"Could not read duration of {path}")
+    hours, minutes, seconds = match.groups()
+
+    info = _empty_probe(int(hours) * 3600 + int(minutes) * 60 + float(seconds))
+    audio = re.search(r"Stream #\d+:\d+.*: Audio: (\w+)(.*)", output)
+    if audio:
+        info["has_audio"], info["audio_codec"] = True, audio.group(1)
+        details = audio.group(2)
+        sample_rate = re.search(r", (\d+) Hz", details)
+        if sample_rate:
+            info["audio_sample_rate"] = int(sample_rate.group(1))
+        channels = re.search(r" Hz, ([^,]+)", details)
+        if channels:
+            layout = channels.group(1).strip()
+            count = re.match(r"(\d+) channels", layout)
+            info["audio_channels"] = {"mono": 1, "stereo": 2}.get(layout, int(count.group(1)) if count else None)
+        bitrate = re.search(r", (\d+) kb/s", details)
+        if bitrate:
+            info["audio_bitrate"] = int(bitrate.group(1)) * 1000
+
+    video = re.search(r"Stream #\d+:\d+.*: Video: (\w+)[^,]*, (\w+)[^,]*(?:,[^,]*)*?, (\d+)x(\d+)", output)
+    if video:
+        info["video_codec"], info["pix_fmt"] = video.group(1), video.group(2)
+        info["width"], info["height"] = int(video.group(3)), int(video.group(4))
+    fps = re.search(r"Stream #\d+:\d+.*: Video: .*?([\d.]+) fps", output)
+    if fps:
+        info["fps"] = float(fps.group(1))
+    comment = re.search(r"^\s*comment\s*:\s*(.+)$", output, re.MULTILINE)
+    if comment:
+        info["comment"] = comment.group(1).strip()
+
+    return info
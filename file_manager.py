@@ -1 +1,320 @@
- 
\ No newline at end of file
+import os
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional
+
+import aiofiles
+
+from metrics import STORAGE_RECLAIMED_BYTES, directory_size
+from task_manager import TaskStatus
+
+if TYPE_CHECKING:
+    from fastapi import UploadFile
+
+logger = logging.getLogger(__name__)
+
+# Bytes copied per read while ingesting uploads
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', str(1024 * 1024)))
+
+# Volume for per-job scratch files, e.g. a tmpfs mount; the system temp directory if unset
+SCRATCH_DIR = os.getenv('SCRATCH_DIR') or None
+
+# Prefix of per-job scratch directories, so the reaper only touches its own
+SCRATCH_PREFIX = "stitch_"
+
+# Byte limits for uploads in TEMP_DIR and task outputs in OUTPUT_DIR, in MB; 0 disables
+TEMP_QUOTA = int(os.getenv('TEMP_QUOTA', '5120'))
+OUTPUT_QUOTA = int(os.getenv('OUTPUT_QUOTA', '10240'))
+
+# Seconds between background reaper passes
+REAP_INTERVAL = float(os.getenv('REAP_INTERVAL', '300'))
+
+# Age at which finished tasks are removed with their files
+TASK_MAX_AGE_HOURS = int(os.getenv('TASK_MAX_AGE_HOURS', '24'))
+
+# Seconds an unreferenced temp file or scratch directory is left alone, so
+# files of requests still in flight are not taken
+ORPHAN_MAX_AGE = float(os.getenv('ORPHAN_MAX_AGE', '3600'))
+
+
+class UploadTooLargeError(Exception):
+    """Raised when an upload exceeds the configured size limit"""
+
+
+class StorageQuotaError(Exception):
+    """Raised when accepting more data would take a storage area over its quota"""
+
+
+async def save_upload(upload: "UploadFile", dest_path: str, max_bytes: int, chunk_size: Optional[int] = None) -> Dict:
+    """
+    Copy an upload to dest_path in fixed-size chunks.
+
+    Memory use is bounded by chunk_size whatever the size of the upload.
+    The copy stops as soon as max_bytes is exceeded, in which case the
+    partial file is removed and UploadTooLargeError is raised. Returns the
+    number of bytes written and the SHA-256 of the content.
+    """
+    chunk_size = chunk_size or UPLOAD_CHUNK_SIZE
+
+    # The multipart parser already knows the size of spooled uploads
+    if upload.size is not None and upload.size > max_bytes:
+        raise UploadTooLargeError(f"{upload.filename} is {upload.size} bytes, limit is {max_bytes}")
+
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async with aiofiles.open(dest_path, "wb") as f:
+            while True:
+                chunk = await upload.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLargeError(f"{upload.filename} exceeds the limit of {max_bytes} bytes")
+                digest.update(chunk)
+                await f.write(chunk)
+    except Exception:
+        if os.path.exists(dest_path):
+            os.remove(dest_path)
+        raise
+
+    logger.info(f"Saved upload {upload.filename} to {dest_path} ({size} bytes)")
+    return {"path": dest_path, "size": size, "sha256": digest.hexdigest()}
+
+
+def make_scratch_dir() -> str:
+    """Create a private scratch directory for one job on the scratch volume"""
+    if SCRATCH_DIR:
+        os.makedirs(SCRATCH_DIR, exist_ok=True)
+    return tempfile.mkdtemp(prefix=SCRATCH_PREFIX, dir=SCRATCH_DIR)
+
+
+def _last_modified(path: str) -> float:
+    """Latest mtime of path and everything under it"""
+    latest = os.path.getmtime(path)
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            try:
+                latest = max(latest, os.path.getmtime(os.path.join(root, name)))
+            except OSError:
+                pass
+    return latest
+
+
+def _files(path: str) -> List[os.stat_result]:
+    """stat of path, or of every file under it when it is a directory"""
+    if not os.path.isdir(path):
+        return [os.stat(path)]
+    results = []
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                results.append(os.stat(os.path.join(root, name)))
+            except OSError:
+                pass
+    return results
+
+
+def _disk_usage(path: str, seen: set) -> int:
+    """Bytes of the files at path not counted yet; hard links to an inode in seen are skipped"""
+    total = 0
+    for st in _files(path):
+        if (st.st_dev, st.st_ino) not in seen:
+            seen.add((st.st_dev, st.st_ino))
+            total += st.st_size
+    return total
+
+
+def _remove(path: str, reason: str) -> int:
+    """
+    Delete a file or directory tree, returning the bytes freed.
+
+    Files with other hard links, such as result cache entries, stay on
+    disk, so they free nothing.
+    """
+    try:
+        size = sum(st.st_size for st in _files(path) if st.st_nlink == 1)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    except OSError as e:
+        # Another worker's reaper or the owning job may have removed it first
+        logger.debug(f"Could not remove {path}: {e}")
+        return 0
+    STORAGE_RECLAIMED_BYTES.labels(reason=reason).inc(size)
+    logger.info(f"Removed {reason} file: {path} ({size} bytes)")
+    return size
+
+
+class StorageManager:
+    """
+    Keeps TEMP_DIR, OUTPUT_DIR and the scratch volume within bounds.
+
+    Files are tracked through the tasks that own them: a task's inputs,
+    output and preview are known from its record, so anything in these
+    directories that no task claims is an orphan, e.g. left by a crash or
+    by a task store that was reset. A background thread periodically
+    removes old tasks and orphans and evicts outputs once OUTPUT_DIR is
+    over its quota, preferring outputs that were downloaded the least and
+    least recently. Uploads that would take TEMP_DIR over its quota are
+    refused up front.
+    """
+
+    def __init__(self, temp_dir: str, task_manager, temp_quota: Optional[int] = None,
+                 output_quota: Optional[int] = None, reap_interval: Optional[float] = None):
+        self.temp_dir = temp_dir
+        self.task_manager = task_manager
+        self.output_dir = task_manager.output_dir
+        self.temp_quota = (TEMP_QUOTA if temp_quota is None else temp_quota) * 1024 * 1024
+        self.output_quota = (OUTPUT_QUOTA if output_quota is None else output_quota) * 1024 * 1024
+        self.reap_interval = reap_interval or REAP_INTERVAL
+        self.cleanups: List[Callable[[], None]] = []
+        self.claims: List[Callable[[], Iterable[str]]] = []
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add_cleanup(self, cleanup: Callable[[], None]) -> None:
+        """Register a callback run on every reaper pass"""
+        self.cleanups.append(cleanup)
+
+    def add_claim(self, claim: Callable[[], Iterable[str]]) -> None:
+        """Register a callback listing files that are in use although no task owns them"""
+        self.claims.append(claim)
+
+    def start(self) -> None:
+        """Start the background reaper; its first pass runs immediately"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="storage-reaper", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.reap()
+            except Exception as e:
+                logger.error(f"Error reaping storage: {e}")
+            self._stop.wait(self.reap_interval)
+
+    def _task_files(self, task: Dict) -> List[str]:
+        paths = [os.path.join(self.output_dir, task["output_filename"])]
+        if task.get("preview_filename"):
+            paths.append(os.path.join(self.output_dir, task["preview_filename"]))
+        if task.get("stream_dirname"):
+            paths.append(os.path.join(self.output_dir, task["stream_dirname"]))
+        return paths
+
+    def usage(self) -> Dict[str, int]:
+        """Bytes used by uploads in TEMP_DIR and by task outputs; outputs sharing an inode count once"""
+        output_bytes = 0
+        seen = set()
+        for task in self.task_manager.get_all_tasks():
+            for path in self._task_files(task):
+                try:
+                    output_bytes += _disk_usage(path, seen)
+                except OSError:
+                    pass
+        return {"temp": directory_size(self.temp_dir), "output": output_bytes}
+
+    def ensure_temp_space(self, incoming_bytes: int) -> None:
+        """Raise StorageQuotaError unless incoming_bytes more fit in TEMP_DIR, reaping orphans first if needed"""
+        if not self.temp_quota:
+            return
+        if directory_size(self.temp_dir) + incoming_bytes <= self.temp_quota:
+            return
+        self.reap_orphans()
+        used = directory_size(self.temp_dir)
+        if used + incoming_bytes > self.temp_quota:
+            raise StorageQuotaError(
+                f"Temporary storage is full ({used} of {self.temp_quota} bytes used)"
+            )
+
+    def reap(self) -> None:
+        """One reaper pass: old tasks, orphans, then the output quota"""
+        self.task_manager.cleanup_old_tasks(TASK_MAX_AGE_HOURS)
+        for cleanup in self.cleanups:
+            cleanup()
+        self.reap_orphans()
+        self.enforce_output_quota()
+
+    def reap_orphans(self) -> int:
+        """Remove unclaimed temp files, outputs and scratch directories older than ORPHAN_MAX_AGE"""
+        cutoff = time.time() - ORPHAN_MAX_AGE
+        tasks = self.task_manager.get_all_tasks()
+        claimed = set()
+        for task in tasks:
+            claimed.update(os.path.abspath(path) for path in task.get("temp_inputs") or [])
+            claimed.update(os.path.abspath(path) for path in self._task_files(task))
+        for claim in self.claims:
+            claimed.update(os.path.abspath(path) for path in claim())
+
+        freed = 0
+        candidates = [(self.temp_dir, None)]
+        # Only task outputs live at the top of OUTPUT_DIR; sources and the cache have their own upkeep
+        candidates.append((self.output_dir, ("output_", "preview_")))
+        for directory, prefixes in candidates:
+            for entry in os.scandir(directory):
+                if not entry.is_file() or (prefixes and not entry.name.startswith(prefixes)):
+                    continue
+                if os.path.abspath(entry.path) in claimed:
+                    continue
+                try:
+                    if entry.stat().st_mtime < cutoff:
+                        freed += _remove(entry.path, "orphan")
+                except OSError:
+                    pass
+
+        # Scratch directories of jobs that died without cleaning up
+        scratch_root = SCRATCH_DIR or tempfile.gettempdir()
+        if os.path.isdir(scratch_root):
+            for entry in os.scandir(scratch_root):
+                if entry.name.startswith(SCRATCH_PREFIX) and entry.is_dir():
+                    try:
+                        if _last_modified(entry.path) < cutoff:
+                            freed += _remove(entry.path, "scratch")
+                    except OSError:
+                        pass
+        return freed
+
+    def enforce_output_quota(self) -> int:
+        """Evict completed outputs until OUTPUT_DIR is within its quota"""
+        if not self.output_quota:
+            return 0
+        used = self.usage()["output"]
+        if used <= self.output_quota:
+            return 0
+
+        # Least downloaded first, then least recently used
+        completed = [
+            task for task in self.task_manager.get_all_tasks()
+            if task["status"] == TaskStatus.COMPLETED.value and not task.get("evicted")
+        ]
+        completed.sort(key=lambda task: (
+            task.get("downloads", 0),
+            task.get("last_downloaded_at") or task["created_at"]
+        ))
+        freed = 0
+        for task in completed:
+            if used - freed <= self.output_quota:
+                break
+            # The cache entry is a hard link to the output, which only frees its disk once both are gone
+            result_cache = self.task_manager.result_cache
+            if result_cache and task.get("cache_key"):
+                result_cache.remove(task["cache_key"])
+            for path in self._task_files(task):
+                if os.path.exists(path):
+                    freed += _remove(path, "quota")
+            self.task_manager.update_task(task["id"], evicted=True)
+            logger.info(f"Evicted output of task {task['id']} to stay within the output quota")
+        return freed
@@ -0,0 +1,168 @@
+import os
+import time
+import queue
+import logging
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Frames each queue between pipeline stages holds; peak memory is bounded by
+# this, not by clip length
+PIPELINE_QUEUE_DEPTH = int(os.getenv('PIPELINE_QUEUE_DEPTH', '4'))
+
+# Seconds a blocked stage waits before checking whether the pipeline stopped
+_POLL_SECONDS = 0.1
+
+_END = object()
+
+
+class PipelineStopped(Exception):
+    """Raised inside a stage when the pipeline is stopping early"""
+
+
+class FramePool:
+    """
+    Fixed set of preallocated frame buffers of one shape.
+
+    Stages take a buffer, fill it and pass it on; the last stage gives it
+    back. Frames are never allocated per frame, and a stage that gets
+    ahead blocks once every buffer is in flight.
+    """
+
+    def __init__(self, shape: Tuple[int, ...], count: int, stop: threading.Event):
+        self.shape = shape
+        self._stop = stop
+        self._free: "queue.Queue[np.ndarray]" = queue.Queue()
+        for _ in range(count):
+            self._free.put(np.empty(shape, dtype=np.uint8))
+
+    def acquire(self) -> np.ndarray:
+        while True:
+            try:
+                return self._free.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                if self._stop.is_set():
+                    raise PipelineStopped()
+
+    def release(self, frame: np.ndarray) -> None:
+        self._free.put(frame)
+
+
+class FramePipeline:
+    """
+    Runs a frame source and a chain of stages on their own threads.
+
+    The stages are connected by queues holding PIPELINE_QUEUE_DEPTH items.
+    The source is an iterable, and each stage is a function applied to
+    every item in order. OpenCV, NumPy and pipe writes release the GIL, so
+    decoding, scaling and encoding overlap on separate cores. run() blocks
+    until the last item has passed the last stage. It calls on_poll
+    regularly from the calling thread, which can report progress from
+    there. If should_cancel returns true, or a stage raises, the pipeline
+    stops early.
+    """
+
+    def __init__(self, depth: Optional[int] = None):
+        self.depth = depth or PIPELINE_QUEUE_DEPTH
+        self.stop = threading.Event()
+        # Seconds each stage spent working rather than waiting on its neighbours
+        self.busy: Dict[str, float] = {}
+        self._errors: List[BaseException] = []
+
+    def make_pool(self, shape: Tuple[int, ...], stages: int = 3) -> FramePool:
+        """A pool large enough to fill every queue, plus one frame in the hands of each stage"""
+        return FramePool(shape, self.depth * (stages - 1) + stages, self.stop)
+
+    def _put(self, q: queue.Queue, item) -> None:
+        # Checked up front too, since stages that keep up never block on a queue
+        while True:
+            if self.stop.is_set():
+                raise PipelineStopped()
+            try:
+                q.put(item, timeout=_POLL_SECONDS)
+                return
+            except queue.Full:
+                if self.stop.is_set():
+                    raise PipelineStopped()
+
+    def _get(self, q: queue.Queue):
+        while True:
+            if self.stop.is_set():
+                raise PipelineStopped()
+            try:
+                return q.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                if self.stop.is_set():
+                    raise PipelineStopped()
+
+    def _guard(self, name: str, body: Callable[[], None]) -> None:
+        self.busy[name] = 0.0
+        try:
+            body()
+        except PipelineStopped:
+            pass
+        except BaseException as e:
+            logger.error(f"Pipeline stage {name} failed: {e}")
+            self._errors.append(e)
+            self.stop.set()
+
+    def _run_source(self, name: str, source: Iterable, out: queue.Queue) -> None:
+        iterator = iter(source)
+        while True:
+            started = time.perf_counter()
+            item = next(iterator, _END)
+            self.busy[name] += time.perf_counter() - started
+            self._put(out, item)
+            if item is _END:
+                return
+
+    def _run_stage(self, name: str, work: Callable, inbox: queue.Queue, out: Optional[queue.Queue]) -> None:
+        while True:
+            item = self._get(inbox)
+            if item is not _END:
+                started = time.perf_counter()
+                item = work(item)
+                self.busy[name] += time.perf_counter() - started
+            if out is not None:
+                self._put(out, item)
+            if item is _END:
+                return
+
+    def run(self, source: Tuple[str, Iterable], stages: List[Tuple[str, Callable]],
+            should_cancel: Optional[Callable[[], bool]] = None,
+            on_poll: Optional[Callable[[], None]] = None) -> None:
+        queues = [queue.Queue(maxsize=self.depth) for _ in stages]
+        threads = [threading.Thread(target=self._guard, args=(source[0], lambda: self._run_source(*source, queues[0])),
+                                    name=f"pipeline-{source[0]}", daemon=True)]
+        for i, (name, work) in enumerate(stages):
+            out = queues[i + 1] if i + 1 < len(stages) else None
+            threads.append(threading.Thread(
+                target=self._guard,
+                args=(name, lambda name=name, work=work, inbox=queues[i], out=out: self._run_stage(name, work, inbox, out)),
+                name=f"pipeline-{name}", daemon=True
+            ))
+        for thread in threads:
+            thread.start()
+
+        cancelled = False
+        try:
+            while any(thread.is_alive() for thread in threads):
+                threads[-1].join(timeout=0.5)
+                if on_poll:
+                    on_poll()
+                if not cancelled and should_cancel and should_cancel():
+                    cancelled = True
+                    self.stop.set()
+        finally:
+            self.stop.set()
+            for thread in threads:
+                thread.join()
+
+        if self._errors:
+            raise self._errors[0]
+        if cancelled:
+            from job_executor import JobCancelledError
+            raise JobCancelledError("Stitching cancelled")
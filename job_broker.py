@@ -0,0 +1,451 @@
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from queue_manager import JobScheduler
+
+logger = logging.getLogger(__name__)
+
+# Broker shared by the API and the encoder workers, e.g. sqlite:////shared/broker.db on
+# a filesystem with working POSIX locks; empty runs jobs in a process pool inside the API process
+BROKER_URL = os.getenv('BROKER_URL', '')
+
+# Seconds between worker heartbeats, and after which a silent worker counts as dead
+WORKER_HEARTBEAT_INTERVAL = float(os.getenv('WORKER_HEARTBEAT_INTERVAL', '5'))
+WORKER_TIMEOUT = float(os.getenv('WORKER_TIMEOUT', '30'))
+
+# Times a job is handed to a worker before a dead worker fails it instead of requeueing it
+MAX_JOB_ATTEMPTS = int(os.getenv('MAX_JOB_ATTEMPTS', '3'))
+
+# Seconds undelivered events are kept for a submitter that never comes back
+EVENT_TTL = 24 * 3600
+
+
+class JobState:
+    PENDING = "pending"
+    RUNNING = "running"
+
+
+class JobBroker:
+    """
+    Queue of jobs shared by API processes and encoder workers.
+
+    API processes enqueue jobs and read back the events of the jobs they
+    submitted; workers claim jobs, heartbeat while running them and report
+    events and the outcome. A job is a dict with its "id", "task_id", the
+    job function as "module:name", JSON arguments, scheduling fields and
+    its "state". At most one job exists per task. Every method is safe to
+    call from any thread and any process.
+    """
+
+    def enqueue(self, task_id: str, fn: str, args: List, priority: str, client_id: Optional[str],
+                submitter: str, max_jobs: int) -> Optional[Dict]:
+        """Add a pending job; None if max_jobs jobs are already pending or running"""
+        raise NotImplementedError
+
+    def get_job(self, task_id: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def adopt(self, task_id: str, submitter: str) -> Optional[Dict]:
+        """Redirect the job of a task and its undelivered events to a new submitter; None if there is no job"""
+        raise NotImplementedError
+
+    def adopted_away(self, task_ids: List[str], submitter: str) -> List[str]:
+        """Those of task_ids whose jobs now belong to another submitter"""
+        raise NotImplementedError
+
+    def claim(self, worker_id: str) -> Optional[Dict]:
+        """Hand the pending job the scheduler picks to a worker; None if nothing is waiting"""
+        raise NotImplementedError
+
+    def heartbeat(self, worker_id: str, slots: int) -> None:
+        """Record that a worker running up to slots jobs at once is alive, and keep its jobs from going stale"""
+        raise NotImplementedError
+
+    def remove_worker(self, worker_id: str) -> None:
+        raise NotImplementedError
+
+    def add_event(self, job_id: str, kind: str, data: Dict) -> None:
+        """Queue an event of a job for its submitter"""
+        raise NotImplementedError
+
+    def fetch_events(self, submitter: str) -> List[Tuple[str, str, Dict]]:
+        """Take the (task_id, kind, data) events waiting for a submitter, oldest first"""
+        raise NotImplementedError
+
+    def finish(self, job_id: str, worker_id: str, outcome: Dict) -> bool:
+        """
+        Remove a job a worker ran, sending its outcome as a "done" event.
+
+        outcome has "result", or "error" and "cancelled". Returns False if
+        the job was meanwhile taken from the worker.
+        """
+        raise NotImplementedError
+
+    def cancel(self, job_id: str) -> bool:
+        """Drop a pending job and return True, or flag a running one for its worker to stop"""
+        raise NotImplementedError
+
+    def is_cancel_requested(self, job_id: str, worker_id: str) -> bool:
+        """Whether a worker should stop a job: it was cancelled, or it was taken from the worker"""
+        raise NotImplementedError
+
+    def requeue_stale(self) -> None:
+        """Requeue the jobs of workers silent for WORKER_TIMEOUT, failing those out of attempts"""
+        raise NotImplementedError
+
+    def counts(self) -> Dict[str, int]:
+        """Pending and running jobs, and the job slots of live workers"""
+        raise NotImplementedError
+
+    def snapshot(self) -> Dict:
+        """Live workers, running jobs and waiting jobs with their queue estimates"""
+        raise NotImplementedError
+
+
+class SQLiteBroker(JobBroker):
+    """
+    Broker in one SQLite file with a rollback journal.
+
+    Every API process and worker that opens the same file shares the
+    queue, so the file must sit on storage they all see with working
+    POSIX locks, e.g. NFSv4 with locking enabled. WAL mode is not used
+    since its shared-memory index only works among processes on one
+    host. Claims run in an immediate transaction that rebuilds a
+    JobScheduler from the waiting jobs and the stored fair-share usage,
+    so priority classes, aging and fair sharing work as in a single
+    process. Each thread gets its own connection.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            task_id TEXT NOT NULL UNIQUE,
+            fn TEXT NOT NULL,
+            args TEXT NOT NULL,
+            priority TEXT NOT NULL,
+            client_id TEXT,
+            submitter TEXT NOT NULL,
+            state TEXT NOT NULL,
+            worker_id TEXT,
+            enqueued_at REAL NOT NULL,
+            started_at REAL,
+            heartbeat_at REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            cancel_requested INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs(state);
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            task_id TEXT NOT NULL,
+            submitter TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            data TEXT NOT NULL,
+            created_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_events_submitter ON events(submitter, id);
+        CREATE TABLE IF NOT EXISTS workers (
+            id TEXT PRIMARY KEY,
+            host TEXT NOT NULL,
+            slots INTEGER NOT NULL,
+            started_at REAL NOT NULL,
+            heartbeat_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS scheduler (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            state TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._connect().executescript(self.SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            # WAL breaks on network filesystems; keep the default full sync with a rollback journal
+            conn.execute("PRAGMA journal_mode=DELETE")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        return conn
+
+    @staticmethod
+    def _row_to_job(row: sqlite3.Row) -> Dict:
+        job = dict(row)
+        job["args"] = json.loads(job["args"])
+        job["cancel_requested"] = bool(job["cancel_requested"])
+        return job
+
+    @staticmethod
+    def _insert_event(conn: sqlite3.Connection, job: Dict, kind: str, data: Dict) -> None:
+        conn.execute(
+            "INSERT INTO events (task_id, submitter, kind, data, created_at) VALUES (?, ?, ?, ?, ?)",
+            (job["task_id"], job["submitter"], kind, json.dumps(data), time.time())
+        )
+
+    def _scheduler(self, conn: sqlite3.Connection) -> JobScheduler:
+        """A scheduler holding every pending job, with the stored usage and average job length"""
+        scheduler = JobScheduler()
+        row = conn.execute("SELECT state FROM scheduler WHERE id = 1").fetchone()
+        if row:
+            scheduler.import_state(json.loads(row["state"]))
+        for job in conn.execute("SELECT * FROM jobs WHERE state = ?", (JobState.PENDING,)):
+            scheduler.push(job["task_id"], job["priority"], job["client_id"], enqueued_at=job["enqueued_at"],
+                           job_id=job["id"])
+        return scheduler
+
+    @staticmethod
+    def _save_scheduler(conn: sqlite3.Connection, scheduler: JobScheduler) -> None:
+        conn.execute("INSERT OR REPLACE INTO scheduler (id, state) VALUES (1, ?)", (json.dumps(scheduler.export_state()),))
+
+    def _live_workers(self, conn: sqlite3.Connection) -> List[Dict]:
+        cutoff = time.time() - WORKER_TIMEOUT
+        return [dict(row) for row in conn.execute("SELECT * FROM workers WHERE heartbeat_at >= ? ORDER BY id", (cutoff,))]
+
+    def enqueue(self, task_id, fn, args, priority, client_id, submitter, max_jobs):
+        conn = self._transaction()
+        try:
+            (active,) = conn.execute("SELECT COUNT(*) FROM jobs").fetchone()
+            if active >= max_jobs:
+                conn.execute("ROLLBACK")
+                return None
+            job_id = str(uuid.uuid4())
+            conn.execute(
+                "INSERT INTO jobs (id, task_id, fn, args, priority, client_id, submitter, state, enqueued_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, task_id, fn, json.dumps(args), priority, client_id or "anonymous", submitter,
+                 JobState.PENDING, time.time())
+            )
+            job = self._row_to_job(conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+            conn.execute("COMMIT")
+            return job
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get_job(self, task_id):
+        row = self._connect().execute("SELECT * FROM jobs WHERE task_id = ?", (task_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def adopt(self, task_id, submitter):
+        conn = self._transaction()
+        try:
+            conn.execute("UPDATE jobs SET submitter = ? WHERE task_id = ?", (submitter, task_id))
+            conn.execute("UPDATE events SET submitter = ? WHERE task_id = ?", (submitter, task_id))
+            row = conn.execute("SELECT * FROM jobs WHERE task_id = ?", (task_id,)).fetchone()
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return self._row_to_job(row) if row else None
+
+    def adopted_away(self, task_ids, submitter):
+        if not task_ids:
+            return []
+        rows = self._connect().execute(
+            f"SELECT task_id FROM jobs WHERE submitter != ? AND task_id IN ({','.join('?' * len(task_ids))})",
+            (submitter, *task_ids)
+        )
+        return [row["task_id"] for row in rows]
+
+    def claim(self, worker_id):
+        conn = self._transaction()
+        try:
+            scheduler = self._scheduler(conn)
+            entry = scheduler.pop_next()
+            if entry is None:
+                conn.execute("ROLLBACK")
+                return None
+            now = time.time()
+            conn.execute(
+                "UPDATE jobs SET state = ?, worker_id = ?, started_at = ?, heartbeat_at = ?, attempts = attempts + 1"
+                " WHERE id = ?",
+                (JobState.RUNNING, worker_id, now, now, entry["job_id"])
+            )
+            self._save_scheduler(conn, scheduler)
+            job = self._row_to_job(conn.execute("SELECT * FROM jobs WHERE id = ?", (entry["job_id"],)).fetchone())
+            conn.execute("COMMIT")
+            return job
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def heartbeat(self, worker_id, slots):
+        conn = self._transaction()
+        try:
+            now = time.time()
+            conn.execute(
+                "INSERT INTO workers (id, host, slots, started_at, heartbeat_at) VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT(id) DO UPDATE SET slots = excluded.slots, heartbeat_at = excluded.heartbeat_at",
+                (worker_id, socket.gethostname(), slots, now, now)
+            )
+            conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE worker_id = ? AND state = ?",
+                         (now, worker_id, JobState.RUNNING))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def remove_worker(self, worker_id):
+        self._connect().execute("DELETE FROM workers WHERE id = ?", (worker_id,))
+
+    def add_event(self, job_id, kind, data):
+        conn = self._connect()
+        row = conn.execute("SELECT task_id, submitter FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row:
+            self._insert_event(conn, dict(row), kind, data)
+
+    def fetch_events(self, submitter):
+        conn = self._transaction()
+        try:
+            rows = conn.execute("SELECT * FROM events WHERE submitter = ? ORDER BY id", (submitter,)).fetchall()
+            if rows:
+                conn.execute("DELETE FROM events WHERE submitter = ? AND id <= ?", (submitter, rows[-1]["id"]))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return [(row["task_id"], row["kind"], json.loads(row["data"])) for row in rows]
+
+    def finish(self, job_id, worker_id, outcome):
+        conn = self._transaction()
+        try:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ? AND worker_id = ? AND state = ?",
+                               (job_id, worker_id, JobState.RUNNING)).fetchone()
+            if row is None:
+                conn.execute("ROLLBACK")
+                return False
+            job = self._row_to_job(row)
+            # Only completed runs say how long a job takes
+            if "result" in outcome:
+                scheduler = self._scheduler(conn)
+                scheduler.record_duration(time.time() - job["started_at"])
+                self._save_scheduler(conn, scheduler)
+            self._insert_event(conn, job, "done", outcome)
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            conn.execute("COMMIT")
+            return True
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def cancel(self, job_id):
+        conn = self._transaction()
+        try:
+            cursor = conn.execute("DELETE FROM jobs WHERE id = ? AND state = ?", (job_id, JobState.PENDING))
+            if cursor.rowcount == 0:
+                conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+            conn.execute("COMMIT")
+            return cursor.rowcount > 0
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def is_cancel_requested(self, job_id, worker_id):
+        row = self._connect().execute("SELECT worker_id, cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row is None or row["worker_id"] != worker_id or bool(row["cancel_requested"])
+
+    def requeue_stale(self):
+        conn = self._transaction()
+        try:
+            now = time.time()
+            stale = conn.execute("SELECT * FROM jobs WHERE state = ? AND heartbeat_at < ?",
+                                 (JobState.RUNNING, now - WORKER_TIMEOUT)).fetchall()
+            for row in map(self._row_to_job, stale):
+                if row["cancel_requested"] or row["attempts"] >= MAX_JOB_ATTEMPTS:
+                    error = f"Worker {row['worker_id']} stopped responding"
+                    if row["attempts"] > 1:
+                        error += f" on all {row['attempts']} attempts"
+                    self._insert_event(conn, row, "done", {"error": error, "cancelled": row["cancel_requested"]})
+                    conn.execute("DELETE FROM jobs WHERE id = ?", (row["id"],))
+                    logger.warning(f"Failed task {row['task_id']}: {error}")
+                    continue
+                conn.execute(
+                    "UPDATE jobs SET state = ?, worker_id = NULL, started_at = NULL, heartbeat_at = NULL WHERE id = ?",
+                    (JobState.PENDING, row["id"])
+                )
+                self._insert_event(conn, row, "progress", {"stage": "queued", "progress": 0})
+                logger.warning(f"Requeued task {row['task_id']} from unresponsive worker {row['worker_id']}")
+            conn.execute("DELETE FROM workers WHERE heartbeat_at < ?", (now - WORKER_TIMEOUT,))
+            conn.execute("DELETE FROM events WHERE created_at < ?", (now - EVENT_TTL,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def counts(self):
+        conn = self._connect()
+        counts = {JobState.PENDING: 0, JobState.RUNNING: 0}
+        for row in conn.execute("SELECT state, COUNT(*) AS n FROM jobs GROUP BY state"):
+            counts[row["state"]] = row["n"]
+        counts["slots"] = sum(worker["slots"] for worker in self._live_workers(conn))
+        return counts
+
+    def snapshot(self):
+        conn = self._connect()
+        workers = self._live_workers(conn)
+        running = [
+            self._row_to_job(row)
+            for row in conn.execute("SELECT * FROM jobs WHERE state = ? ORDER BY started_at", (JobState.RUNNING,))
+        ]
+        scheduler = self._scheduler(conn)
+        slots = sum(worker["slots"] for worker in workers)
+        # With no worker up yet, estimate as if one were about to start
+        estimates = scheduler.estimates([job["started_at"] for job in running], max(1, slots))
+        pending = {job["task_id"]: job for job in scheduler.order()}
+        for worker in workers:
+            worker["running"] = [job["task_id"] for job in running if job["worker_id"] == worker["id"]]
+        return {
+            "workers": slots,
+            "nodes": workers,
+            "average_job_seconds": round(scheduler.average_job_seconds, 1),
+            "running": [
+                {"task_id": job["task_id"], "priority": job["priority"], "client_id": job["client_id"],
+                 "started_at": job["started_at"], "worker_id": job["worker_id"]}
+                for job in running
+            ],
+            "queued": [
+                dict(estimate, priority=pending[estimate["task_id"]]["priority"],
+                     client_id=pending[estimate["task_id"]]["client_id"])
+                for estimate in estimates
+            ],
+        }
+
+
+_brokers: Dict[str, JobBroker] = {}
+_brokers_lock = threading.Lock()
+
+
+def create_broker(url: str) -> JobBroker:
+    """
+    The broker at url, shared within this process.
+
+    sqlite:///relative/path.db and sqlite:////absolute/path.db are
+    supported. Other backends, such as a Redis-backed queue, implement
+    JobBroker and are added here.
+    """
+    with _brokers_lock:
+        if url not in _brokers:
+            scheme, _, path = url.partition("://")
+            if scheme != "sqlite" or not path.startswith("/"):
+                raise ValueError(f"Unsupported BROKER_URL '{url}', expected sqlite:///path/to/broker.db")
+            _brokers[url] = SQLiteBroker(path[1:])
+            logger.info(f"Using SQLite job broker at {path[1:]}")
+        return _brokers[url]
@@ -0,0 +1,720 @@
+import os
+import time
+import queue
+import socket
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, Future
+from typing import Callable, Dict, List, Optional
+
+from job_broker import BROKER_URL, WORKER_HEARTBEAT_INTERVAL, JobState, create_broker
+from queue_manager import DEFAULT_PRIORITY, PRIORITY_CLASSES, JobScheduler
+from warmup import WARM_POOL, warm_pool, warm_process
+
+logger = logging.getLogger(__name__)
+
+# Threads handed to each encoder; the default pool size divides the cores by this
+ENCODER_THREADS = int(os.getenv('ENCODER_THREADS', '4'))
+
+# Minimum seconds between progress events sent by a worker for one job
+PROGRESS_INTERVAL = float(os.getenv('PROGRESS_INTERVAL', '0.5'))
+
+# Seconds between reads of the broker for new events, and for the cancellation of a running job
+BROKER_POLL_INTERVAL = float(os.getenv('BROKER_POLL_INTERVAL', '0.5'))
+CANCEL_POLL_INTERVAL = 1.0
+
+# Share of overall progress reached at the start of each stage
+STAGE_PROGRESS = {"normalize": 0, "encode": 5, "mux": 95, "package": 96}
+
+
+def default_worker_count() -> int:
+    """Number of concurrent encodes that fit on this machine"""
+    return max(1, (os.cpu_count() or 1) // ENCODER_THREADS)
+
+
+class QueueFullError(Exception):
+    """Raised when the admission queue cannot take another job"""
+
+
+class JobCancelledError(Exception):
+    """Raised inside a worker when its job has been cancelled"""
+
+
+class JobContext:
+    """
+    Handle passed to every job function running in a worker process.
+
+    It is picklable (both members are manager proxies), so the worker can
+    check for cancellation and report events back to the API process.
+    """
+
+    def __init__(self, task_id: str, cancel_event, events):
+        self.task_id = task_id
+        self._cancel_event = cancel_event
+        self._events = events
+        self._last_progress = None
+        self._stage = None
+        self._encode_started = None
+
+    def is_cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def check_cancelled(self) -> None:
+        """Raise JobCancelledError if the job has been cancelled"""
+        if self.is_cancelled():
+            raise JobCancelledError(f"Task {self.task_id} was cancelled")
+
+    def report(self, kind: str, **data) -> None:
+        """Send an event for this job back to the API process"""
+        self._events.put((self.task_id, kind, data))
+
+    def progress(self, stage: str, done: int = 0, total: int = 0) -> None:
+        """
+        Report progress through a stage (normalize, encode, mux, package).
+
+        During encode and package, done and total count frames and are
+        turned into an overall percentage, and during encode an ETA. Events are throttled to one per
+        PROGRESS_INTERVAL except on stage changes and the final frame.
+        """
+        now = time.monotonic()
+        if total:
+            done = min(done, total)
+        stage_changed = stage != self._stage
+        finished = total and done >= total
+        if not stage_changed and not finished and self._last_progress and now - self._last_progress < PROGRESS_INTERVAL:
+            return
+        self._stage = stage
+        self._last_progress = now
+
+        percent = STAGE_PROGRESS.get(stage, 0)
+        eta = None
+        if stage == "encode":
+            if self._encode_started is None:
+                self._encode_started = now
+            if total:
+                fraction = min(done / total, 1.0)
+                percent += int(fraction * (STAGE_PROGRESS["mux"] - STAGE_PROGRESS["encode"]))
+                elapsed = now - self._encode_started
+                if done and elapsed > 0:
+                    eta = round(elapsed * (total - done) / done, 1)
+        elif stage == "package" and total:
+            percent += int(min(done / total, 1.0) * (99 - STAGE_PROGRESS["package"]))
+
+        self.report("progress", stage=stage, progress=percent, frames_done=done, frames_total=total, eta=eta)
+
+
+def create_stitcher(engine: str, wwe_path: str, fan_path: str, profile: Optional[str] = None,
+                    timeline: Optional[Dict] = None, checksums: Optional[Dict[str, str]] = None):
+    """Instantiate the stitcher for the given engine, encoding profile, compiled timeline and input checksums"""
+    # Imported lazily so the API process never loads OpenCV
+    if engine == "smart":
+        from smart_stitcher import SmartStitcher
+        return SmartStitcher(wwe_path, fan_path, profile, timeline, checksums)
+    if engine == "ffmpeg":
+        from ffmpeg_stitcher import FFmpegStitcher
+        return FFmpegStitcher(wwe_path, fan_path, profile, timeline, checksums)
+    # Tasks queued before the rename still name the frames engine moviepy
+    if engine in ("frames", "moviepy"):
+        from video_stitcher import VideoStitcher
+        return VideoStitcher(wwe_path, fan_path, profile, timeline, checksums)
+    raise ValueError(f"Unknown stitching engine: {engine}")
+
+
+def run_stitch_job(context: JobContext, wwe_path: str, fan_path: str, output_path: str,
+                   engine: str = "frames", profile: Optional[str] = None,
+                   timeline: Optional[Dict] = None, stream_dir: Optional[str] = None,
+                   checksums: Optional[Dict[str, str]] = None) -> str:
+    """
+    Stitch one pair of videos inside a worker process, then package the output for streaming into stream_dir.
+
+    checksums holds the SHA-256 of the inputs by source name where the API already knows it.
+    """
+    context.check_cancelled()
+    context.report("started", pid=os.getpid())
+
+    context.progress("normalize")
+    stitcher = create_stitcher(engine, wwe_path, fan_path, profile, timeline, checksums)
+    try:
+        stitcher.stitch_videos(output_path, should_cancel=context.is_cancelled, on_progress=context.progress)
+        if stream_dir:
+            from stream_packager import package_stream
+            context.progress("package")
+            stitcher.timer.start("package")
+            package_stream(output_path, stream_dir, stitcher.encoder_threads,
+                           should_cancel=context.is_cancelled, on_progress=context.progress)
+            stitcher.timer.stop()
+    finally:
+        # Failed and cancelled jobs report too, showing where their time went
+        context.report("timings", engine=engine, profile=stitcher.profile, timings=stitcher.timer.timings)
+    return output_path
+
+
+def run_package_job(context: JobContext, video_path: str, stream_dir: str, profile: Optional[str] = None) -> str:
+    """Package an existing output for streaming inside a worker process"""
+    from stitch_plan import output_settings
+    from stream_packager import package_stream
+    context.check_cancelled()
+    context.report("started", pid=os.getpid())
+
+    context.progress("package")
+    started = time.perf_counter()
+    try:
+        package_stream(video_path, stream_dir, output_settings(profile)["encoder_threads"],
+                       should_cancel=context.is_cancelled, on_progress=context.progress)
+    finally:
+        context.report("timings", engine=None, profile=profile,
+                       timings={"package": round(time.perf_counter() - started, 3)})
+    return stream_dir
+
+
+def _copy_outcome(pool_future: Future, future: Future) -> None:
+    """Settle a job's future with the outcome of its run in the pool"""
+    if pool_future.cancelled():
+        future.set_exception(JobCancelledError("Job was cancelled"))
+    elif pool_future.exception():
+        future.set_exception(pool_future.exception())
+    else:
+        future.set_result(pool_future.result())
+
+
+class JobExecutor:
+    """
+    Runs stitch jobs in a pool of worker processes behind a bounded admission queue.
+
+    At most ``max_workers`` jobs encode at once and at most ``max_queue_size``
+    more wait for a free worker; anything beyond that is refused with
+    QueueFullError so the API can answer with backpressure instead of piling
+    work onto the machine. Waiting jobs are held here rather than in the
+    pool, and a JobScheduler picks which one takes each worker that frees
+    up. A "queued" event carries the queue position and estimated start of
+    every waiting job whose estimate changed.
+
+    With WARM_POOL, start() also spawns every worker process in the
+    background and has each import the engines and check ffmpeg before
+    taking a job, so the first jobs after a deploy do not start cold.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, max_queue_size: Optional[int] = None):
+        self.max_workers = max_workers or int(os.getenv('MAX_WORKERS', str(default_worker_count())))
+        self.max_queue_size = max_queue_size if max_queue_size is not None else int(os.getenv('MAX_QUEUED_JOBS', '10'))
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._manager = None
+        self._events = None
+        self._event_thread: Optional[threading.Thread] = None
+        self._event_handlers: Dict[str, Callable] = {}
+        self._jobs: Dict[str, Dict] = {}
+        self._scheduler = JobScheduler()
+        self._lock = threading.Lock()
+        self._running = False
+        self._warmup: Optional[Dict] = None
+
+    def start(self) -> None:
+        """Start the worker pool and the event listener, and warm the pool in the background"""
+        if self._running:
+            return
+        # Spawn keeps workers from inheriting the event loop and server sockets
+        ctx = multiprocessing.get_context('spawn')
+        self._manager = ctx.Manager()
+        self._events = self._manager.Queue()
+        self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=ctx, initializer=warm_process)
+        self._running = True
+        self._event_thread = threading.Thread(target=self._event_loop, name="job-events", daemon=True)
+        self._event_thread.start()
+        if WARM_POOL:
+            threading.Thread(target=self._warm, name="pool-warmup", daemon=True).start()
+        logger.info(f"Job executor started with {self.max_workers} workers and a queue of {self.max_queue_size}")
+
+    def shutdown(self) -> None:
+        """Cancel outstanding jobs and stop the workers"""
+        if not self._running:
+            return
+        # Stop dispatching first; cancelling runs completion callbacks that take the lock
+        self._running = False
+        with self._lock:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            job["cancel_event"].set()
+            job["future"].cancel()
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        self._event_thread.join(timeout=5)
+        self._manager.shutdown()
+        logger.info("Job executor stopped")
+
+    def _warm(self) -> None:
+        warmup = warm_pool(self._pool, self.max_workers, self._manager)
+        if not self._running:
+            return
+        if warmup["errors"]:
+            logger.error(f"Encoder workers are not ready: {'; '.join(warmup['errors'])}")
+        else:
+            logger.info(f"Warmed {warmup['warm_workers']} encoder workers in {warmup['seconds']}s (ffmpeg {warmup['ffmpeg']})")
+        self._warmup = warmup
+
+    def readiness(self) -> Dict:
+        """Whether the pool is running and, with WARM_POOL, every worker is warm and can encode"""
+        warmup = self._warmup or {"warm_workers": 0, "seconds": None, "ffmpeg": None, "errors": []}
+        warm = self._warmup is not None and not warmup["errors"]
+        return dict(warmup, ready=self._running and (warm or not WARM_POOL), workers=self.max_workers)
+
+    def on_event(self, kind: str, handler: Callable[[str, Dict], None]) -> None:
+        """Register a handler called as handler(task_id, data) for worker events"""
+        self._event_handlers[kind] = handler
+
+    @property
+    def capacity(self) -> int:
+        return self.max_workers + self.max_queue_size
+
+    def active_jobs(self) -> int:
+        """Jobs that are queued or running"""
+        with self._lock:
+            return len(self._jobs)
+
+    def running_jobs(self) -> int:
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job["future"].running())
+
+    def _started_jobs(self) -> List[Dict]:
+        return [job for job in self._jobs.values() if job.get("started_at")]
+
+    def snapshot(self) -> Dict:
+        """Running and waiting jobs, the latter in the order they will start"""
+        with self._lock:
+            running = [
+                {"task_id": task_id, "priority": job["priority"], "client_id": job["client_id"],
+                 "started_at": job["started_at"]}
+                for task_id, job in self._jobs.items() if job.get("started_at")
+            ]
+            estimates = self._scheduler.estimates([job["started_at"] for job in self._started_jobs()], self.max_workers)
+            queued = [
+                dict(estimate, priority=self._jobs[estimate["task_id"]]["priority"],
+                     client_id=self._jobs[estimate["task_id"]]["client_id"])
+                for estimate in estimates
+            ]
+        return {
+            "workers": self.max_workers,
+            "capacity": self.capacity,
+            "average_job_seconds": round(self._scheduler.average_job_seconds, 1),
+            "running": running,
+            "queued": queued,
+        }
+
+    def has_capacity(self) -> bool:
+        return self.active_jobs() < self.capacity
+
+    def has_idle_worker(self) -> bool:
+        """Whether a new job would start right away rather than wait in the queue"""
+        return self.active_jobs() < self.max_workers
+
+    def holds(self, task_id: str) -> bool:
+        """Whether a job for the task is queued or running"""
+        with self._lock:
+            return task_id in self._jobs
+
+    def submit(self, task_id: str, fn: Callable, *args, on_done: Optional[Callable[[str, Future], None]] = None,
+               priority: str = DEFAULT_PRIORITY, client_id: Optional[str] = None) -> Future:
+        """
+        Queue fn(context, *args) for a worker process.
+
+        priority is one of queue_manager.PRIORITY_CLASSES and client_id
+        identifies the submitter for fair sharing. on_done(task_id, future)
+        is called from a background thread once the job finishes, fails or
+        is cancelled.
+        """
+        if not self._running:
+            raise RuntimeError("Job executor is not running")
+
+        future: Future = Future()
+        with self._lock:
+            if task_id in self._jobs:
+                raise ValueError(f"Task {task_id} is already queued")
+            if len(self._jobs) >= self.capacity:
+                raise QueueFullError(f"Job queue is full ({self.capacity} jobs)")
+
+            cancel_event = self._manager.Event()
+            job = self._scheduler.push(task_id, priority, client_id, fn=fn, args=args)
+            self._jobs[task_id] = {
+                "future": future,
+                "cancel_event": cancel_event,
+                "priority": job["priority"],
+                "client_id": job["client_id"],
+                "started_at": None,
+            }
+
+        def _done(fut: Future):
+            with self._lock:
+                job = self._jobs.pop(task_id, None)
+                self._scheduler.remove(task_id)
+                # Only completed runs say how long a job takes
+                if job and job["started_at"] and not fut.cancelled() and not fut.exception():
+                    self._scheduler.record_duration(time.time() - job["started_at"])
+            self._dispatch()
+            if on_done:
+                try:
+                    on_done(task_id, fut)
+                except Exception as e:
+                    logger.error(f"Error in completion handler for task {task_id}: {e}")
+
+        future.add_done_callback(_done)
+        logger.info(f"Queued task {task_id} with priority {priority} ({self.active_jobs()}/{self.capacity} slots used)")
+        self._dispatch()
+        return future
+
+    def _dispatch(self) -> None:
+        """Hand waiting jobs to free workers in scheduler order, then publish the new estimates"""
+        starting = []
+        with self._lock:
+            while self._running and len(self._started_jobs()) < self.max_workers:
+                entry = self._scheduler.pop_next()
+                if entry is None:
+                    break
+                job = self._jobs.get(entry["task_id"])
+                # Jobs cancelled while waiting are dropped here
+                if job is None or not job["future"].set_running_or_notify_cancel():
+                    continue
+                job["started_at"] = time.time()
+                starting.append((job, entry))
+
+            estimates = self._scheduler.estimates([job["started_at"] for job in self._started_jobs()], self.max_workers)
+            changed = []
+            for estimate in estimates:
+                job = self._jobs[estimate["task_id"]]
+                previous = job.get("estimate")
+                # Small drifts of the estimate are not worth an event
+                if (not previous or previous["queue_position"] != estimate["queue_position"]
+                        or abs(previous["estimated_start"] - estimate["estimated_start"]) >= 5):
+                    job["estimate"] = estimate
+                    changed.append(estimate)
+
+        # Settling a job's future runs its completion callback, which takes the lock
+        for job, entry in starting:
+            context = JobContext(entry["task_id"], job["cancel_event"], self._events)
+            try:
+                pool_future = self._pool.submit(entry["fn"], context, *entry["args"])
+            except Exception as e:
+                logger.error(f"Could not start task {entry['task_id']}: {e!r}")
+                job["future"].set_exception(e)
+                continue
+            pool_future.add_done_callback(lambda pf, future=job["future"]: _copy_outcome(pf, future))
+
+        handler = self._event_handlers.get("queued")
+        if handler:
+            for estimate in changed:
+                try:
+                    handler(estimate["task_id"], estimate)
+                except Exception as e:
+                    logger.error(f"Error handling queued event for task {estimate['task_id']}: {e}")
+
+    def cancel(self, task_id: str) -> bool:
+        """
+        Cancel a waiting or running job.
+
+        Waiting jobs are dropped immediately; running jobs are signalled and
+        stop at their next cancellation check.
+        """
+        with self._lock:
+            job = self._jobs.get(task_id)
+        if not job:
+            return False
+        job["cancel_event"].set()
+        job["future"].cancel()
+        logger.info(f"Cancellation requested for task {task_id}")
+        return True
+
+    def _event_loop(self) -> None:
+        while self._running:
+            try:
+                task_id, kind, data = self._events.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                break
+            handler = self._event_handlers.get(kind)
+            if handler:
+                try:
+                    handler(task_id, data)
+                except Exception as e:
+                    logger.error(f"Error handling {kind} event for task {task_id}: {e}")
+
+
+class JobFailedError(Exception):
+    """Raised from the future of a job that failed on a remote worker"""
+
+
+class BrokerJobContext(JobContext):
+    """
+    JobContext of a job a worker claimed from a broker.
+
+    Events are written to the broker for the API process that submitted
+    the job. Cancellation is read from the broker at most once every
+    CANCEL_POLL_INTERVAL seconds, since encoders check it on every frame.
+    """
+
+    def __init__(self, task_id: str, job_id: str, worker_id: str, broker_url: str):
+        super().__init__(task_id, None, None)
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.broker_url = broker_url
+        self._cancelled = False
+        self._cancel_checked = None
+
+    def is_cancelled(self) -> bool:
+        now = time.monotonic()
+        if not self._cancelled and (self._cancel_checked is None or now - self._cancel_checked >= CANCEL_POLL_INTERVAL):
+            self._cancel_checked = now
+            self._cancelled = create_broker(self.broker_url).is_cancel_requested(self.job_id, self.worker_id)
+        return self._cancelled
+
+    def report(self, kind: str, **data) -> None:
+        create_broker(self.broker_url).add_event(self.job_id, kind, data)
+
+
+class RemoteJobExecutor:
+    """
+    Queues jobs on a broker for worker processes on any node to run.
+
+    It has the interface of JobExecutor, so the API does not care where
+    jobs run. Jobs are enqueued with their function and JSON arguments;
+    the workers (python -m video_stitcher worker) claim them in scheduler
+    order. A background thread reads the events of this process's jobs
+    from the broker, settles their futures when a "done" event arrives and
+    passes the rest to the registered handlers. It also requeues the jobs
+    of workers that stopped heartbeating, and publishes queue estimates.
+    Jobs keep running when this process stops; the next API process
+    adopts them while recovering its tasks.
+
+    Capacity is the job slots of the live workers plus max_queue_size, so
+    the queue still takes work while encoder nodes are scaling up. A
+    "workers" event with no task fires whenever the number of live slots
+    changes.
+    """
+
+    def __init__(self, broker_url: str, max_queue_size: Optional[int] = None):
+        self.broker_url = broker_url
+        self.max_queue_size = max_queue_size if max_queue_size is not None else int(os.getenv('MAX_QUEUED_JOBS', '10'))
+        self.submitter = f"{socket.gethostname()}:{os.getpid()}"
+        self._broker = create_broker(broker_url)
+        self._thread: Optional[threading.Thread] = None
+        self._event_handlers: Dict[str, Callable] = {}
+        self._jobs: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._running = False
+        self._slots = 0
+
+    def start(self) -> None:
+        """Start reading events from the broker"""
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._poll_loop, name="job-broker", daemon=True)
+        self._thread.start()
+        logger.info(f"Job executor queueing on broker {self.broker_url} as {self.submitter}")
+
+    def shutdown(self) -> None:
+        """Stop reading events; queued and running jobs are left for the next API process to adopt"""
+        if not self._running:
+            return
+        self._running = False
+        self._thread.join(timeout=5)
+        logger.info("Job executor stopped")
+
+    def readiness(self) -> Dict:
+        """
+        Whether the broker answers. Jobs encode on the worker nodes, which
+        warm their pools before they offer slots, so workers is the number
+        of warm job slots.
+        """
+        try:
+            slots = self._broker.counts()["slots"]
+        except Exception as e:
+            return {"ready": False, "workers": 0, "errors": [f"Broker is unreachable: {e}"]}
+        return {"ready": self._running, "workers": slots, "errors": []}
+
+    def on_event(self, kind: str, handler: Callable[[str, Dict], None]) -> None:
+        """Register a handler called as handler(task_id, data) for worker events"""
+        self._event_handlers[kind] = handler
+
+    @property
+    def max_workers(self) -> int:
+        return self._broker.counts()["slots"]
+
+    @property
+    def capacity(self) -> int:
+        return self.max_workers + self.max_queue_size
+
+    def active_jobs(self) -> int:
+        """Jobs that are queued or running on any node"""
+        counts = self._broker.counts()
+        return counts["pending"] + counts["running"]
+
+    def running_jobs(self) -> int:
+        return self._broker.counts()["running"]
+
+    def snapshot(self) -> Dict:
+        """Live workers, running jobs and waiting jobs, the latter in the order they will start"""
+        snapshot = self._broker.snapshot()
+        snapshot["capacity"] = snapshot["workers"] + self.max_queue_size
+        return snapshot
+
+    def has_capacity(self) -> bool:
+        return self.active_jobs() < self.capacity
+
+    def has_idle_worker(self) -> bool:
+        """Whether a new job would start right away rather than wait in the queue"""
+        counts = self._broker.counts()
+        return counts["pending"] == 0 and counts["running"] < counts["slots"]
+
+    def holds(self, task_id: str) -> bool:
+        """Whether the broker has a queued or running job for the task, whoever submitted it"""
+        return self._broker.get_job(task_id) is not None
+
+    def submit(self, task_id: str, fn: Callable, *args, on_done: Optional[Callable[[str, Future], None]] = None,
+               priority: str = DEFAULT_PRIORITY, client_id: Optional[str] = None) -> Future:
+        """
+        Queue fn(context, *args) on the broker, or adopt the task's job if it already has one.
+
+        fn must be a module-level function and args must be JSON
+        serialisable, since workers import and call it by name. Paths in
+        args must resolve to the same files on every node.
+        """
+        if not self._running:
+            raise RuntimeError("Job executor is not running")
+        if priority not in PRIORITY_CLASSES:
+            raise ValueError(f"Unknown priority class '{priority}'")
+
+        future: Future = Future()
+        with self._lock:
+            if task_id in self._jobs:
+                raise ValueError(f"Task {task_id} is already queued")
+            # A job left by an API process that has since died carries on
+            job = self._broker.adopt(task_id, self.submitter)
+            if job:
+                logger.info(f"Adopted {job['state']} job of task {task_id}")
+            else:
+                job = self._broker.enqueue(task_id, f"{fn.__module__}:{fn.__name__}", list(args), priority,
+                                           client_id, self.submitter, self.capacity)
+                if job is None:
+                    raise QueueFullError(f"Job queue is full ({self.capacity} jobs)")
+            if job["state"] == JobState.RUNNING:
+                future.set_running_or_notify_cancel()
+            self._jobs[task_id] = {"future": future, "job_id": job["id"], "estimate": None}
+
+        def _done(fut: Future):
+            with self._lock:
+                self._jobs.pop(task_id, None)
+            if on_done:
+                try:
+                    on_done(task_id, fut)
+                except Exception as e:
+                    logger.error(f"Error in completion handler for task {task_id}: {e}")
+
+        future.add_done_callback(_done)
+        logger.info(f"Queued task {task_id} on the broker with priority {priority}")
+        self._publish_estimates()
+        return future
+
+    def cancel(self, task_id: str) -> bool:
+        """
+        Cancel a waiting or running job.
+
+        Waiting jobs are removed from the broker immediately; running jobs
+        are flagged and stop once their worker sees it.
+        """
+        with self._lock:
+            job = self._jobs.get(task_id)
+        if not job:
+            return False
+        # A requeued job is waiting again although its future already runs
+        if self._broker.cancel(job["job_id"]) and not job["future"].cancel():
+            job["future"].set_exception(JobCancelledError("Job was cancelled"))
+        logger.info(f"Cancellation requested for task {task_id}")
+        return True
+
+    def _settle(self, task_id: str, outcome: Dict) -> None:
+        with self._lock:
+            job = self._jobs.get(task_id)
+        if not job or job["future"].done():
+            return
+        if outcome.get("cancelled"):
+            job["future"].set_exception(JobCancelledError(outcome.get("error") or "Job was cancelled"))
+        elif "result" not in outcome:
+            job["future"].set_exception(JobFailedError(outcome.get("error")))
+        else:
+            job["future"].set_result(outcome["result"])
+
+    def _handle(self, task_id: str, kind: str, data: Dict) -> None:
+        if kind == "done":
+            self._settle(task_id, data)
+            return
+        if kind == "started":
+            with self._lock:
+                job = self._jobs.get(task_id)
+            if job and not job["future"].running():
+                job["future"].set_running_or_notify_cancel()
+        self._call_handler(kind, task_id, data)
+
+    def _call_handler(self, kind: str, task_id: Optional[str], data: Dict) -> None:
+        handler = self._event_handlers.get(kind)
+        if handler:
+            try:
+                handler(task_id, data)
+            except Exception as e:
+                logger.error(f"Error handling {kind} event for task {task_id}: {e}")
+
+    def _publish_estimates(self) -> None:
+        """Send a "queued" event for every waiting job of this process whose estimate changed"""
+        changed = []
+        queued = self._broker.snapshot()["queued"]
+        with self._lock:
+            for estimate in queued:
+                job = self._jobs.get(estimate["task_id"])
+                if not job:
+                    continue
+                previous = job["estimate"]
+                # Small drifts of the estimate are not worth an event
+                if (not previous or previous["queue_position"] != estimate["queue_position"]
+                        or abs(previous["estimated_start"] - estimate["estimated_start"]) >= 5):
+                    job["estimate"] = estimate
+                    changed.append(estimate)
+        for estimate in changed:
+            self._call_handler("queued", estimate["task_id"], estimate)
+
+    def _maintain(self) -> None:
+        """Requeue the jobs of dead workers, forget jobs another API process adopted and refresh estimates"""
+        self._broker.requeue_stale()
+        with self._lock:
+            task_ids = list(self._jobs)
+        for task_id in self._broker.adopted_away(task_ids, self.submitter):
+            with self._lock:
+                self._jobs.pop(task_id, None)
+            logger.info(f"Task {task_id} was adopted by another API process")
+
+        slots = self._broker.counts()["slots"]
+        if slots != self._slots:
+            logger.info(f"Workers now offer {slots} job slots")
+            self._slots = slots
+            self._call_handler("workers", None, {"slots": slots})
+        self._publish_estimates()
+
+    def _poll_loop(self) -> None:
+        last_maintained = 0.0
+        while self._running:
+            try:
+                events = self._broker.fetch_events(self.submitter)
+                for task_id, kind, data in events:
+                    self._handle(task_id, kind, data)
+                if time.monotonic() - last_maintained >= WORKER_HEARTBEAT_INTERVAL:
+                    last_maintained = time.monotonic()
+                    self._maintain()
+            except Exception as e:
+                logger.error(f"Error reading from the job broker: {e}")
+                events = None
+            if not events:
+                time.sleep(BROKER_POLL_INTERVAL)
+
+
+def create_job_executor():
+    """A RemoteJobExecutor on BROKER_URL if one is set, otherwise a local JobExecutor"""
+    if BROKER_URL:
+        return RemoteJobExecutor(BROKER_URL)
+    return JobExecutor()
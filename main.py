@@ -1,16 +1,36 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks
+from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse, RedirectResponse, HTMLResponse
+from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
 import os
 import logging
 import uuid
 import asyncio
+import json
+import threading
 from dotenv import load_dotenv
-from task_manager import TaskManager, TaskStatus
+from task_manager import TaskManager, TaskStatus, FINAL_STATUSES
+from task_events import TaskEventBroker
+from stitch_plan import ENGINE_ALIASES, ENGINES, ENCODING_PROFILES, PREVIEW_PROFILE, TimelineError, compile_timeline, default_engine, default_profile
+from result_cache import ResultCache
+from source_registry import SourceRegistry, SourceStatus, run_normalize_job
+from batch_registry import MAX_BATCH_SIZE, BatchRegistry
+from upload_sessions import UploadSessionError, UploadSessionStore, UploadStatus
+from downloads import download_response
+from file_manager import StorageManager, StorageQuotaError, UploadTooLargeError, save_upload
+from preflight import PreflightError, preflight_inputs
+from stream_packager import STREAM_INFO, STREAM_MEDIA_TYPES, STREAM_PACKAGING
+from job_executor import JobCancelledError, QueueFullError, create_job_executor, run_package_job, run_stitch_job
+from metrics import observe_stage, register_gauges
+from queue_manager import client_for_key, priority_for
+from queue_ui import create_queue_router
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from concurrent.futures import CancelledError, Future
 from pathlib import Path
+from typing import Dict, List, Optional
 import time
 
 # Load environment variables
@@ -32,6 +52,14 @@ TARGET_HEIGHT = int(os.getenv('TARGET_HEIGHT', '720'))
 TARGET_FPS = int(os.getenv('TARGET_FPS', '30'))
 VIDEO_BITRATE = os.getenv('VIDEO_BITRATE', '2000k')
 AUDIO_BITRATE = os.getenv('AUDIO_BITRATE', '128k')
+RESULT_CACHE_ENABLED = os.getenv('RESULT_CACHE_ENABLED', 'true').lower() == 'true'
+RESULT_CACHE_DIR = os.getenv('RESULT_CACHE_DIR', os.path.join(OUTPUT_DIR, 'cache'))
+RESULT_CACHE_MAX_SIZE = int(os.getenv('RESULT_CACHE_MAX_SIZE', '2048'))
+SOURCES_DIR = os.getenv('SOURCES_DIR', os.path.join(OUTPUT_DIR, 'sources'))
+BATCHES_DIR = os.getenv('BATCHES_DIR', os.path.join(OUTPUT_DIR, 'batches'))
+
+# API Version prefix
+API_V1_PREFIX = "/api/v1"
 
 # Create FastAPI app
 app = FastAPI(
@@ -57,15 +85,129 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Multipart framing allowed on top of the files when checking Content-Length
+UPLOAD_OVERHEAD_BYTES = 64 * 1024
+
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    """
+    Reject oversized uploads from their Content-Length before reading the body.
+
+    Requests that are within the limits but would take TEMP_DIR over its
+    quota are refused with 507. A stitch request repeating an
+    Idempotency-Key is answered with its task without reading the body.
+    """
+    idempotency_key = request.headers.get("idempotency-key")
+    if request.method == "POST" and request.url.path == f"{API_V1_PREFIX}/stitch" and idempotency_key:
+        key = scoped_idempotency_key(request, idempotency_key)
+        task_id = await run_in_threadpool(task_manager.get_idempotency_key, key)
+        if task_id:
+            return replay_idempotent_request(task_id)
+
+    max_videos = {
+        f"{API_V1_PREFIX}/stitch": 2,
+        f"{API_V1_PREFIX}/batches": MAX_BATCH_SIZE + 1,
+        f"{API_V1_PREFIX}/sources": 1,
+    }.get(request.url.path)
+    if request.method == "POST" and max_videos:
+        content_length = request.headers.get("content-length")
+        max_request_bytes = max_videos * MAX_UPLOAD_SIZE * 1024 * 1024 + UPLOAD_OVERHEAD_BYTES
+        if content_length and content_length.isdigit():
+            if int(content_length) > max_request_bytes:
+                return JSONResponse(
+                    status_code=413,
+                    content={"detail": f"Upload exceeds maximum size of {MAX_UPLOAD_SIZE}MB per video"}
+                )
+            try:
+                await run_in_threadpool(storage_manager.ensure_temp_space, int(content_length))
+            except StorageQuotaError as e:
+                logger.warning(str(e))
+                return JSONResponse(
+                    status_code=507,
+                    content={"detail": "Not enough storage for this upload, please retry later"},
+                    headers={"Retry-After": QUEUE_RETRY_AFTER}
+                )
+    return await call_next(request)
+
 # Create directories
 os.makedirs(TEMP_DIR, exist_ok=True)
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-# Initialize task manager
-task_manager = TaskManager(OUTPUT_DIR)
+# Initialize result cache and task manager
+result_cache = ResultCache(RESULT_CACHE_DIR, RESULT_CACHE_MAX_SIZE * 1024 * 1024) if RESULT_CACHE_ENABLED else None
+task_manager = TaskManager(OUTPUT_DIR, result_cache=result_cache)
 
-# API Version prefix
-API_V1_PREFIX = "/api/v1"
+# Reap old tasks and orphaned files and keep storage within its quotas
+storage_manager = StorageManager(TEMP_DIR, task_manager)
+
+# Push task updates to server-sent event subscribers
+task_events = TaskEventBroker()
+task_manager.add_listener(task_events.publish)
+
+# Seconds between store re-reads while streaming task events, so updates
+# made by sibling workers are picked up too
+SSE_POLL_INTERVAL = float(os.getenv('SSE_POLL_INTERVAL', '2'))
+
+# Initialize registry of pre-normalized WWE sources
+source_registry = SourceRegistry(SOURCES_DIR)
+# Uploads of sources still being normalized belong to no task
+storage_manager.add_claim(
+    lambda: [source["upload_path"] for source in source_registry.get_processing_sources() if source.get("upload_path")]
+)
+
+# Initialize registry of batches stitched against one source
+batch_registry = BatchRegistry(BATCHES_DIR)
+storage_manager.add_cleanup(batch_registry.cleanup_old_batches)
+
+# Initialize resumable upload sessions; their part files live in TEMP_DIR
+upload_sessions = UploadSessionStore(TEMP_DIR)
+storage_manager.add_claim(upload_sessions.active_files)
+storage_manager.add_cleanup(upload_sessions.cleanup_expired)
+
+# Initialize job executor: a local worker pool started and warmed on application
+# startup, or a queue on BROKER_URL served by encoder workers on other nodes.
+# Job functions import the engines lazily, so OpenCV and NumPy never load here
+job_executor = create_job_executor()
+
+# Queue depth, temp usage and memory are read live on every scrape
+register_gauges(job_executor, TEMP_DIR)
+
+# Seconds clients are asked to wait before retrying when the queue is full
+QUEUE_RETRY_AFTER = os.getenv('QUEUE_RETRY_AFTER', '30')
+
+# Times a job interrupted by a restart is requeued before it is failed
+MAX_JOB_RECOVERIES = int(os.getenv('MAX_JOB_RECOVERIES', '2'))
+
+def client_id_for(request: Request) -> str:
+    """
+    Who submitted a request, for fair sharing and priority.
+
+    The client of a known X-API-Key, otherwise the peer address; never a
+    name the caller picks, so nobody can claim another client's priority.
+    """
+    client_id = client_for_key(request.headers.get("x-api-key"))
+    if client_id:
+        return client_id
+    return request.client.host if request.client else "anonymous"
+
+# Live view of running and waiting jobs
+app.include_router(create_queue_router(job_executor, task_manager, templates, API_V1_PREFIX, client_id_for))
+
+def scoped_idempotency_key(request: Request, key: str) -> str:
+    """Idempotency keys are only unique per client"""
+    return f"{client_id_for(request)}:{key}"
+
+def replay_idempotent_request(task_id: str) -> JSONResponse:
+    """Answer a repeated request with the task the first one created"""
+    task = task_manager.get_task(task_id)
+    if not task:
+        # Bound but not created yet: the first request is still being accepted
+        return JSONResponse(
+            status_code=409,
+            content={"detail": "A request with this Idempotency-Key is still in progress"},
+            headers={"Retry-After": "1"}
+        )
+    return JSONResponse(content=task, headers={"Idempotent-Replayed": "true"})
 
 # Health and Status Endpoints
 @app.get("/", response_class=HTMLResponse)
@@ -75,9 +217,15 @@ async def root(request: Request):
 
 @app.get("/status")
 async def health_check():
-    """Health check endpoint for Railway - must return 200 for successful deployment"""
+    """Liveness check: 200 as soon as the process serves requests"""
     return {"status": "ok"}
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness check for Railway: 200 once the encoder workers are warm, 503 while they start or if they cannot encode"""
+    readiness = await run_in_threadpool(job_executor.readiness)
+    return JSONResponse(status_code=200 if readiness["ready"] else 503, content=readiness)
+
 # API v1 Endpoints
 @app.get(f"{API_V1_PREFIX}/status")
 async def api_status():
@@ -88,10 +236,17 @@ async def api_status():
         "timestamp": time.time()
     }
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics for this API process and its workers"""
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 @app.get(f"{API_V1_PREFIX}/tasks")
-async def list_tasks():
-    """List all tasks"""
-    return task_manager.get_all_tasks()
+async def list_tasks(status: Optional[str] = None, limit: int = Query(100, ge=1, le=1000), offset: int = Query(0, ge=0)):
+    """List tasks, newest first, optionally filtered by status"""
+    if status and status not in [s.value for s in TaskStatus]:
+        raise HTTPException(status_code=400, detail=f"Unknown status '{status}'")
+    return task_manager.list_tasks(status=status, limit=limit, offset=offset)
 
 @app.get(f"{API_V1_PREFIX}/tasks/{{task_id}}")
 async def get_task(task_id: str):
@@ -101,34 +256,160 @@ async def get_task(task_id: str):
         raise HTTPException(status_code=404, detail="Task not found")
     return task
 
+@app.get(f"{API_V1_PREFIX}/tasks/{{task_id}}/events")
+async def task_event_stream(task_id: str, request: Request):
+    """Stream task updates as server-sent events until the task finishes"""
+    task = task_manager.get_task(task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+    
+    async def event_generator():
+        queue = task_events.subscribe(task_id)
+        try:
+            current = task_manager.get_task(task_id)
+            last_sent = None
+            while current:
+                if current != last_sent:
+                    yield f"event: task\ndata: {json.dumps(current)}\n\n"
+                    last_sent = current
+                else:
+                    # Comment line keeps proxies from closing an idle stream
+                    yield ": keepalive\n\n"
+                if current["status"] in FINAL_STATUSES or await request.is_disconnected():
+                    break
+                try:
+                    current = await asyncio.wait_for(queue.get(), timeout=SSE_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    current = task_manager.get_task(task_id)
+        finally:
+            task_events.unsubscribe(task_id, queue)
+    
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post(f"{API_V1_PREFIX}/tasks/{{task_id}}/cancel")
+async def cancel_task(task_id: str):
+    """Cancel a queued or running task"""
+    task = task_manager.get_task(task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+
+    if task["status"] not in (TaskStatus.PENDING.value, TaskStatus.PROCESSING.value):
+        raise HTTPException(status_code=409, detail=f"Task is already {task['status']}")
+
+    if task.get("stage") in ("preview_ready", "waiting"):
+        # Deferred renders and waiting batch items have no job yet; drop the inputs they kept
+        remove_task_inputs(task)
+        return task_manager.update_task_status(task_id, TaskStatus.CANCELLED)
+
+    if not job_executor.cancel(task_id):
+        raise HTTPException(status_code=409, detail="Task is not running")
+
+    return task_manager.get_task(task_id)
+
 @app.get(f"{API_V1_PREFIX}/tasks/{{task_id}}/download")
-async def download_video(task_id: str):
-    """Download the processed video"""
+async def download_video(task_id: str, request: Request):
+    """Download the processed video, with support for range and conditional requests"""
     logger.info(f"Download request for task {task_id}")
     task = task_manager.get_task(task_id)
     if not task:
         logger.warning(f"Task {task_id} not found")
         raise HTTPException(status_code=404, detail="Task not found")
     
+    if task["status"] == TaskStatus.PENDING.value and task.get("stage") == "preview_ready":
+        # Deferred full renders start when someone asks for the file
+        try:
+            task = queue_stitch_job(task_id)
+        except QueueFullError:
+            raise HTTPException(
+                status_code=429,
+                detail="Too many videos are being processed, please retry later",
+                headers={"Retry-After": QUEUE_RETRY_AFTER}
+            )
+        except ValueError:
+            # A concurrent request queued it first
+            task = task_manager.get_task(task_id)
+        return JSONResponse(status_code=202, content=task, headers={"Retry-After": QUEUE_RETRY_AFTER})
+    
     if task["status"] != TaskStatus.COMPLETED.value:
         logger.warning(f"Task {task_id} is not completed")
         raise HTTPException(status_code=400, detail="Video is not ready for download")
     
+    if task.get("evicted"):
+        raise HTTPException(status_code=410, detail="Video was removed to free up storage")
+    
     output_path = task_manager.get_output_path(task_id)
     if not os.path.exists(output_path):
         logger.warning(f"Output file not found for task {task_id}")
         raise HTTPException(status_code=404, detail="Video file not found")
     
-    # Record the download
-    task_manager.record_download(task_id)
-    
-    logger.info(f"Sending file: {output_path}")
-    return FileResponse(
+    response, full_download = download_response(
+        request,
         output_path,
-        media_type="video/mp4",
         filename=f"stitched_video_{task_id}.mp4",
-        background=None
+        accel_path=task["output_filename"]
+    )
+    
+    # Record the download; seeks and revalidations are not new downloads
+    if full_download:
+        task_manager.record_download(task_id)
+    
+    logger.info(f"Sending file: {output_path} ({response.status_code})")
+    return response
+
+@app.get(f"{API_V1_PREFIX}/tasks/{{task_id}}/preview")
+async def download_preview(task_id: str, request: Request):
+    """Stream the low-resolution preview rendered ahead of the full output"""
+    task = task_manager.get_task(task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+    
+    if not task.get("preview_ready"):
+        raise HTTPException(status_code=400, detail="Preview is not ready")
+    
+    preview_path = os.path.join(OUTPUT_DIR, task["preview_filename"])
+    if not os.path.exists(preview_path):
+        raise HTTPException(status_code=404, detail="Preview file not found")
+    
+    # Previews are not counted as downloads
+    response, _ = download_response(
+        request,
+        preview_path,
+        filename=f"preview_{task_id}.mp4",
+        accel_path=task["preview_filename"]
     )
+    return response
+
+@app.get(f"{API_V1_PREFIX}/tasks/{{task_id}}/stream/{{filename:path}}")
+async def stream_file(task_id: str, filename: str, request: Request):
+    """Serve a file of the task's HLS/DASH package: playlists, segments, poster and thumbnails"""
+    task = task_manager.get_task(task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if task.get("evicted"):
+        raise HTTPException(status_code=410, detail="Video was removed to free up storage")
+    if not task.get("stream_ready"):
+        raise HTTPException(status_code=404, detail="Streaming package is not ready")
+    
+    stream_dir = os.path.realpath(stream_path(task))
+    path = os.path.realpath(os.path.join(stream_dir, filename))
+    media_type = STREAM_MEDIA_TYPES.get(os.path.splitext(path)[1])
+    if not path.startswith(stream_dir + os.sep) or not media_type or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Stream file not found")
+    
+    # Players fetch these piecemeal; none of it counts as a download
+    response, _ = download_response(
+        request,
+        path,
+        filename=os.path.basename(path),
+        media_type=media_type,
+        accel_path=f"{task['stream_dirname']}/{os.path.relpath(path, stream_dir)}",
+        inline=True
+    )
+    return response
 
 @app.get(f"{API_V1_PREFIX}/downloads/recent")
 async def get_recent_downloads():
@@ -142,71 +423,424 @@ async def get_popular_downloads():
     logger.info("Getting popular downloads")
     return task_manager.get_popular_downloads()
 
+@app.get(f"{API_V1_PREFIX}/sources")
+async def list_sources():
+    """List registered WWE sources"""
+    return source_registry.get_all_sources()
+
+@app.get(f"{API_V1_PREFIX}/sources/{{source_id}}")
+async def get_source(source_id: str):
+    """Get WWE source details"""
+    source = source_registry.get_source(source_id)
+    if not source:
+        raise HTTPException(status_code=404, detail="Source not found")
+    return source
+
+@app.post(f"{API_V1_PREFIX}/sources")
+async def register_source(request: Request, wwe_video: UploadFile = File(...)):
+    """Upload a WWE clip once so stitch requests can reference it by ID"""
+    return await ingest_source(wwe_video, client_id=client_id_for(request))
+
+async def ingest_source(wwe_video: UploadFile, timeline: Optional[Dict] = None, client_id: Optional[str] = None) -> Dict:
+    """Save, check and register a WWE clip, normalizing it in the background if it is new"""
+    if not wwe_video.filename.endswith('.mp4'):
+        raise HTTPException(status_code=400, detail="Only MP4 files are supported")
+    
+    if not job_executor.has_capacity():
+        raise HTTPException(
+            status_code=429,
+            detail="Too many videos are being processed, please retry later",
+            headers={"Retry-After": QUEUE_RETRY_AFTER}
+        )
+    
+    upload_path = os.path.join(TEMP_DIR, f"source_{uuid.uuid4()}.mp4")
+    try:
+        upload = await save_upload(wwe_video, upload_path, MAX_UPLOAD_SIZE * 1024 * 1024)
+    except UploadTooLargeError:
+        raise HTTPException(
+            status_code=400,
+            detail=f"WWE video exceeds maximum size of {MAX_UPLOAD_SIZE}MB"
+        )
+    
+    # Refuse clips the timeline cannot use before normalizing them
+    try:
+        await run_in_threadpool(preflight_inputs, timeline, wwe=upload_path)
+    except PreflightError as e:
+        os.remove(upload_path)
+        raise HTTPException(status_code=422, detail=str(e))
+    
+    source, created = source_registry.register(
+        upload["sha256"], wwe_video.filename, upload_path=upload_path, owner=task_manager.owner
+    )
+    if not created:
+        # Already registered; the new copy is not needed
+        os.remove(upload_path)
+        return source
+    
+    try:
+        submit_normalize_job(source, client_id)
+    except QueueFullError:
+        os.remove(upload_path)
+        source_registry.update_status(source["id"], SourceStatus.FAILED, error="Job queue is full")
+        raise HTTPException(
+            status_code=429,
+            detail="Too many videos are being processed, please retry later",
+            headers={"Retry-After": QUEUE_RETRY_AFTER}
+        )
+    
+    return source
+
+def submit_normalize_job(source: Dict, client_id: Optional[str] = None):
+    """Normalize a registered source's upload into its mezzanine copy on the worker pool"""
+    upload_path = source["upload_path"]
+    
+    def on_source_done(job_id: str, future: Future):
+        try:
+            future.result()
+            source_registry.update_status(source["id"], SourceStatus.READY)
+        except Exception as e:
+            logger.error(f"Error normalizing source {source['id']}: {e}")
+            source_registry.update_status(source["id"], SourceStatus.FAILED, error=str(e))
+        finally:
+            if os.path.exists(upload_path):
+                os.remove(upload_path)
+        # Batch items waiting for this source can go now
+        dispatch_waiting_tasks()
+    
+    job_executor.submit(
+        f"source_{source['id']}",
+        run_normalize_job,
+        upload_path,
+        source_registry.mezzanine_path(source["id"]),
+        on_done=on_source_done,
+        client_id=client_id
+    )
+
+def recover_interrupted_sources():
+    """Restart normalizations left unfinished by an API process whose lease lapsed"""
+    for source in source_registry.get_processing_sources():
+        if task_manager.owner_alive(source.get("owner")):
+            continue
+        source = source_registry.claim(source, task_manager.owner)
+        if not source:
+            continue
+        if job_executor.holds(f"source_{source['id']}"):
+            submit_normalize_job(source)
+            continue
+        upload_path = source.get("upload_path")
+        if not upload_path or not os.path.exists(upload_path):
+            source_registry.update_status(source["id"], SourceStatus.FAILED, error="Interrupted by a restart")
+            continue
+        try:
+            submit_normalize_job(source)
+            logger.info(f"Restarted normalization of source {source['id']}")
+        except QueueFullError:
+            os.remove(upload_path)
+            source_registry.update_status(source["id"], SourceStatus.FAILED, error="Job queue is full")
+
+@app.post(f"{API_V1_PREFIX}/uploads")
+async def create_upload(filename: str = Form(...), size: int = Form(...)):
+    """Start a resumable upload of a size byte MP4"""
+    if not filename.endswith('.mp4'):
+        raise HTTPException(status_code=400, detail="Only MP4 files are supported")
+    if not 0 < size <= MAX_UPLOAD_SIZE * 1024 * 1024:
+        raise HTTPException(status_code=400, detail=f"Upload size must be between 1 byte and {MAX_UPLOAD_SIZE}MB")
+    try:
+        await run_in_threadpool(storage_manager.ensure_temp_space, size)
+    except StorageQuotaError as e:
+        logger.warning(str(e))
+        raise HTTPException(
+            status_code=507,
+            detail="Not enough storage for this upload, please retry later",
+            headers={"Retry-After": QUEUE_RETRY_AFTER}
+        )
+    session = await run_in_threadpool(upload_sessions.create, filename, size)
+    return upload_sessions.describe(session)
+
+def get_upload_session(upload_id: str) -> Dict:
+    session = upload_sessions.get(upload_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return session
+
+@app.get(f"{API_V1_PREFIX}/uploads/{{upload_id}}")
+async def get_upload(upload_id: str):
+    """Byte ranges received so far and the offset to resume from"""
+    return upload_sessions.describe(get_upload_session(upload_id))
+
+@app.put(f"{API_V1_PREFIX}/uploads/{{upload_id}}")
+async def upload_chunk(upload_id: str, request: Request, offset: int = Query(..., ge=0)):
+    """Write the request body into the upload at offset; chunks may be resent or arrive out of order"""
+    get_upload_session(upload_id)
+    try:
+        session = await upload_sessions.write_chunk(upload_id, offset, request.stream())
+    except UploadSessionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return upload_sessions.describe(session)
+
+@app.post(f"{API_V1_PREFIX}/uploads/{{upload_id}}/complete")
+async def complete_upload(upload_id: str, sha256: str = Form(...)):
+    """Verify that every byte arrived and matches sha256; the upload can then be used by /api/v1/stitch"""
+    get_upload_session(upload_id)
+    try:
+        session = await run_in_threadpool(upload_sessions.finalize, upload_id, sha256)
+    except UploadSessionError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return upload_sessions.describe(session)
+
+@app.delete(f"{API_V1_PREFIX}/uploads/{{upload_id}}")
+async def delete_upload(upload_id: str):
+    """Abandon an upload and free its space"""
+    get_upload_session(upload_id)
+    await run_in_threadpool(upload_sessions.delete, upload_id)
+    return {"id": upload_id, "deleted": True}
+
+def get_finalized_upload(upload_id: str, name: str) -> Dict:
+    """A completed upload referenced by a stitch request"""
+    session = upload_sessions.get(upload_id)
+    if not session:
+        raise HTTPException(status_code=404, detail=f"{name} upload not found")
+    if session["status"] != UploadStatus.COMPLETE:
+        raise HTTPException(status_code=409, detail=f"{name} upload is not finalized")
+    return session
+
+def consume_uploads(*sessions: Optional[Dict]):
+    """Remove resumable uploads once a task has taken them; a rejected request leaves them for a retry"""
+    for session in sessions:
+        if session:
+            upload_sessions.delete(session["id"])
+
 @app.post(f"{API_V1_PREFIX}/stitch")
 async def stitch_videos(
-    background_tasks: BackgroundTasks,
-    wwe_video: UploadFile = File(...),
-    fan_video: UploadFile = File(...)
+    request: Request,
+    fan_video: Optional[UploadFile] = File(None),
+    wwe_video: Optional[UploadFile] = File(None),
+    wwe_source_id: Optional[str] = Form(None),
+    wwe_upload_id: Optional[str] = Form(None),
+    fan_upload_id: Optional[str] = Form(None),
+    engine: Optional[str] = Form(None),
+    profile: Optional[str] = Form(None),
+    preview: bool = Form(False),
+    defer_render: bool = Form(False),
+    timeline: Optional[str] = Form(None),
+    streaming: Optional[bool] = Form(None),
+    idempotency_key: Optional[str] = Header(None)
 ):
-    """Upload and stitch two videos together"""
+    """
+    Upload and stitch two videos together.
+
+    The WWE clip is either uploaded as wwe_video, referenced by the ID of
+    a source registered through /api/v1/sources, or referenced as
+    wwe_upload_id, a finalized resumable upload from /api/v1/uploads. The
+    fan clip is uploaded as fan_video or referenced as fan_upload_id. A
+    resumable upload is used up by the task that takes it. With preview, a quick
+    low-resolution render is published first and the output in the chosen
+    encoding profile follows on the same task, or only once it is
+    downloaded when defer_render is set. timeline is a JSON description of
+    the segments and audio ranges to render instead of the default plan.
+    With streaming (default: STREAM_PACKAGING), the output is also
+    packaged for HLS and DASH under /api/v1/tasks/{id}/stream/.
+    Retrying with the same Idempotency-Key header returns the task of the
+    first accepted request instead of starting another job.
+    """
     try:
+        # Validate the requested engine
+        engine = (engine or default_engine()).lower()
+        engine = ENGINE_ALIASES.get(engine, engine)
+        if engine not in ENGINES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown engine '{engine}', expected one of: {', '.join(ENGINES)}"
+            )
+        
+        # Validate the requested encoding profile
+        profile = (profile or default_profile()).lower()
+        if profile not in ENCODING_PROFILES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown profile '{profile}', expected one of: {', '.join(ENCODING_PROFILES)}"
+            )
+        # The preview profile needs no separate preview
+        preview = preview and profile != PREVIEW_PROFILE
+        
+        # Validate a custom timeline before accepting any upload
+        if timeline:
+            try:
+                timeline = compile_timeline(timeline)
+            except TimelineError as e:
+                raise HTTPException(status_code=400, detail=f"Invalid timeline: {e}")
+        else:
+            timeline = None
+        
+        # Resolve the WWE input
+        source = None
+        wwe_upload = None
+        if sum(1 for given in (wwe_video, wwe_source_id, wwe_upload_id) if given) > 1:
+            raise HTTPException(
+                status_code=400, detail="Provide only one of wwe_video, wwe_source_id or wwe_upload_id"
+            )
+        if wwe_source_id:
+            source = source_registry.get_source(wwe_source_id)
+            if not source:
+                raise HTTPException(status_code=404, detail="Source not found")
+            if source["status"] != SourceStatus.READY:
+                raise HTTPException(status_code=409, detail=f"Source is {source['status']}")
+            wwe_filename = source["filename"]
+        elif wwe_upload_id:
+            wwe_upload = get_finalized_upload(wwe_upload_id, "WWE")
+            wwe_filename = wwe_upload["filename"]
+        elif wwe_video:
+            wwe_filename = wwe_video.filename
+        else:
+            raise HTTPException(status_code=400, detail="wwe_video, wwe_source_id or wwe_upload_id is required")
+        
+        # Resolve the fan input
+        fan_upload = None
+        if fan_video and fan_upload_id:
+            raise HTTPException(status_code=400, detail="Provide either fan_video or fan_upload_id, not both")
+        if fan_upload_id:
+            fan_upload = get_finalized_upload(fan_upload_id, "Fan")
+            fan_filename = fan_upload["filename"]
+        elif fan_video:
+            fan_filename = fan_video.filename
+        else:
+            raise HTTPException(status_code=400, detail="fan_video or fan_upload_id is required")
+        
         # Validate file types
-        if not wwe_video.filename.endswith('.mp4') or not fan_video.filename.endswith('.mp4'):
+        if not wwe_filename.endswith('.mp4') or not fan_filename.endswith('.mp4'):
             raise HTTPException(
                 status_code=400,
                 detail="Only MP4 files are supported"
             )
         
+        # Refuse early rather than accepting uploads we cannot queue
+        if not job_executor.has_capacity():
+            raise HTTPException(
+                status_code=429,
+                detail="Too many videos are being processed, please retry later",
+                headers={"Retry-After": QUEUE_RETRY_AFTER}
+            )
+        
         # Create unique task ID
         task_id = str(uuid.uuid4())
         
+        # The first request with a key wins; repeats get its task
+        if idempotency_key:
+            idempotency_key = scoped_idempotency_key(request, idempotency_key)
+            bound_task_id = task_manager.bind_idempotency_key(idempotency_key, task_id)
+            if bound_task_id != task_id:
+                return replay_idempotent_request(bound_task_id)
+        
         # Create task
-        task = task_manager.create_task(task_id, wwe_video.filename, fan_video.filename)
+        task = task_manager.create_task(
+            task_id, wwe_filename, fan_filename, engine=engine, profile=profile, client_id=client_id_for(request)
+        )
         
-        # Save uploaded files
-        wwe_path = os.path.join(TEMP_DIR, f"wwe_{task_id}.mp4")
+        # Save uploaded files; a registered source is read from its mezzanine copy
         fan_path = os.path.join(TEMP_DIR, f"fan_{task_id}.mp4")
+        if source:
+            wwe_path = source_registry.mezzanine_path(source["id"])
+            pending_uploads = [("Fan", fan_upload or fan_video, fan_path)]
+        else:
+            wwe_path = os.path.join(TEMP_DIR, f"wwe_{task_id}.mp4")
+            pending_uploads = [("WWE", wwe_upload or wwe_video, wwe_path), ("Fan", fan_upload or fan_video, fan_path)]
+        temp_paths = [path for _, _, path in pending_uploads]
         
         try:
-            # Save WWE video
-            with open(wwe_path, "wb") as f:
-                content = await wwe_video.read()
-                if len(content) > MAX_UPLOAD_SIZE * 1024 * 1024:  # Convert MB to bytes
-                    raise HTTPException(
-                        status_code=400,
-                        detail=f"WWE video exceeds maximum size of {MAX_UPLOAD_SIZE}MB"
-                    )
-                f.write(content)
-            
-            # Save fan video
-            with open(fan_path, "wb") as f:
-                content = await fan_video.read()
-                if len(content) > MAX_UPLOAD_SIZE * 1024 * 1024:  # Convert MB to bytes
+            # Stream uploads to disk in chunks, hashing as we go
+            max_bytes = MAX_UPLOAD_SIZE * 1024 * 1024  # Convert MB to bytes
+            ingest_started = time.perf_counter()
+            uploads = {}
+            if source:
+                uploads["WWE"] = {"sha256": source["sha256"]}
+            for name, upload, path in pending_uploads:
+                try:
+                    if isinstance(upload, dict):
+                        # A finalized resumable upload is linked in, its checksum already known
+                        uploads[name] = await run_in_threadpool(upload_sessions.link_to, upload["id"], path)
+                    else:
+                        uploads[name] = await save_upload(upload, path, max_bytes)
+                except UploadSessionError:
+                    raise HTTPException(status_code=409, detail=f"{name} upload is no longer available")
+                except UploadTooLargeError:
                     raise HTTPException(
                         status_code=400,
-                        detail=f"Fan video exceeds maximum size of {MAX_UPLOAD_SIZE}MB"
+                        detail=f"{name} video exceeds maximum size of {MAX_UPLOAD_SIZE}MB"
                     )
-                f.write(content)
+            ingest_seconds = round(time.perf_counter() - ingest_started, 3)
+            observe_stage("ingest", ingest_seconds, engine)
             
-            # Update task status to processing
-            task_manager.update_task_status(task_id, TaskStatus.PROCESSING)
+            # Check the inputs from their metadata before they take a worker
+            preflight_started = time.perf_counter()
+            try:
+                probe = await run_in_threadpool(preflight_inputs, timeline, wwe=wwe_path, fan=fan_path)
+            except PreflightError as e:
+                task_manager.update_task(task_id, probe=e.probe)
+                raise HTTPException(status_code=422, detail=str(e))
+            preflight_seconds = round(time.perf_counter() - preflight_started, 3)
+            observe_stage("preflight", preflight_seconds, engine)
             
-            # Add video processing to background tasks
-            background_tasks.add_task(
-                process_videos,
+            task = task_manager.update_task(
                 task_id,
-                wwe_path,
-                fan_path,
-                os.path.join(OUTPUT_DIR, task["output_filename"])
+                wwe_source_id=source["id"] if source else None,
+                wwe_sha256=uploads["WWE"]["sha256"],
+                fan_sha256=uploads["Fan"]["sha256"],
+                probe=probe,
+                timings={"ingest": ingest_seconds, "preflight": preflight_seconds},
+                inputs={"wwe": wwe_path, "fan": fan_path},
+                temp_inputs=temp_paths,
+                timeline=timeline,
+                stream_dirname=f"stream_{task_id}" if streaming or (streaming is None and STREAM_PACKAGING) else None
             )
+            output_path = os.path.join(OUTPUT_DIR, task["output_filename"])
+            
+            # Identical inputs rendered with the same settings reuse the cached output
+            if result_cache:
+                cache_key = ResultCache.make_key(task["wwe_sha256"], task["fan_sha256"], engine, profile, timeline,
+                                                 from_source=source is not None)
+                task_manager.update_task(task_id, cache_key=cache_key)
+                if result_cache.link_to(cache_key, output_path):
+                    for path in temp_paths:
+                        os.remove(path)
+                    consume_uploads(wwe_upload, fan_upload)
+                    task_manager.update_task(task_id, cache_hit=True)
+                    task = task_manager.update_task_status(task_id, TaskStatus.COMPLETED, progress=100)
+                    if task.get("stream_dirname"):
+                        queue_package_job(task_id)
+                    return task
             
+            if preview:
+                task_manager.update_task(
+                    task_id,
+                    preview=True,
+                    preview_ready=False,
+                    preview_filename=f"preview_{task_id}.mp4",
+                    defer_render=defer_render
+                )
+            
+            # Queue video processing on the worker pool; the task moves to
+            # processing once a worker picks it up
+            task = queue_stitch_job(task_id, preview=preview)
+            consume_uploads(wwe_upload, fan_upload)
             return task
             
         except Exception as e:
             # Clean up temporary files if they exist
-            for path in [wwe_path, fan_path]:
+            for path in temp_paths:
                 if os.path.exists(path):
                     os.remove(path)
+            # Never leave a task pending for a job that was not queued
+            error = e.detail if isinstance(e, HTTPException) else str(e)
+            task_manager.update_task_status(task_id, TaskStatus.FAILED, error=error)
+            # A rejected request did not use up its key
+            if idempotency_key:
+                task_manager.release_idempotency_key(idempotency_key, task_id)
+            if isinstance(e, QueueFullError):
+                raise HTTPException(
+                    status_code=429,
+                    detail="Too many videos are being processed, please retry later",
+                    headers={"Retry-After": QUEUE_RETRY_AFTER}
+                )
             raise e
             
     except HTTPException:
@@ -218,30 +852,462 @@ async def stitch_videos(
             detail="Failed to process videos"
         )
 
-# Background processing function
-async def process_videos(task_id: str, wwe_path: str, fan_path: str, output_path: str):
-    """Process videos in background"""
+@app.post(f"{API_V1_PREFIX}/batches")
+async def create_batch(
+    request: Request,
+    fan_videos: List[UploadFile] = File(...),
+    wwe_video: Optional[UploadFile] = File(None),
+    wwe_source_id: Optional[str] = Form(None),
+    engine: Optional[str] = Form(None),
+    profile: Optional[str] = Form(None),
+    timeline: Optional[str] = Form(None),
+    streaming: Optional[bool] = Form(None)
+):
+    """
+    Stitch one WWE clip against many fan clips.
+
+    The WWE clip is registered as a source (or referenced by wwe_source_id)
+    so it is decoded and normalized once for the whole batch. Every fan
+    clip becomes a task of its own that waits until the source is ready
+    and a worker is idle, so a batch may be larger than the queue.
+    """
+    engine = (engine or "smart").lower()
+    engine = ENGINE_ALIASES.get(engine, engine)
+    if engine not in ENGINES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown engine '{engine}', expected one of: {', '.join(ENGINES)}"
+        )
+    profile = (profile or default_profile()).lower()
+    if profile not in ENCODING_PROFILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown profile '{profile}', expected one of: {', '.join(ENCODING_PROFILES)}"
+        )
+    if timeline:
+        try:
+            timeline = compile_timeline(timeline)
+        except TimelineError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid timeline: {e}")
+        if any(audio_range["source"] == "wwe" for audio_range in timeline["audio"]):
+            raise HTTPException(status_code=400, detail="Batches read the WWE clip from a normalized copy without audio")
+    else:
+        timeline = None
+    if len(fan_videos) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"A batch takes at most {MAX_BATCH_SIZE} fan videos")
+    if any(not fan_video.filename.endswith('.mp4') for fan_video in fan_videos):
+        raise HTTPException(status_code=400, detail="Only MP4 files are supported")
+    
+    # Resolve the shared WWE source, registering an uploaded clip
+    if wwe_source_id:
+        if wwe_video:
+            raise HTTPException(status_code=400, detail="Provide either wwe_video or wwe_source_id, not both")
+        source = source_registry.get_source(wwe_source_id)
+        if not source:
+            raise HTTPException(status_code=404, detail="Source not found")
+        if source["status"] == SourceStatus.FAILED:
+            raise HTTPException(status_code=409, detail=f"Source is {source['status']}")
+    elif wwe_video:
+        source = await ingest_source(wwe_video, timeline, client_id=client_id_for(request))
+    else:
+        raise HTTPException(status_code=400, detail="wwe_video or wwe_source_id is required")
+    
+    batch = batch_registry.create_batch(str(uuid.uuid4()), source["id"], engine, profile)
+    wwe_path = source_registry.mezzanine_path(source["id"])
+    for fan_video in fan_videos:
+        task_id = str(uuid.uuid4())
+        task_manager.create_task(
+            task_id, source["filename"], fan_video.filename, engine=engine, profile=profile, client_id=client_id_for(request)
+        )
+        task_manager.update_task(task_id, batch_id=batch["id"], wwe_source_id=source["id"], wwe_sha256=source["sha256"])
+        batch_registry.add_task(batch["id"], task_id)
+        fan_path = os.path.join(TEMP_DIR, f"fan_{task_id}.mp4")
+        
+        # A bad item fails on its own instead of failing the batch
+        try:
+            ingest_started = time.perf_counter()
+            try:
+                upload = await save_upload(fan_video, fan_path, MAX_UPLOAD_SIZE * 1024 * 1024)
+            except UploadTooLargeError:
+                raise HTTPException(status_code=400, detail=f"Fan video exceeds maximum size of {MAX_UPLOAD_SIZE}MB")
+            ingest_seconds = round(time.perf_counter() - ingest_started, 3)
+            observe_stage("ingest", ingest_seconds, engine)
+            
+            preflight_started = time.perf_counter()
+            try:
+                probe = await run_in_threadpool(preflight_inputs, timeline, fan=fan_path)
+            except PreflightError as e:
+                task_manager.update_task(task_id, probe=e.probe)
+                raise HTTPException(status_code=422, detail=str(e))
+            preflight_seconds = round(time.perf_counter() - preflight_started, 3)
+            observe_stage("preflight", preflight_seconds, engine)
+            
+            task = task_manager.update_task(
+                task_id,
+                fan_sha256=upload["sha256"],
+                probe=probe,
+                timings={"ingest": ingest_seconds, "preflight": preflight_seconds},
+                inputs={"wwe": wwe_path, "fan": fan_path},
+                temp_inputs=[fan_path],
+                timeline=timeline,
+                stream_dirname=f"stream_{task_id}" if streaming or (streaming is None and STREAM_PACKAGING) else None
+            )
+            
+            if result_cache:
+                cache_key = ResultCache.make_key(source["sha256"], upload["sha256"], engine, profile, timeline,
+                                                 from_source=True)
+                task_manager.update_task(task_id, cache_key=cache_key)
+                if result_cache.link_to(cache_key, os.path.join(OUTPUT_DIR, task["output_filename"])):
+                    os.remove(fan_path)
+                    task_manager.update_task(task_id, cache_hit=True)
+                    task = task_manager.update_task_status(task_id, TaskStatus.COMPLETED, progress=100)
+                    if task.get("stream_dirname"):
+                        queue_package_job(task_id)
+                    continue
+            
+            # Queued by dispatch_waiting_tasks once the source is ready and a worker is idle
+            task_manager.update_task(task_id, stage="waiting")
+        except Exception as e:
+            if os.path.exists(fan_path):
+                os.remove(fan_path)
+            error = e.detail if isinstance(e, HTTPException) else str(e)
+            logger.error(f"Batch {batch['id']} item {task_id} failed: {error}")
+            task_manager.update_task_status(task_id, TaskStatus.FAILED, error=error)
+    
+    await run_in_threadpool(dispatch_waiting_tasks)
+    return batch_summary(batch_registry.get_batch(batch["id"]))
+
+@app.get(f"{API_V1_PREFIX}/batches/{{batch_id}}")
+async def get_batch(batch_id: str):
+    """Get a batch with the status of each of its items"""
+    batch = batch_registry.get_batch(batch_id)
+    if not batch:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return batch_summary(batch)
+
+@app.post(f"{API_V1_PREFIX}/batches/{{batch_id}}/cancel")
+async def cancel_batch(batch_id: str):
+    """Cancel every item of a batch that has not finished"""
+    batch = batch_registry.get_batch(batch_id)
+    if not batch:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    for task_id in batch["task_ids"]:
+        try:
+            await cancel_task(task_id)
+        except HTTPException:
+            # Finished items and items already being cancelled stay as they are
+            pass
+    return batch_summary(batch)
+
+def batch_summary(batch: Dict) -> Dict:
+    """A batch with its item tasks, counts by status and an overall status"""
+    tasks = [task for task in (task_manager.get_task(task_id) for task_id in batch["task_ids"]) if task]
+    counts = {status.value: 0 for status in TaskStatus}
+    for task in tasks:
+        counts[task["status"]] += 1
+    if any(task["status"] not in FINAL_STATUSES for task in tasks):
+        status = "processing"
+    elif counts[TaskStatus.COMPLETED.value] == len(tasks):
+        status = "completed"
+    elif counts[TaskStatus.COMPLETED.value]:
+        status = "partial"
+    else:
+        status = "failed"
+    return dict(batch, status=status, counts=counts, tasks=tasks)
+
+def queue_stitch_job(task_id: str, preview: bool = False) -> Dict:
+    """Queue the preview or the full render of a task on the worker pool"""
+    task = task_manager.get_task(task_id)
+    if preview:
+        output_filename, profile, on_done = task["preview_filename"], PREVIEW_PROFILE, on_preview_done
+    else:
+        output_filename, profile, on_done = task["output_filename"], task["profile"], on_job_done
+    
+    # Set before submitting so it never overwrites progress from a fast worker;
+    # the owner is the process whose restart requeues the job
+    task = task_manager.update_task(
+        task_id,
+        stage="queued",
+        rendering="preview" if preview else "full",
+        queued_at=time.time(),
+        owner=task_manager.owner
+    )
+    job_executor.submit(
+        task_id,
+        run_stitch_job,
+        task["inputs"]["wwe"],
+        task["inputs"]["fan"],
+        os.path.join(OUTPUT_DIR, output_filename),
+        task["engine"],
+        profile,
+        task.get("timeline"),
+        # Previews are never packaged for streaming
+        None if preview else stream_path(task),
+        input_checksums(task),
+        on_done=on_done,
+        priority=priority_for(task.get("client_id"), preview=preview, bulk=bool(task.get("batch_id"))),
+        client_id=task.get("client_id")
+    )
+    return task
+
+def input_checksums(task: Dict) -> Dict[str, str]:
+    """SHA-256 of the inputs a job reads, hashed at upload, so workers need not hash them again"""
+    checksums = {"fan": task.get("fan_sha256")}
+    # A registered source is read from its mezzanine copy, not the upload the checksum belongs to
+    if not task.get("wwe_source_id"):
+        checksums["wwe"] = task.get("wwe_sha256")
+    return {name: sha256 for name, sha256 in checksums.items() if sha256}
+
+def stream_path(task: Dict) -> Optional[str]:
+    """Directory of a task's streaming package, if it asked for one"""
+    return os.path.join(OUTPUT_DIR, task["stream_dirname"]) if task.get("stream_dirname") else None
+
+def queue_package_job(task_id: str):
+    """Package an output taken from the result cache, which comes without a streaming package"""
+    task = task_manager.get_task(task_id)
+    try:
+        job_executor.submit(
+            task_id,
+            run_package_job,
+            os.path.join(OUTPUT_DIR, task["output_filename"]),
+            stream_path(task),
+            task["profile"],
+            on_done=on_package_done,
+            priority=priority_for(task.get("client_id"), bulk=bool(task.get("batch_id"))),
+            client_id=task.get("client_id")
+        )
+    except QueueFullError:
+        logger.warning(f"Queue is full, not packaging task {task_id} for streaming")
+        task_manager.update_task(task_id, stream_error="Job queue is full")
+
+def publish_stream(task_id: str):
+    """Expose a finished streaming package on its task"""
+    task = task_manager.get_task(task_id)
     try:
-        # Import here to avoid circular imports
-        from video_stitcher import VideoStitcher
+        with open(os.path.join(stream_path(task), STREAM_INFO)) as f:
+            stream = json.load(f)
+    except (OSError, ValueError):
+        task_manager.update_task(task_id, stream_error="Streaming package is incomplete")
+        return
+    base_url = f"{API_V1_PREFIX}/tasks/{task_id}/stream"
+    urls = {kind: f"{base_url}/{stream[kind]}" for kind in ("hls", "dash", "poster", "sprite", "thumbnails")}
+    task_manager.update_task(task_id, stream_ready=True, stream=dict(urls, renditions=stream["renditions"]))
+
+# Keeps concurrent dispatches from queueing a waiting task twice
+dispatch_lock = threading.Lock()
+
+def dispatch_waiting_tasks():
+    """
+    Queue waiting tasks (batch items and recovered jobs), oldest first, while a worker is idle.
+
+    Batch items never take the queue slots single requests rely on. Runs
+    whenever a worker may have freed up or a source finished normalizing.
+    Items whose source failed fail with it.
+    """
+    with dispatch_lock:
+        for task in task_manager.get_waiting_tasks():
+            # Other API processes sharing the task store dispatch their own
+            if not task_manager.owns(task):
+                continue
+            if task.get("wwe_source_id"):
+                source = source_registry.get_source(task["wwe_source_id"])
+                if not source or source["status"] == SourceStatus.FAILED:
+                    remove_task_inputs(task)
+                    error = source["error"] if source else "Source not found"
+                    task_manager.update_task_status(task["id"], TaskStatus.FAILED, error=f"WWE source failed: {error}")
+                    continue
+                if source["status"] != SourceStatus.READY:
+                    continue
+            if not job_executor.has_idle_worker():
+                break
+            try:
+                queue_stitch_job(task["id"], preview=task.get("rendering") == "preview")
+            except QueueFullError:
+                break
+
+def recover_interrupted_tasks():
+    """
+    Requeue jobs left unfinished by an API process whose lease lapsed.
+
+    Every task records its owner; tasks whose owner stopped renewing its
+    lease are claimed by this process and queued again from the inputs
+    kept on the task, or failed if those inputs are incomplete. Recovered
+    jobs wait for an idle worker like batch items. A task that has
+    already been recovered MAX_JOB_RECOVERIES times is failed instead, in
+    case it is what brought the process down. Jobs still queued or running on a broker
+    lost nothing; they are adopted as they are.
+    """
+    recovered = 0
+    for task in task_manager.get_unfinished_tasks():
+        if task_manager.owner_alive(task.get("owner")):
+            continue
+        task = task_manager.claim_task(task)
+        # Waiting tasks and deferred renders hold no job to lose; they only change hands
+        if not task or task.get("stage") in ("waiting", "preview_ready"):
+            continue
         
-        # Process videos
-        stitcher = VideoStitcher(wwe_path, fan_path)
-        stitcher.stitch_videos(output_path)
+        # Jobs on a broker outlive the API process; this one takes over their events
+        if job_executor.holds(task["id"]):
+            try:
+                queue_stitch_job(task["id"], preview=task.get("rendering") == "preview")
+                logger.info(f"Adopted the queued job of task {task['id']}")
+                continue
+            except QueueFullError:
+                pass
         
-        # Update task status to completed
-        task_manager.update_task_status(task_id, TaskStatus.COMPLETED)
+        inputs = (task.get("inputs") or {}).values()
+        if task.get("stage") == "ingest" or not inputs or not all(os.path.exists(path) for path in inputs):
+            error = "Interrupted by a restart before its inputs were saved"
+        elif task.get("recoveries", 0) >= MAX_JOB_RECOVERIES:
+            error = f"Interrupted by a restart {task.get('recoveries', 0) + 1} times"
+        else:
+            task_manager.update_task(
+                task["id"],
+                stage="waiting",
+                progress=0,
+                queue_position=None,
+                estimated_start=None,
+                recoveries=task.get("recoveries", 0) + 1
+            )
+            task_manager.update_task_status(task["id"], TaskStatus.PENDING)
+            recovered += 1
+            continue
+        remove_task_inputs(task)
+        task_manager.update_task_status(task["id"], TaskStatus.FAILED, error=error)
+    
+    if recovered:
+        logger.info(f"Recovered {recovered} interrupted jobs")
+
+def recover_interrupted_jobs():
+    """Take over the work of API processes whose lease lapsed, then queue what waits"""
+    recover_interrupted_sources()
+    recover_interrupted_tasks()
+    dispatch_waiting_tasks()
+
+def remove_task_inputs(task: Dict):
+    """Delete the uploaded inputs a task kept in TEMP_DIR"""
+    for path in task.get("temp_inputs") or []:
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+        except Exception as e:
+            logger.error(f"Error cleaning up temporary files: {e}")
+
+# Job executor callbacks
+def on_job_started(task_id: str, data: dict):
+    """Mark a task as processing once a worker picks it up"""
+    task = task_manager.get_task(task_id)
+    # The completion callback may already have run for very short jobs
+    if task and task["status"] == TaskStatus.PENDING.value:
+        task_manager.update_task_status(task_id, TaskStatus.PROCESSING)
+    if task and task["status"] not in FINAL_STATUSES:
+        task_manager.update_task(task_id, queue_position=None, estimated_start=None)
+    # A full render queued right after its preview starts while already processing
+    if task and task["status"] not in FINAL_STATUSES and task.get("queued_at"):
+        prefix = "preview_" if task.get("rendering") == "preview" else ""
+        record_timings(task_id, {f"{prefix}queue": round(time.time() - task["queued_at"], 3)}, task.get("engine"))
+
+def on_job_queued(task_id: str, data: dict):
+    """Show a waiting task where it stands in the queue and when it should start"""
+    task = task_manager.get_task(task_id)
+    if task and task["status"] not in FINAL_STATUSES:
+        task_manager.update_task(
+            task_id,
+            queue_position=data["queue_position"],
+            estimated_start=data["estimated_start"]
+        )
+
+def record_timings(task_id: str, timings: dict, engine: Optional[str] = None):
+    """Observe stage durations and merge them into the task's timing breakdown"""
+    for stage, seconds in timings.items():
+        observe_stage(stage, seconds, engine)
+    task = task_manager.get_task(task_id)
+    if task:
+        task_manager.update_task(task_id, timings=dict(task.get("timings") or {}, **timings))
+
+def on_job_timings(task_id: str, data: dict):
+    """Record the per-stage timings a worker measured for its job"""
+    timings = data["timings"]
+    # Keep the preview's stages apart from those of the full render
+    task = task_manager.get_task(task_id)
+    if task and task.get("preview") and data.get("profile") == PREVIEW_PROFILE:
+        timings = {f"preview_{stage}": seconds for stage, seconds in timings.items()}
+    record_timings(task_id, timings, data.get("engine"))
+
+def on_job_progress(task_id: str, data: dict):
+    """Store progress reported by a worker"""
+    task = task_manager.get_task(task_id)
+    # Late events must not overwrite the final state of a task, nor mark a
+    # task waiting for its deferred full render as busy
+    if task and task["status"] not in FINAL_STATUSES and task.get("stage") != "preview_ready":
+        task_manager.update_task(task_id, **data)
+
+def on_job_done(task_id: str, future: Future):
+    """Record the outcome of a finished job and remove its inputs"""
+    try:
+        output_path = future.result()
+        # The package is ready together with the output
+        if task_manager.get_task(task_id).get("stream_dirname"):
+            publish_stream(task_id)
+        task_manager.update_task_status(task_id, TaskStatus.COMPLETED, progress=100)
         
+        # Make the result available to later submissions of the same inputs
+        task = task_manager.get_task(task_id)
+        if result_cache and task and task.get("cache_key"):
+            result_cache.store(task["cache_key"], output_path)
+    except (CancelledError, JobCancelledError):
+        logger.info(f"Task {task_id} was cancelled")
+        task_manager.update_task_status(task_id, TaskStatus.CANCELLED)
     except Exception as e:
         logger.error(f"Error processing videos: {e}")
         task_manager.update_task_status(task_id, TaskStatus.FAILED, error=str(e))
     finally:
         # Cleanup temporary files
+        task = task_manager.get_task(task_id)
+        if task:
+            remove_task_inputs(task)
+        # The finished job freed a worker for a waiting batch item
+        dispatch_waiting_tasks()
+
+def on_preview_done(task_id: str, future: Future):
+    """Publish a finished preview, then queue the full render unless it is deferred"""
+    if future.cancelled() or future.exception():
+        # Cancelled or failed previews end the task like any other job
+        on_job_done(task_id, future)
+        return
+    
+    task = task_manager.update_task(task_id, preview_ready=True)
+    if not task["defer_render"]:
         try:
-            os.remove(wwe_path)
-            os.remove(fan_path)
-        except Exception as e:
-            logger.error(f"Error cleaning up temporary files: {e}")
+            queue_stitch_job(task_id)
+            return
+        except QueueFullError:
+            logger.warning(f"Queue is full, deferring the full render of task {task_id} until download")
+    
+    # Wait for a download before spending CPU on the full render
+    task_manager.update_task(task_id, stage="preview_ready")
+    task_manager.update_task_status(task_id, TaskStatus.PENDING)
+    dispatch_waiting_tasks()
+
+def on_package_done(task_id: str, future: Future):
+    """Publish the streaming package of a task completed from the result cache"""
+    try:
+        future.result()
+        publish_stream(task_id)
+    except (CancelledError, JobCancelledError):
+        logger.info(f"Packaging of task {task_id} was cancelled")
+    except Exception as e:
+        logger.error(f"Error packaging task {task_id} for streaming: {e}")
+        task_manager.update_task(task_id, stream_error=str(e))
+    finally:
+        dispatch_waiting_tasks()
+
+job_executor.on_event("started", on_job_started)
+job_executor.on_event("queued", on_job_queued)
+job_executor.on_event("progress", on_job_progress)
+job_executor.on_event("timings", on_job_timings)
+# Encoder nodes joining a broker can take waiting batch items
+job_executor.on_event("workers", lambda task_id, data: dispatch_waiting_tasks())
 
 # Startup event
 @app.on_event("startup")
@@ -250,24 +1316,40 @@ async def startup_event():
     logger.info("Starting up application...")
     
     try:
-        # Create directories if they don't exist with proper permissions
+        # Create directories if they don't exist, and check their permissions
+        # without writing to them
         for directory in [TEMP_DIR, OUTPUT_DIR]:
             os.makedirs(directory, exist_ok=True)
-            # Ensure directory is writable
-            test_file = os.path.join(directory, "test.txt")
-            with open(test_file, "w") as f:
-                f.write("test")
-            os.remove(test_file)
+            if not os.access(directory, os.W_OK | os.X_OK):
+                raise PermissionError(f"Directory {directory} is not writable")
             logger.info(f"Directory {directory} is ready")
         
-        # Clean up old tasks
-        task_manager.cleanup_old_tasks()
+        # Clean up old tasks and orphaned files, then keep doing so periodically
+        storage_manager.start()
+        
+        # Start the encoder worker pool; its processes warm up in the background
+        task_events.bind(asyncio.get_running_loop())
+        job_executor.start()
+        
+        # Jobs interrupted by the last shutdown, then everything left waiting; the
+        # lease makes this process's tasks its own and keeps recovering lapsed ones
+        task_manager.start_lease(on_renew=recover_interrupted_jobs)
+        recover_interrupted_jobs()
         
         logger.info("Application startup complete")
     except Exception as e:
         logger.error(f"Error during startup: {str(e)}")
         raise
 
+# Shutdown event
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background workers on shutdown"""
+    logger.info("Shutting down application...")
+    storage_manager.stop()
+    job_executor.shutdown()
+    task_manager.stop_lease()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
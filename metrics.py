@@ -0,0 +1,121 @@
+import os
+import time
+import logging
+from typing import Dict, Optional
+
+import psutil
+from prometheus_client import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+# Job stages are seconds to minutes long, so the default HTTP-sized buckets are too fine
+STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+
+STAGE_SECONDS = Histogram(
+    "video_stitcher_stage_seconds",
+    "Time spent in each stage of a job (ingest, preflight, queue, probe, segments, encode, mux, normalize)",
+    ["stage", "engine"],
+    buckets=STAGE_BUCKETS
+)
+
+TASK_TRANSITIONS = Counter(
+    "video_stitcher_task_transitions_total",
+    "Tasks entering each status",
+    ["status"]
+)
+
+JOBS_IN_FLIGHT = Gauge(
+    "video_stitcher_jobs_in_flight",
+    "Jobs admitted to the worker pool, by state",
+    ["state"]
+)
+
+TEMP_DIR_BYTES = Gauge(
+    "video_stitcher_temp_dir_bytes",
+    "Bytes of uploads and intermediates in the temp directory"
+)
+
+STORAGE_RECLAIMED_BYTES = Counter(
+    "video_stitcher_storage_reclaimed_bytes_total",
+    "Bytes freed by the storage reaper, by reason (orphan, scratch, quota)",
+    ["reason"]
+)
+
+PROCESS_RSS_BYTES = Gauge(
+    "video_stitcher_process_rss_bytes",
+    "Resident memory of the API process and of its worker processes",
+    ["process"]
+)
+
+
+class StageTimer:
+    """
+    Accumulates wall-clock time per stage of a job.
+
+    Starting a stage ends the one before it, so linear code only marks
+    where each stage begins. Runs inside worker processes; the totals are
+    sent back to the API process which records them.
+    """
+
+    def __init__(self):
+        self.timings: Dict[str, float] = {}
+        self._stage: Optional[str] = None
+        self._started = 0.0
+
+    def start(self, stage: str) -> None:
+        self.stop()
+        self._stage = stage
+        self._started = time.perf_counter()
+
+    def stop(self) -> None:
+        if self._stage is None:
+            return
+        elapsed = time.perf_counter() - self._started
+        self.timings[self._stage] = round(self.timings.get(self._stage, 0.0) + elapsed, 3)
+        self._stage = None
+
+
+def observe_stage(stage: str, seconds: float, engine: Optional[str] = None) -> None:
+    STAGE_SECONDS.labels(stage=stage, engine=engine or "none").observe(seconds)
+
+
+def count_transition(status: str) -> None:
+    TASK_TRANSITIONS.labels(status=status).inc()
+
+
+def directory_size(path: str) -> int:
+    """Total size of the files under path"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                # Temp files come and go while jobs run
+                pass
+    return total
+
+
+def process_rss(children: bool = False) -> int:
+    """RSS of this process, or the summed RSS of all its descendants"""
+    process = psutil.Process()
+    if not children:
+        return process.memory_info().rss
+    total = 0
+    for child in process.children(recursive=True):
+        try:
+            total += child.memory_info().rss
+        except psutil.Error:
+            pass
+    return total
+
+
+def register_gauges(job_executor, temp_dir: str) -> None:
+    """Compute the gauges from live state whenever /metrics is scraped"""
+    JOBS_IN_FLIGHT.labels(state="running").set_function(job_executor.running_jobs)
+    JOBS_IN_FLIGHT.labels(state="queued").set_function(
+        lambda: job_executor.active_jobs() - job_executor.running_jobs()
+    )
+    TEMP_DIR_BYTES.set_function(lambda: directory_size(temp_dir))
+    PROCESS_RSS_BYTES.labels(process="api").set_function(process_rss)
+    PROCESS_RSS_BYTES.labels(process="workers").set_function(lambda: process_rss(children=True))
@@ -0,0 +1,92 @@
+import os
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from ffmpeg_utils import probe_media
+import stitch_plan
+
+logger = logging.getLogger(__name__)
+
+# Longest input accepted, in seconds
+MAX_INPUT_DURATION = float(os.getenv('MAX_INPUT_DURATION', '600'))
+
+# Largest input frame accepted
+MAX_INPUT_WIDTH = int(os.getenv('MAX_INPUT_WIDTH', '3840'))
+MAX_INPUT_HEIGHT = int(os.getenv('MAX_INPUT_HEIGHT', '2160'))
+
+# Reject fan clips without a commentary track instead of only flagging them
+REQUIRE_FAN_AUDIO = os.getenv('REQUIRE_FAN_AUDIO', 'true').lower() == 'true'
+
+
+class PreflightError(ValueError):
+    """Raised when an input cannot be stitched; carries every problem found and the probe"""
+
+    def __init__(self, errors: List[str], probe: Dict):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+        self.probe = probe
+
+
+def required_duration(video_type: str, timeline: Optional[Dict] = None) -> float:
+    """Seconds of a source the timeline (the default plan unless given) reads"""
+    return stitch_plan.required_duration(timeline or stitch_plan.default_timeline(), video_type)
+
+
+def check_input(video_type: str, info: Dict, timeline: Optional[Dict] = None) -> Tuple[List[str], List[str]]:
+    """Errors and warnings for one probed input"""
+    timeline = timeline or stitch_plan.default_timeline()
+    label = "WWE" if video_type == "wwe" else "Fan"
+    errors, warnings = [], []
+
+    if not info.get("video_codec"):
+        errors.append(f"{label} video has no video stream")
+    needed = required_duration(video_type, timeline)
+    if info["duration"] < needed:
+        errors.append(f"{label} video is {info['duration']:.2f}s long, the timeline needs {needed:g}s")
+    if info["duration"] > MAX_INPUT_DURATION:
+        errors.append(f"{label} video is {info['duration']:.0f}s long, the limit is {MAX_INPUT_DURATION:g}s")
+    width, height = info.get("width"), info.get("height")
+    if width and height and (width > MAX_INPUT_WIDTH or height > MAX_INPUT_HEIGHT):
+        errors.append(f"{label} video is {width}x{height}, the limit is {MAX_INPUT_WIDTH}x{MAX_INPUT_HEIGHT}")
+    if not info.get("fps"):
+        warnings.append(f"{label} video has no frame rate in its metadata")
+
+    uses_audio = any(audio_range["source"] == video_type for audio_range in timeline["audio"])
+    if uses_audio and not info.get("has_audio"):
+        if video_type == "fan":
+            message = "Fan video has no audio track for the commentary"
+            (errors if REQUIRE_FAN_AUDIO else warnings).append(message)
+        else:
+            errors.append(f"{label} video has no audio track for the timeline's audio ranges")
+    return errors, warnings
+
+
+def preflight_inputs(timeline: Optional[Dict] = None, **paths: str) -> Dict:
+    """
+    Check inputs against a compiled timeline and limits from their metadata alone.
+
+    Inputs are passed by source name, e.g. wwe=path, fan=path; timeline
+    defaults to the standard segment plan. Nothing is
+    decoded, so this takes milliseconds where a doomed encode would hold a
+    worker for minutes. Returns the probe of each input plus any warnings,
+    and raises PreflightError with that same result when an input must be
+    rejected.
+    """
+    result = {"warnings": []}
+    errors = []
+    for video_type, path in paths.items():
+        try:
+            info = probe_media(path)
+        except Exception as e:
+            logger.warning(f"Could not probe {video_type} input {path}: {e}")
+            result[video_type] = None
+            errors.append(f"{'WWE' if video_type == 'wwe' else 'Fan'} video could not be read")
+            continue
+        result[video_type] = info
+        input_errors, input_warnings = check_input(video_type, info, timeline)
+        errors += input_errors
+        result["warnings"] += input_warnings
+
+    if errors:
+        raise PreflightError(errors, result)
+    return result
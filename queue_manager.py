@@ -1 +1,156 @@
- 
\ No newline at end of file
+import os
+import time
+import heapq
+import logging
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Priority classes, most urgent first
+PRIORITY_CLASSES = ("preview", "paid", "standard", "bulk")
+DEFAULT_PRIORITY = "standard"
+
+# Seconds of waiting that promote a job by one priority class, so bulk work is never starved
+PRIORITY_AGING_SECONDS = float(os.getenv('PRIORITY_AGING_SECONDS', '60'))
+
+# Assumed job length until enough jobs have finished to measure it
+ESTIMATED_JOB_SECONDS = float(os.getenv('ESTIMATED_JOB_SECONDS', '60'))
+
+# API keys sent in X-API-Key, as comma separated key:client_id pairs; a key
+# is the only way a request can name its client
+API_KEYS = dict(
+    pair.strip().split(":", 1) for pair in os.getenv('API_KEYS', '').split(',') if ":" in pair
+)
+
+# Clients whose jobs run in the paid class, by the client ID of their API key
+PRIORITY_CLIENTS = {client.strip() for client in os.getenv('PRIORITY_CLIENTS', '').split(',') if client.strip()}
+
+# Seconds over which a client's past usage counts half as much against its turn
+FAIR_SHARE_HALF_LIFE = float(os.getenv('FAIR_SHARE_HALF_LIFE', '300'))
+
+# Weight of the latest job in the running average of job durations
+DURATION_SMOOTHING = 0.2
+
+
+def client_for_key(api_key: Optional[str]) -> Optional[str]:
+    """Client ID an API key belongs to; None for missing or unknown keys"""
+    return API_KEYS.get(api_key) if api_key else None
+
+
+def priority_for(client_id: Optional[str], preview: bool = False, bulk: bool = False) -> str:
+    """Priority class of a job from what it renders and who asked for it"""
+    if preview:
+        return "preview"
+    if bulk:
+        return "bulk"
+    if client_id and client_id in PRIORITY_CLIENTS:
+        return "paid"
+    return DEFAULT_PRIORITY
+
+
+class JobScheduler:
+    """
+    Decides which waiting job a free worker takes next.
+
+    Jobs are ordered by priority class, with every PRIORITY_AGING_SECONDS
+    of waiting promoting a job by one class. Within a class, the client
+    that started the fewest jobs recently goes first. Each start counts
+    one, halving every FAIR_SHARE_HALF_LIFE seconds, and jobs already
+    picked ahead in the queue count too. So one client submitting many
+    jobs takes turns with the others instead of holding every worker.
+    Ties go to the oldest job.
+
+    Not thread-safe; JobExecutor calls it under its own lock, and the
+    SQLite broker rebuilds one inside each transaction.
+    """
+
+    def __init__(self, aging_seconds: Optional[float] = None, estimated_job_seconds: Optional[float] = None):
+        self.aging_seconds = aging_seconds or PRIORITY_AGING_SECONDS
+        self.average_job_seconds = estimated_job_seconds or ESTIMATED_JOB_SECONDS
+        self._jobs: Dict[str, Dict] = {}
+        self._usage: Dict[str, float] = {}
+        self._usage_at = time.time()
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def push(self, task_id: str, priority: str = DEFAULT_PRIORITY, client_id: Optional[str] = None,
+             enqueued_at: Optional[float] = None, **data) -> Dict:
+        """Add a job; data is kept on the entry for the caller"""
+        if priority not in PRIORITY_CLASSES:
+            raise ValueError(f"Unknown priority class '{priority}'")
+        job = dict(data, task_id=task_id, priority=priority, client_id=client_id or "anonymous",
+                   enqueued_at=enqueued_at or time.time())
+        self._jobs[task_id] = job
+        return job
+
+    def remove(self, task_id: str) -> Optional[Dict]:
+        return self._jobs.pop(task_id, None)
+
+    def effective_rank(self, job: Dict, now: float) -> int:
+        """Priority class index after aging; lower runs first"""
+        waited = now - job["enqueued_at"]
+        return max(0, PRIORITY_CLASSES.index(job["priority"]) - int(waited // self.aging_seconds))
+
+    def _decay_usage(self, now: float) -> None:
+        factor = 0.5 ** ((now - self._usage_at) / FAIR_SHARE_HALF_LIFE)
+        self._usage = {client: usage * factor for client, usage in self._usage.items() if usage * factor > 0.01}
+        self._usage_at = now
+
+    def order(self, now: Optional[float] = None) -> List[Dict]:
+        """Waiting jobs in the order workers will take them"""
+        now = now or time.time()
+        self._decay_usage(now)
+        share = dict(self._usage)
+        remaining = list(self._jobs.values())
+        ordered = []
+        while remaining:
+            # Each pick counts against its client, so clients alternate within a class
+            job = min(remaining, key=lambda j: (
+                self.effective_rank(j, now), share.get(j["client_id"], 0), j["enqueued_at"]
+            ))
+            remaining.remove(job)
+            share[job["client_id"]] = share.get(job["client_id"], 0) + 1
+            ordered.append(job)
+        return ordered
+
+    def pop_next(self) -> Optional[Dict]:
+        """Remove and return the job a free worker should take, counting it against its client"""
+        ordered = self.order()
+        if not ordered:
+            return None
+        job = self._jobs.pop(ordered[0]["task_id"])
+        self._usage[job["client_id"]] = self._usage.get(job["client_id"], 0.0) + 1
+        return job
+
+    def export_state(self) -> Dict:
+        """Client usage and the average job length, for a scheduler rebuilt in another process"""
+        return {"usage": self._usage, "usage_at": self._usage_at, "average_job_seconds": self.average_job_seconds}
+
+    def import_state(self, state: Dict) -> None:
+        self._usage = dict(state.get("usage") or {})
+        self._usage_at = state.get("usage_at") or time.time()
+        self.average_job_seconds = state.get("average_job_seconds") or self.average_job_seconds
+
+    def record_duration(self, seconds: float) -> None:
+        """Fold a finished job's run time into the average used for estimates"""
+        self.average_job_seconds += DURATION_SMOOTHING * (seconds - self.average_job_seconds)
+
+    def estimates(self, running_started: List[float], workers: int, now: Optional[float] = None) -> List[Dict]:
+        """
+        Queue position (1-based) and estimated start time of every waiting job.
+
+        Each worker frees up when its current job reaches the average
+        duration (or now, if idle or overdue); waiting jobs take the
+        earliest free worker in queue order.
+        """
+        now = now or time.time()
+        free_at = [max(now, started + self.average_job_seconds) for started in running_started]
+        free_at += [now] * max(0, workers - len(free_at))
+        heapq.heapify(free_at)
+        result = []
+        for position, job in enumerate(self.order(now), start=1):
+            start = heapq.heappop(free_at)
+            heapq.heappush(free_at, start + self.average_job_seconds)
+            result.append({"task_id": job["task_id"], "queue_position": position, "estimated_start": round(start, 1)})
+        return result
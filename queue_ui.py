@@ -1 +1,63 @@
- 
\ No newline at end of file
+import hmac
+import hashlib
+import secrets
+from typing import Callable, Dict, Optional
+
+from fastapi import APIRouter, Request
+from fastapi.responses import HTMLResponse
+from fastapi.templating import Jinja2Templates
+
+
+# Keys the client labels; a fresh one per process, so labels cannot be matched to addresses offline
+_LABEL_KEY = secrets.token_bytes(16)
+
+
+def client_label(client_id: Optional[str]) -> Optional[str]:
+    """A short label telling a client's jobs apart without revealing its address or API key identity"""
+    if not client_id:
+        return None
+    return hmac.new(_LABEL_KEY, client_id.encode(), hashlib.sha256).hexdigest()[:8]
+
+
+def create_queue_router(job_executor, task_manager, templates: Jinja2Templates, api_prefix: str,
+                        client_id_for: Callable[[Request], str]) -> APIRouter:
+    """
+    Routes showing the job queue: a JSON snapshot and a page that polls it.
+
+    The snapshot lists running jobs and waiting jobs in the order workers
+    will take them, each joined with its task's filenames, stage and
+    progress. Clients appear only as a client_label, and jobs of the
+    caller (as client_id_for names it) are marked as theirs.
+    """
+    router = APIRouter()
+
+    def describe(job: Dict, caller: str) -> Dict:
+        task = task_manager.get_task(job["task_id"]) or {}
+        job = dict(job)
+        client_id = job.pop("client_id", None)
+        return dict(
+            job,
+            client=client_label(client_id),
+            mine=client_id == caller,
+            wwe_filename=task.get("wwe_filename"),
+            fan_filename=task.get("fan_filename"),
+            rendering=task.get("rendering"),
+            stage=task.get("stage"),
+            progress=task.get("progress"),
+        )
+
+    @router.get(f"{api_prefix}/queue")
+    async def queue_snapshot(request: Request):
+        """Running and waiting jobs with their priority, client label and estimated start"""
+        caller = client_id_for(request)
+        snapshot = job_executor.snapshot()
+        snapshot["running"] = [describe(job, caller) for job in snapshot["running"]]
+        snapshot["queued"] = [describe(job, caller) for job in snapshot["queued"]]
+        return snapshot
+
+    @router.get("/queue", response_class=HTMLResponse)
+    async def queue_page(request: Request):
+        """Live view of the job queue"""
+        return templates.TemplateResponse("queue.html", {"request": request, "api_prefix": api_prefix})
+
+    return router
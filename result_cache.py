@@ -0,0 +1,151 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+from typing import Dict, List, Optional
+
+from audio_track import loudness_settings
+from source_registry import mezzanine_settings
+from stitch_plan import default_timeline, output_settings
+
+logger = logging.getLogger(__name__)
+
+
+def link_or_copy(src: str, dest: str) -> None:
+    """Hard-link src to dest, falling back to a copy across filesystems"""
+    tmp_dest = f"{dest}.tmp"
+    try:
+        os.link(src, tmp_dest)
+    except OSError:
+        shutil.copyfile(src, tmp_dest)
+    os.replace(tmp_dest, dest)
+
+
+class ResultCache:
+    """
+    Content-addressed cache of stitched outputs.
+
+    Entries are keyed by the hashes of both inputs plus everything that
+    affects the encode (target size, fps, bitrates, segment plan, engine)
+    and stored as hard links under cache_dir, so a cached result survives
+    the removal of the task that produced it. File modification times
+    double as the LRU clock: every hit touches the entry and eviction
+    removes the least recently used entries until the cache fits its limits.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int, max_entries: Optional[int] = None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(wwe_sha256: str, fan_sha256: str, engine: str, profile: Optional[str] = None,
+                 timeline: Optional[Dict] = None, from_source: bool = False) -> str:
+        """
+        Cache key for a pair of inputs rendered along a compiled timeline with an encoding profile.
+
+        from_source tells that the WWE clip is read from a registered
+        source's mezzanine copy, whose encoder settings the smart engine
+        uses instead of the profile's.
+        """
+        settings = output_settings(profile)
+        key_data = {
+            "wwe": wwe_sha256,
+            "fan": fan_sha256,
+            "engine": engine,
+            "size": list(settings["target_size"]),
+            "fps": settings["target_fps"],
+            "video_bitrate": settings["video_bitrate"],
+            "crf": settings["crf"],
+            "tune": settings["tune"],
+            "audio_bitrate": settings["audio_bitrate"],
+            "preset": settings["encoder_preset"],
+            "timeline": timeline or default_timeline(),
+        }
+        # Only when on, so keys from before loudness normalisation stay valid
+        if loudness_settings():
+            key_data["loudness"] = loudness_settings()
+        if engine == "smart" and from_source and mezzanine_settings(profile):
+            key_data["mezzanine"] = mezzanine_settings(profile)
+        return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode()).hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.mp4")
+
+    def lookup(self, key: str) -> Optional[str]:
+        """Return the cached file for key, marking it as recently used"""
+        path = self._entry_path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return path
+
+    def link_to(self, key: str, dest_path: str) -> bool:
+        """Materialise the cached result for key at dest_path, returning False on a miss"""
+        path = self.lookup(key)
+        if not path:
+            return False
+        try:
+            link_or_copy(path, dest_path)
+        except OSError as e:
+            logger.error(f"Error linking cached result {key}: {e}")
+            return False
+        logger.info(f"Result cache hit for {key}")
+        return True
+
+    def store(self, key: str, output_path: str) -> None:
+        """Add a freshly rendered output to the cache"""
+        try:
+            link_or_copy(output_path, self._entry_path(key))
+            logger.info(f"Stored result {key} in cache")
+        except OSError as e:
+            logger.error(f"Error storing result {key} in cache: {e}")
+            return
+        self.evict()
+
+    def remove(self, key: str) -> bool:
+        """Drop the entry for key, e.g. with the task output it shares its data with"""
+        try:
+            os.remove(self._entry_path(key))
+        except FileNotFoundError:
+            return False
+        logger.info(f"Removed cached result {key}")
+        return True
+
+    def entries(self) -> List[Dict]:
+        """Cached entries, least recently used first"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".mp4"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append({"key": name[:-4], "path": path, "size": stat.st_size, "last_used": stat.st_mtime})
+        return sorted(entries, key=lambda x: x["last_used"])
+
+    def evict(self) -> int:
+        """Remove least recently used entries until the cache is within its limits"""
+        entries = self.entries()
+        total_bytes = sum(entry["size"] for entry in entries)
+        removed = 0
+        while entries and (
+            total_bytes > self.max_bytes
+            or (self.max_entries is not None and len(entries) > self.max_entries)
+        ):
+            entry = entries.pop(0)
+            try:
+                os.remove(entry["path"])
+                total_bytes -= entry["size"]
+                removed += 1
+                logger.info(f"Evicted cached result {entry['key']}")
+            except OSError as e:
+                logger.error(f"Error evicting cached result {entry['key']}: {e}")
+        return removed
@@ -0,0 +1,205 @@
+import os
+import shutil
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional
+
+from ffmpeg_stitcher import FFmpegStitcher, frame_lead
+from ffmpeg_utils import run_ffmpeg
+from source_registry import MEZZANINE_CRF, MEZZANINE_PRESET, mezzanine_tag
+from stitch_plan import FFMPEG_OUTPUT_PARAMS, keyframe_times, snap_to_frame
+
+logger = logging.getLogger(__name__)
+
+
+class SmartStitcher(FFmpegStitcher):
+    """
+    Stitcher that only re-encodes what the timeline actually changes.
+
+    Segments taken from a conforming mezzanine source (see
+    source_registry.normalize_source) are split at their fade windows: the
+    windows are re-encoded with the mezzanine's encoder settings and the
+    keyframe-aligned middle is stream-copied. Everything else is
+    re-encoded piece by piece, and the pieces are joined with the concat
+    demuxer without another encode. When nothing lines up with the
+    mezzanine's keyframes there is nothing to copy and the single-pass
+    FFmpegStitcher render is used instead.
+    """
+
+    def is_conforming(self, video_type: str) -> bool:
+        """Whether a source can be stream-copied into the output as is"""
+        info = self.source_info[video_type]
+        # Profiles that scale the output down cannot reuse the mezzanine's frames
+        return info.get("comment") == mezzanine_tag() and (info["width"], info["height"]) == tuple(self.target_size)
+
+    def plan_pieces(self) -> List[Dict]:
+        """
+        Split the timeline into pieces that are either copied or encoded.
+
+        Window edges are snapped to frame boundaries. A middle is only
+        copied when both its edges fall on forced keyframes of the mezzanine
+        copy, which holds for the default plan; custom timelines that cut
+        elsewhere have those segments encoded.
+        """
+        pieces = []
+        keyframes = keyframe_times("wwe", self.target_fps)
+
+        def on_keyframe(t: float) -> bool:
+            return any(abs(t - keyframe) < 1e-6 for keyframe in keyframes)
+
+        for i, segment in enumerate(self.timeline["segments"]):
+            video_type = segment["source"]
+            start_time = segment["in"]
+            source_duration = self.source_info[video_type]["duration"]
+            end_time = min(segment["out"], source_duration)
+            if end_time <= start_time:
+                raise ValueError(
+                    f"{video_type} video is too short for segment {i + 1} "
+                    f"({source_duration:.2f}s, segment starts at {start_time}s)"
+                )
+
+            piece = {"source": video_type, "fade_in": segment["fade_in"], "fade_out": segment["fade_out"]}
+            if not self.is_conforming(video_type):
+                pieces.append(dict(piece, start=start_time, end=end_time, copy=False))
+                continue
+
+            body_start = snap_to_frame(start_time + segment["fade_in"], self.target_fps) if segment["fade_in"] else start_time
+            body_end = snap_to_frame(end_time - segment["fade_out"], self.target_fps) if segment["fade_out"] else end_time
+            if body_end - body_start < 1.0 / self.target_fps or not (on_keyframe(body_start) and on_keyframe(body_end)):
+                pieces.append(dict(piece, start=start_time, end=end_time, copy=False))
+                continue
+
+            if body_start > start_time:
+                pieces.append(dict(piece, start=start_time, end=body_start, copy=False, fade_out=0.0))
+            pieces.append({"source": video_type, "start": body_start, "end": body_end, "copy": True,
+                           "fade_in": 0.0, "fade_out": 0.0})
+            if body_end < end_time:
+                pieces.append(dict(piece, start=body_end, end=end_time, copy=False, fade_in=0.0))
+        return pieces
+
+    def render_piece(self, piece: Dict, output_path: str, should_cancel: Optional[Callable[[], bool]] = None) -> None:
+        """Copy or encode one piece of the timeline"""
+        duration = piece["end"] - piece["start"]
+        source_path = self.sources[piece["source"]]
+
+        if piece["copy"]:
+            run_ffmpeg([
+                '-ss', f"{piece['start']:.6f}",
+                '-i', source_path,
+                # Count frames rather than time: the piece spans whole closed
+                # GOPs, so exactly this many packets follow its keyframe
+                '-frames:v', str(round(duration * self.target_fps)),
+                '-map', '0:v:0',
+                '-c', 'copy',
+                '-avoid_negative_ts', 'make_zero',
+                '-y',
+                output_path
+            ], should_cancel=should_cancel)
+            return
+
+        # Same frame choice as FFmpegStitcher.build_command
+        lead = frame_lead(piece["start"], self.source_info[piece["source"]].get("fps"))
+        width, height = self.target_size
+        chain = [
+            f"setpts=PTS-STARTPTS-{lead:.6f}/TB",
+            f"scale={width}:{height}",
+            'setsar=1',
+            f"fps={self.target_fps}:round=up",
+            f"trim=end_frame={round(duration * self.target_fps)}",
+        ]
+        if piece["fade_in"]:
+            chain.append(f"fade=t=in:st=0:d={piece['fade_in']}")
+        if piece["fade_out"]:
+            chain.append(f"fade=t=out:st={max(duration - piece['fade_out'], 0):.6f}:d={piece['fade_out']}")
+
+        # Same encoder settings as the mezzanine so the pieces concatenate cleanly,
+        # whatever the profile's rate control (see source_registry.mezzanine_settings)
+        run_ffmpeg([
+            '-ss', f"{piece['start'] - lead:.6f}",
+            '-t', f"{duration + lead:.6f}",
+            '-i', source_path,
+            '-vf', ','.join(chain),
+            '-an',
+            '-c:v', 'libx264',
+            '-preset', MEZZANINE_PRESET,
+            '-crf', MEZZANINE_CRF,
+            '-g', str(self.target_fps),
+            '-sc_threshold', '0',
+            '-threads', '1',
+            *FFMPEG_OUTPUT_PARAMS,
+            output_path
+        ], should_cancel=should_cancel)
+
+    def stitch_videos(self, output_path, should_cancel: Optional[Callable[[], bool]] = None,
+                      on_progress: Optional[Callable] = None):
+        """
+        Stitch the videos, stream-copying untouched ranges of conforming sources.
+
+        on_progress(stage, done, total) receives the frames of finished pieces.
+        """
+        self.timer.start("segments")
+        pieces = self.plan_pieces()
+        if not any(piece["copy"] for piece in pieces):
+            logger.info("No conforming sources to copy from, rendering in a single pass")
+            return super().stitch_videos(output_path, should_cancel=should_cancel, on_progress=on_progress)
+
+        try:
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+            copied = sum(piece["end"] - piece["start"] for piece in pieces if piece["copy"])
+            logger.info(f"Smart render: {len(pieces)} pieces, {copied:.2f}s stream-copied")
+
+            # Pieces are independent, so the short re-encodes run side by side
+            self.timer.start("encode")
+            piece_paths = [os.path.join(self.temp_dir, f"piece_{i:03d}.mp4") for i in range(len(pieces))]
+            piece_frames = [round((piece["end"] - piece["start"]) * self.target_fps) for piece in pieces]
+            total_frames = sum(piece_frames)
+            frames_done = 0
+            with ThreadPoolExecutor(max_workers=max(1, self.encoder_threads)) as pool:
+                futures = {
+                    pool.submit(self.render_piece, piece, path, should_cancel): frames
+                    for piece, path, frames in zip(pieces, piece_paths, piece_frames)
+                }
+                for future in as_completed(futures):
+                    future.result()
+                    frames_done += futures[future]
+                    if on_progress:
+                        on_progress("encode", frames_done, total_frames)
+
+            list_path = os.path.join(self.temp_dir, "pieces.txt")
+            with open(list_path, "w") as f:
+                for path in piece_paths:
+                    f.write(f"file '{path}'\n")
+
+            total_duration = sum(piece["end"] - piece["start"] for piece in pieces)
+            args = ['-f', 'concat', '-safe', '0', '-i', list_path]
+            maps = ['-map', '0:v']
+            audio_inputs, audio_filters, audio_maps = self.build_audio(1, total_duration, should_cancel)
+            args += audio_inputs
+            if audio_filters:
+                args += ['-filter_complex', ';'.join(audio_filters)]
+            maps += audio_maps
+
+            temp_output = os.path.join(self.temp_dir, "temp_output.mp4")
+            logger.info(f"Writing final video to: {temp_output}")
+            self.timer.start("mux")
+            if on_progress:
+                on_progress("mux")
+            run_ffmpeg(args + maps + [
+                '-c:v', 'copy',
+                '-t', f"{total_duration:.6f}",
+                '-movflags', '+faststart',
+                '-y',
+                temp_output
+            ], should_cancel=should_cancel)
+
+            shutil.move(temp_output, output_path)
+            logger.info(f"Moved processed video to: {output_path}")
+            logger.info("Video processing completed successfully")
+
+        except Exception as e:
+            logger.error(f"Error stitching videos: {str(e)}")
+            raise
+        finally:
+            self.timer.stop()
+            self.cleanup()
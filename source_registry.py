@@ -0,0 +1,201 @@
+import os
+import json
+import time
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from ffmpeg_utils import run_ffmpeg
+from stitch_plan import FFMPEG_OUTPUT_PARAMS, keyframe_times, output_settings
+
+logger = logging.getLogger(__name__)
+
+# Quality of the mezzanine copies; they are re-encoded again when stitched
+MEZZANINE_CRF = os.getenv('MEZZANINE_CRF', '16')
+MEZZANINE_PRESET = os.getenv('MEZZANINE_PRESET', 'veryfast')
+
+# Bumped whenever the mezzanine encoding changes so stale copies are not reused as is
+MEZZANINE_VERSION = 2
+
+
+class SourceStatus:
+    PROCESSING = "processing"
+    READY = "ready"
+    FAILED = "failed"
+
+
+def mezzanine_tag() -> str:
+    """
+    Comment tag written into mezzanine copies.
+
+    It records the encoding version and settings, so a stitcher can tell
+    whether a file can be stream-copied into output at the current settings.
+    """
+    settings = output_settings("standard")
+    width, height = settings["target_size"]
+    return f"stitcher-mezzanine v{MEZZANINE_VERSION} {width}x{height}@{settings['target_fps']} {MEZZANINE_PRESET}"
+
+
+def mezzanine_settings(profile: Optional[str] = None) -> Optional[Dict]:
+    """
+    Encoder settings that replace the profile's in smart renders from a registered source.
+
+    Copied ranges keep the mezzanine's quality and the re-encoded pieces
+    match it so they concatenate. None when the profile's output size
+    differs from the mezzanine's: nothing can be copied then, and the
+    profile's own settings apply.
+    """
+    if output_settings(profile)["target_size"] != output_settings("standard")["target_size"]:
+        return None
+    return {"crf": MEZZANINE_CRF, "preset": MEZZANINE_PRESET}
+
+
+def normalize_source(input_path: str, output_path: str, should_cancel=None) -> None:
+    """
+    Encode a WWE clip into a mezzanine copy at the target size and frame rate.
+
+    The copy has a fixed one-second GOP and forced keyframes at every cut
+    point of the segment plan, so later jobs can use it without resizing
+    and seek to segment boundaries exactly. Audio is dropped since the
+    stitched video always carries the fan audio.
+    """
+    settings = output_settings("standard")
+    width, height = settings["target_size"]
+    fps = settings["target_fps"]
+    keyframes = ",".join(f"{t:.6f}" for t in keyframe_times("wwe", fps))
+
+    # Shares the output parameters of the final encode so the parameter
+    # sets match and untouched ranges can be stream-copied
+    tmp_output = f"{output_path}.tmp.mp4"
+    run_ffmpeg([
+        '-i', input_path,
+        '-vf', f"scale={width}:{height},setsar=1,fps={fps}",
+        '-an',
+        '-c:v', 'libx264',
+        '-preset', MEZZANINE_PRESET,
+        '-crf', MEZZANINE_CRF,
+        '-g', str(fps),
+        '-keyint_min', str(fps),
+        '-sc_threshold', '0',
+        '-force_key_frames', keyframes,
+        '-threads', str(settings["encoder_threads"]),
+        '-metadata', f"comment={mezzanine_tag()}",
+        *FFMPEG_OUTPUT_PARAMS,
+        tmp_output
+    ], should_cancel=should_cancel)
+    os.replace(tmp_output, output_path)
+
+
+def run_normalize_job(context, input_path: str, output_path: str) -> str:
+    """Normalize a registered source inside a worker process"""
+    context.check_cancelled()
+    context.report("started", pid=os.getpid())
+    start = time.perf_counter()
+    try:
+        normalize_source(input_path, output_path, should_cancel=context.is_cancelled)
+    finally:
+        context.report("timings", engine=None, timings={"normalize": round(time.perf_counter() - start, 3)})
+    return output_path
+
+
+class SourceRegistry:
+    """
+    Registry of WWE source clips normalized once and shared across jobs.
+
+    Sources are identified by the SHA-256 of the uploaded file, so
+    registering the same clip twice returns the existing entry. Each
+    source is described by a JSON record next to its mezzanine file in
+    sources_dir, which keeps the registry intact across restarts.
+    """
+
+    def __init__(self, sources_dir: str):
+        self.sources_dir = sources_dir
+        self._lock = threading.Lock()
+        os.makedirs(sources_dir, exist_ok=True)
+
+    def _record_path(self, source_id: str) -> str:
+        return os.path.join(self.sources_dir, f"{source_id}.json")
+
+    def mezzanine_path(self, source_id: str) -> str:
+        return os.path.join(self.sources_dir, f"{source_id}.mp4")
+
+    def _save(self, source: Dict) -> None:
+        tmp_path = f"{self._record_path(source['id'])}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(source, f)
+        os.replace(tmp_path, self._record_path(source["id"]))
+
+    def get_source(self, source_id: str) -> Optional[Dict]:
+        """Get a source by ID"""
+        # IDs are hex digests; anything else cannot name a record
+        if not source_id.isalnum():
+            return None
+        try:
+            with open(self._record_path(source_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def get_all_sources(self) -> List[Dict]:
+        """Get all registered sources, newest first"""
+        sources = []
+        for name in os.listdir(self.sources_dir):
+            if name.endswith(".json"):
+                source = self.get_source(name[:-5])
+                if source:
+                    sources.append(source)
+        return sorted(sources, key=lambda x: x["created_at"], reverse=True)
+
+    def register(self, sha256: str, filename: str, upload_path: Optional[str] = None,
+                 owner: Optional[Dict] = None) -> Tuple[Dict, bool]:
+        """
+        Create the record for a source.
+
+        Returns the record and whether it is new; an existing source that
+        is ready or still processing is returned as is. upload_path and the
+        owning process are kept so an interrupted normalization can be
+        restarted.
+        """
+        with self._lock:
+            existing = self.get_source(sha256)
+            if existing and existing["status"] != SourceStatus.FAILED:
+                return existing, False
+
+            source = {
+                "id": sha256,
+                "sha256": sha256,
+                "filename": filename,
+                "status": SourceStatus.PROCESSING,
+                "created_at": time.time(),
+                "error": None,
+                "upload_path": upload_path,
+                "owner": owner,
+            }
+            self._save(source)
+            logger.info(f"Registered source {sha256}")
+            return source, True
+
+    def update_status(self, source_id: str, status: str, error: Optional[str] = None) -> Optional[Dict]:
+        """Update the status of a source"""
+        with self._lock:
+            source = self.get_source(source_id)
+            if not source:
+                return None
+            source["status"] = status
+            source["error"] = error
+            self._save(source)
+            logger.info(f"Updated source {source_id} status to {status}")
+            return source
+
+    def claim(self, source: Dict, owner: Dict) -> Optional[Dict]:
+        """Take over a processing source from its previous owner; None if it changed meanwhile"""
+        with self._lock:
+            current = self.get_source(source["id"])
+            if not current or current["status"] != SourceStatus.PROCESSING or current.get("owner") != source.get("owner"):
+                return None
+            current["owner"] = owner
+            self._save(current)
+            return current
+
+    def get_processing_sources(self) -> List[Dict]:
+        return [source for source in self.get_all_sources() if source["status"] == SourceStatus.PROCESSING]
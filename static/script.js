@@ -42,22 +42,29 @@ document.addEventListener('DOMContentLoaded', () => {
                 body: formData
             });
 
+            if (response.status === 429) {
+                throw new Error('The server is busy, please try again shortly');
+            }
+            if (response.status === 422) {
+                // Preflight explains why the inputs cannot be stitched
+                const error = await response.json();
+                throw new Error(error.detail);
+            }
             if (!response.ok) {
                 throw new Error('Failed to process videos');
             }
 
             const task = await response.json();
             
-            // Poll for task completion
-            await pollTaskStatus(task.id);
+            // Wait for task completion
+            const finished = await waitForTask(task.id);
             
-            // Get the video blob
-            const videoResponse = await fetch(`/api/v1/tasks/${task.id}/download`);
-            const videoBlob = await videoResponse.blob();
-            const videoUrl = URL.createObjectURL(videoBlob);
+            // Stream the video directly; the server answers range requests
+            // so playback starts without fetching the whole file
+            const videoUrl = `/api/v1/tasks/${task.id}/download`;
 
-            // Display result
-            resultVideo.src = videoUrl;
+            // Display result, through the adaptive stream when it was packaged
+            playResult(finished, videoUrl);
             result.classList.remove('hidden');
             
             // Setup download button
@@ -78,12 +85,85 @@ document.addEventListener('DOMContentLoaded', () => {
     // Clean up object URLs when the page is unloaded
     window.addEventListener('beforeunload', () => {
         document.querySelectorAll('video').forEach(video => {
-            if (video.src) {
+            if (video.src && video.src.startsWith('blob:')) {
                 URL.revokeObjectURL(video.src);
             }
         });
     });
 
+    // Play the HLS package natively or with hls.js, falling back to the MP4
+    let hls = null;
+    function playResult(task, videoUrl) {
+        if (hls) {
+            hls.destroy();
+            hls = null;
+        }
+        const stream = task && task.stream_ready ? task.stream : null;
+        resultVideo.poster = stream ? stream.poster : '';
+        if (stream && resultVideo.canPlayType('application/vnd.apple.mpegurl')) {
+            resultVideo.src = stream.hls;
+        } else if (stream && window.Hls && Hls.isSupported()) {
+            hls = new Hls();
+            hls.loadSource(stream.hls);
+            hls.attachMedia(resultVideo);
+        } else {
+            resultVideo.src = videoUrl;
+        }
+    }
+
+    // Show task progress in the progress bar
+    function showProgress(task) {
+        const progressBar = progress.querySelector('.progress-bar');
+        const progressText = progress.querySelector('p');
+        progressBar.style.width = `${task.progress || 0}%`;
+
+        let text = `Processing videos... (${task.stage || task.status})`;
+        if (task.eta !== null && task.eta !== undefined) {
+            text += ` about ${Math.ceil(task.eta)}s left`;
+        }
+        progressText.textContent = text;
+    }
+
+    // Resolve with the task once it completes, using server-sent events when available
+    function waitForTask(taskId) {
+        if (!window.EventSource) {
+            return pollTaskStatus(taskId);
+        }
+
+        return new Promise((resolve, reject) => {
+            const source = new EventSource(`/api/v1/tasks/${taskId}/events`);
+            let finished = false;
+
+            source.addEventListener('task', (event) => {
+                const task = JSON.parse(event.data);
+                showProgress(task);
+
+                if (task.status === 'completed') {
+                    finished = true;
+                    source.close();
+                    resolve(task);
+                } else if (task.status === 'failed') {
+                    finished = true;
+                    source.close();
+                    reject(new Error(task.error || 'Task failed'));
+                } else if (task.status === 'cancelled') {
+                    finished = true;
+                    source.close();
+                    reject(new Error('Task was cancelled'));
+                }
+            });
+
+            source.onerror = () => {
+                // The server ends the stream once the task is done; on any
+                // other failure fall back to polling
+                if (!finished) {
+                    source.close();
+                    pollTaskStatus(taskId).then(resolve, reject);
+                }
+            };
+        });
+    }
+
     // Helper function to poll task status
     async function pollTaskStatus(taskId) {
         const maxAttempts = 60; // 5 minutes with 5-second intervals
@@ -94,15 +174,14 @@ document.addEventListener('DOMContentLoaded', () => {
             const task = await response.json();
 
             if (task.status === 'completed') {
-                return;
+                return task;
             } else if (task.status === 'failed') {
                 throw new Error(task.error || 'Task failed');
+            } else if (task.status === 'cancelled') {
+                throw new Error('Task was cancelled');
             }
 
-            // Update progress bar
-            const progressBar = progress.querySelector('.progress-bar');
-            const progressPercent = Math.min((attempts / maxAttempts) * 100, 95);
-            progressBar.style.width = `${progressPercent}%`;
+            showProgress(task);
 
             await new Promise(resolve => setTimeout(resolve, 5000));
             attempts++;
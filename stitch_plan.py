@@ -0,0 +1,283 @@
+import os
+import json
+import math
+from typing import Dict, List, Optional, Tuple, Union
+
+# Default segment plan, used when a request sends no timeline: (start, end, source)
+SEGMENT_TIMINGS: List[Tuple[float, float, str]] = [
+    (0, 4, "wwe"),    # 0s - 4s: Intro (WWE video)
+    (4, 7, "fan"),    # 4s - 7s: Fan video
+    (7, 10, "wwe"),   # 7s - 10s: WWE video
+    (10, 13, "fan"),  # 10s - 13s: Fan video
+    (13, 22, "wwe"),  # 13s - 22s: WWE video
+    (22, 25, "fan"),  # 22s - 25s: Fan video
+    (25, 30, "wwe")   # 25s - 30s: Final WWE video
+]
+
+# Duration of the final video in seconds
+FINAL_DURATION = 30
+
+# Fade in/out length at segment boundaries in seconds
+TRANSITION_DURATION = 0.5
+
+# Extra ffmpeg output parameters used by every engine
+FFMPEG_OUTPUT_PARAMS = [
+    '-max_muxing_queue_size', '1024',
+    '-movflags', '+faststart',  # Enable fast start for web playback
+    '-profile:v', 'high',       # Use high profile for better quality
+    '-level', '4.0',           # Set H.264 level for compatibility
+    '-pix_fmt', 'yuv420p',     # Ensure pixel format compatibility
+    '-colorspace', 'bt709',    # Set standard colorspace
+    '-color_primaries', 'bt709',
+    '-color_trc', 'bt709',
+    '-y'                       # Overwrite output file if exists
+]
+
+# Available stitching engines
+ENGINES = ("frames", "ffmpeg", "smart")
+
+# Former engine names still accepted; frames was called moviepy before it stopped using MoviePy
+ENGINE_ALIASES = {"moviepy": "frames"}
+
+# Inputs a timeline can take video and audio from
+SOURCES = ("wwe", "fan")
+
+# Ways a timeline segment can join the one before it; fade goes through black
+TRANSITIONS = ("cut", "fade")
+
+# Limits on custom timelines
+MAX_TIMELINE_SEGMENTS = int(os.getenv('MAX_TIMELINE_SEGMENTS', '100'))
+MAX_TIMELINE_DURATION = float(os.getenv('MAX_TIMELINE_DURATION', '300'))
+
+# Named encoding profiles. Settings a profile leaves out come from the
+# environment (TARGET_*, VIDEO_BITRATE, ENCODER_*); a crf replaces the bitrate
+# and a height scales the output down keeping the target aspect ratio.
+ENCODING_PROFILES: Dict[str, Dict] = {
+    "preview": {"height": 360, "preset": "veryfast", "crf": 30, "tune": "fastdecode", "threads": 2},
+    "standard": {},
+    "archive": {"preset": "slow", "crf": 18, "tune": "film"},
+}
+
+# Profile rendered first when a request asks for a preview
+PREVIEW_PROFILE = "preview"
+
+
+def default_engine() -> str:
+    """Engine used when a request does not pick one"""
+    engine = os.getenv('STITCH_ENGINE', 'frames').lower()
+    engine = ENGINE_ALIASES.get(engine, engine)
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown STITCH_ENGINE '{engine}', expected one of {', '.join(ENGINES)}")
+    return engine
+
+
+def default_profile() -> str:
+    """Encoding profile used when a request does not pick one"""
+    profile = os.getenv('ENCODING_PROFILE', 'standard').lower()
+    if profile not in ENCODING_PROFILES:
+        raise ValueError(f"Unknown ENCODING_PROFILE '{profile}', expected one of {', '.join(ENCODING_PROFILES)}")
+    return profile
+
+
+def output_settings(profile: Optional[str] = None) -> Dict:
+    """Target size, frame rate, bitrates and encoder settings for an encoding profile"""
+    profile = profile or default_profile()
+    if profile not in ENCODING_PROFILES:
+        raise ValueError(f"Unknown encoding profile '{profile}'")
+    overrides = ENCODING_PROFILES[profile]
+
+    width = int(os.getenv('TARGET_WIDTH', '1280'))
+    height = int(os.getenv('TARGET_HEIGHT', '720'))
+    if "height" in overrides and overrides["height"] < height:
+        # Keep the aspect ratio; libx264 needs even dimensions
+        width = round(width * overrides["height"] / height / 2) * 2
+        height = overrides["height"]
+
+    crf = overrides.get("crf")
+    return {
+        "profile": profile,
+        "target_size": (width, height),
+        "target_fps": int(os.getenv('TARGET_FPS', '30')),
+        "video_bitrate": None if crf is not None else overrides.get("bitrate", os.getenv('VIDEO_BITRATE', '2000k')),
+        "crf": crf,
+        "audio_bitrate": os.getenv('AUDIO_BITRATE', '128k'),
+        "encoder_threads": overrides.get("threads", int(os.getenv('ENCODER_THREADS', '4'))),
+        "encoder_preset": overrides.get("preset", os.getenv('ENCODER_PRESET', 'medium')),
+        "tune": overrides.get("tune"),
+    }
+
+
+def rate_control_params(settings: Dict) -> List[str]:
+    """libx264 rate control and tuning arguments for output_settings()"""
+    params = ['-crf', str(settings["crf"])] if settings["crf"] is not None else ['-b:v', settings["video_bitrate"]]
+    if settings["tune"]:
+        params += ['-tune', settings["tune"]]
+    return params
+
+
+class TimelineError(ValueError):
+    """Raised when a timeline description cannot be rendered"""
+
+
+def default_timeline_spec() -> Dict:
+    """The default segment plan as a timeline description"""
+    return {
+        "segments": [
+            dict(
+                {"source": source, "in": start, "out": end},
+                **({"transition": {"type": "fade", "duration": TRANSITION_DURATION}} if i > 0 else {})
+            )
+            for i, (start, end, source) in enumerate(SEGMENT_TIMINGS)
+        ],
+        "audio": [{"source": "fan", "in": 0, "start": 0}],
+    }
+
+
+def _number(value, field: str) -> float:
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise TimelineError(f"{field} must be a number")
+    return float(value)
+
+
+def compile_timeline(spec: Union[str, Dict]) -> Dict:
+    """
+    Validate a timeline description and resolve it into the form engines render.
+
+    A description (a dict or its JSON) lists video segments in output order
+    and audio ranges placed on the output:
+
+        {"segments": [{"source": "wwe", "in": 0, "out": 4},
+                      {"source": "fan", "in": 4, "out": 7,
+                       "transition": {"type": "fade", "duration": 0.5}}],
+         "audio": [{"source": "fan", "in": 0, "start": 0}]}
+
+    A segment's transition joins it to the previous one (a fade on the first
+    segment fades in from black). An audio range plays its source from "in"
+    to "out" (or to the end of the output) starting at "start" seconds into
+    the output; gaps are silent and ranges must not overlap. audio defaults
+    to the fan audio from the beginning.
+
+    The result holds each segment's output position and fade lengths, each
+    audio range's output length, and the total duration. Raises
+    TimelineError with the first problem found.
+    """
+    if isinstance(spec, str):
+        try:
+            spec = json.loads(spec)
+        except ValueError as e:
+            raise TimelineError(f"Timeline is not valid JSON: {e}")
+    if not isinstance(spec, dict):
+        raise TimelineError("Timeline must be a JSON object")
+
+    raw_segments = spec.get("segments")
+    if not isinstance(raw_segments, list) or not raw_segments:
+        raise TimelineError("Timeline needs at least one segment")
+    if len(raw_segments) > MAX_TIMELINE_SEGMENTS:
+        raise TimelineError(f"Timeline has {len(raw_segments)} segments, the limit is {MAX_TIMELINE_SEGMENTS}")
+
+    segments = []
+    position = 0.0
+    for i, raw in enumerate(raw_segments):
+        field = f"segments[{i}]"
+        if not isinstance(raw, dict):
+            raise TimelineError(f"{field} must be an object")
+        if raw.get("source") not in SOURCES:
+            raise TimelineError(f"{field}.source must be one of: {', '.join(SOURCES)}")
+        start = _number(raw.get("in"), f"{field}.in")
+        end = _number(raw.get("out"), f"{field}.out")
+        if start < 0 or end <= start:
+            raise TimelineError(f"{field} needs 0 <= in < out")
+
+        transition = raw.get("transition") or {"type": "cut"}
+        if not isinstance(transition, dict) or transition.get("type", "fade") not in TRANSITIONS:
+            raise TimelineError(f"{field}.transition.type must be one of: {', '.join(TRANSITIONS)}")
+        fade = 0.0
+        if transition.get("type", "fade") == "fade":
+            fade = _number(transition.get("duration", TRANSITION_DURATION), f"{field}.transition.duration")
+            if fade <= 0:
+                raise TimelineError(f"{field}.transition.duration must be positive")
+
+        segments.append({"source": raw["source"], "in": start, "out": end, "at": position,
+                         "fade_in": fade, "fade_out": 0.0})
+        # Fading through black darkens both sides of the cut
+        if fade and i > 0:
+            segments[i - 1]["fade_out"] = fade
+        position += end - start
+
+    for i, segment in enumerate(segments):
+        if segment["fade_in"] + segment["fade_out"] > segment["out"] - segment["in"] + 1e-9:
+            raise TimelineError(f"segments[{i}] is shorter than its fades")
+
+    duration = position
+    if duration > MAX_TIMELINE_DURATION:
+        raise TimelineError(f"Timeline is {duration:g}s long, the limit is {MAX_TIMELINE_DURATION:g}s")
+
+    raw_audio = spec.get("audio", [{"source": "fan", "in": 0, "start": 0}])
+    if not isinstance(raw_audio, list):
+        raise TimelineError("audio must be a list of ranges")
+    audio = []
+    for i, raw in enumerate(raw_audio):
+        field = f"audio[{i}]"
+        if not isinstance(raw, dict):
+            raise TimelineError(f"{field} must be an object")
+        if raw.get("source") not in SOURCES:
+            raise TimelineError(f"{field}.source must be one of: {', '.join(SOURCES)}")
+        start = _number(raw.get("in", 0), f"{field}.in")
+        end = _number(raw["out"], f"{field}.out") if raw.get("out") is not None else None
+        at = _number(raw.get("start", 0), f"{field}.start")
+        if start < 0 or (end is not None and end <= start):
+            raise TimelineError(f"{field} needs 0 <= in < out")
+        if not 0 <= at < duration:
+            raise TimelineError(f"{field}.start must fall within the {duration:g}s output")
+        length = min(end - start if end is not None else duration, duration - at)
+        audio.append({"source": raw["source"], "in": start, "out": end, "start": at, "duration": length})
+
+    audio.sort(key=lambda r: r["start"])
+    for previous, current in zip(audio, audio[1:]):
+        if current["start"] < previous["start"] + previous["duration"] - 1e-9:
+            raise TimelineError("audio ranges must not overlap")
+
+    return {"segments": segments, "audio": audio, "duration": duration}
+
+
+def default_timeline() -> Dict:
+    """The compiled default segment plan"""
+    return compile_timeline(default_timeline_spec())
+
+
+def required_duration(timeline: Dict, source: str) -> float:
+    """Seconds of a source the timeline reads; 0 if it does not use the source"""
+    needed = [segment["out"] for segment in timeline["segments"] if segment["source"] == source]
+    for audio_range in timeline["audio"]:
+        if audio_range["source"] == source:
+            # Open-ended ranges are padded with silence, but must start inside the source
+            needed.append(audio_range["out"] if audio_range["out"] is not None else audio_range["in"])
+    return max(needed, default=0.0)
+
+
+def snap_to_frame(t: float, fps: float) -> float:
+    """Round t up to the next frame boundary at fps"""
+    return math.ceil(t * fps - 1e-6) / fps
+
+
+def keyframe_times(source: str, fps: Optional[float] = None, timeline: Optional[Dict] = None) -> List[float]:
+    """
+    Timestamps where a normalized copy of source should have keyframes.
+
+    These are the segment cut points plus the edges of the fade windows of
+    timeline (the default plan unless given), so every segment and its
+    untouched middle start on a keyframe. With fps given, the times are
+    snapped to frame boundaries.
+    """
+    times = set()
+    for segment in (timeline or default_timeline())["segments"]:
+        if segment["source"] != source:
+            continue
+        times.update([segment["in"], segment["out"]])
+        if segment["fade_in"]:
+            times.add(segment["in"] + segment["fade_in"])
+        if segment["fade_out"]:
+            times.add(segment["out"] - segment["fade_out"])
+    if fps:
+        times = {snap_to_frame(t, fps) for t in times}
+    return sorted(times)
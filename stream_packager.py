@@ -0,0 +1,177 @@
+import os
+import json
+import math
+import shutil
+import logging
+from typing import Callable, Dict, List, Optional, Tuple
+
+from ffmpeg_utils import probe_media, run_ffmpeg
+
+logger = logging.getLogger(__name__)
+
+# Package every output for adaptive streaming, not only tasks that ask for it
+STREAM_PACKAGING = os.getenv('STREAM_PACKAGING', 'false').lower() == 'true'
+
+# Rendition ladder as height:bitrate pairs; rungs taller than the output are dropped
+STREAM_LADDER = os.getenv('STREAM_LADDER', '1080:5000k,720:2800k,480:1400k,360:800k,240:400k')
+
+# Length of each media segment in seconds; short segments start playback sooner
+STREAM_SEGMENT_SECONDS = float(os.getenv('STREAM_SEGMENT_SECONDS', '2'))
+
+# x264 preset for the renditions
+STREAM_PRESET = os.getenv('STREAM_PRESET', 'veryfast')
+
+# Seconds between thumbnails in the sprite, and the width of each thumbnail
+THUMBNAIL_INTERVAL = float(os.getenv('THUMBNAIL_INTERVAL', '2'))
+THUMBNAIL_WIDTH = int(os.getenv('THUMBNAIL_WIDTH', '160'))
+SPRITE_COLUMNS = 10
+
+# Files every package has, relative to its directory
+HLS_PLAYLIST = "master.m3u8"
+DASH_MANIFEST = "manifest.mpd"
+POSTER = "poster.jpg"
+SPRITE = "sprite.jpg"
+THUMBNAILS = "thumbnails.vtt"
+STREAM_INFO = "stream.json"
+
+# Media types of the files a package contains, by extension
+STREAM_MEDIA_TYPES = {
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".mpd": "application/dash+xml",
+    ".m4s": "video/iso.segment",
+    ".jpg": "image/jpeg",
+    ".vtt": "text/vtt",
+    ".json": "application/json",
+}
+
+
+def parse_ladder(spec: str) -> List[Tuple[int, str]]:
+    """Parse STREAM_LADDER into (height, bitrate) pairs, tallest first"""
+    rungs = []
+    for rung in spec.split(","):
+        height, _, bitrate = rung.strip().partition(":")
+        if height and bitrate:
+            rungs.append((int(height), bitrate.strip()))
+    return sorted(rungs, reverse=True)
+
+
+def ladder_for(height: int, spec: Optional[str] = None) -> List[Tuple[int, str]]:
+    """Rungs of the ladder no taller than the output; the shortest rung if all are taller"""
+    rungs = parse_ladder(spec or STREAM_LADDER)
+    fitting = [rung for rung in rungs if rung[0] <= height]
+    return fitting or rungs[-1:]
+
+
+def _timestamp(seconds: float) -> str:
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{int(hours):02d}:{int(minutes):02d}:{seconds:06.3f}"
+
+
+def thumbnail_track(duration: float, width: int, height: int) -> str:
+    """WebVTT cues pointing each THUMBNAIL_INTERVAL of the video at its tile in the sprite"""
+    lines = ["WEBVTT", ""]
+    for i in range(math.ceil(duration / THUMBNAIL_INTERVAL)):
+        start = i * THUMBNAIL_INTERVAL
+        end = min(start + THUMBNAIL_INTERVAL, duration)
+        x, y = (i % SPRITE_COLUMNS) * width, (i // SPRITE_COLUMNS) * height
+        lines += [f"{_timestamp(start)} --> {_timestamp(end)}", f"{SPRITE}#xywh={x},{y},{width},{height}", ""]
+    return "\n".join(lines)
+
+
+def package_stream(video_path: str, stream_dir: str, threads: int = 2,
+                   should_cancel: Optional[Callable[[], bool]] = None,
+                   on_progress: Optional[Callable] = None) -> Dict:
+    """
+    Package a stitched MP4 for adaptive streaming into stream_dir.
+
+    Writes one rendition per rung of the ladder, as fragmented MP4
+    segments with aligned keyframes. A DASH manifest and an HLS master
+    playlist share the segments. It also writes a poster frame, a sprite
+    of thumbnails with a WebVTT track that indexes it, and stream.json
+    describing the package. The audio is copied into every rendition, not
+    re-encoded. on_progress("package", done, total) receives frame
+    progress. Returns the stream.json contents.
+    """
+    info = probe_media(video_path)
+    width, height = info.get("width") or 0, info.get("height") or 0
+    fps = info.get("fps") or 30
+    duration = info["duration"]
+    ladder = ladder_for(height)
+
+    if os.path.exists(stream_dir):
+        shutil.rmtree(stream_dir)
+    os.makedirs(stream_dir)
+
+    # Renditions: one decode split into a scaled copy per rung
+    split = f"[0:v]split={len(ladder)}" + "".join(f"[s{i}]" for i in range(len(ladder)))
+    filters = [split] + [f"[s{i}]scale=-2:{rung_height}[v{i}]" for i, (rung_height, _) in enumerate(ladder)]
+    maps = []
+    for i, (_, bitrate) in enumerate(ladder):
+        maps += ['-map', f"[v{i}]", f"-b:v:{i}", bitrate, f"-maxrate:v:{i}", bitrate, f"-bufsize:v:{i}", bitrate]
+    adaptation_sets = "id=0,streams=v"
+    if info["has_audio"]:
+        maps += ['-map', '0:a:0', '-c:a', 'copy']
+        adaptation_sets += " id=1,streams=a"
+    segment = f"{STREAM_SEGMENT_SECONDS:g}"
+    total_frames = round(duration * fps)
+
+    def _progress(block):
+        if block.get("frame", "").isdigit():
+            on_progress("package", int(block["frame"]), total_frames)
+
+    run_ffmpeg([
+        '-i', video_path,
+        '-filter_complex', ';'.join(filters),
+        *maps,
+        '-c:v', 'libx264',
+        '-preset', STREAM_PRESET,
+        '-profile:v', 'high',
+        '-pix_fmt', 'yuv420p',
+        '-threads', str(threads),
+        # Keyframes on every segment boundary, identical across renditions
+        '-force_key_frames', f"expr:gte(t,n_forced*{segment})",
+        '-sc_threshold', '0',
+        '-f', 'dash',
+        '-seg_duration', segment,
+        '-use_template', '1',
+        '-use_timeline', '1',
+        '-hls_playlist', '1',
+        '-hls_master_name', HLS_PLAYLIST,
+        '-adaptation_sets', adaptation_sets,
+        '-init_seg_name', 'init-$RepresentationID$.m4s',
+        '-media_seg_name', 'chunk-$RepresentationID$-$Number%05d$.m4s',
+        '-y', os.path.join(stream_dir, DASH_MANIFEST)
+    ], should_cancel=should_cancel, on_progress=_progress if on_progress else None)
+
+    # Poster frame and thumbnail sprite
+    thumb_height = round(THUMBNAIL_WIDTH * height / width / 2) * 2 if width and height else THUMBNAIL_WIDTH * 9 // 16
+    count = max(1, math.ceil(duration / THUMBNAIL_INTERVAL))
+    rows = math.ceil(count / SPRITE_COLUMNS)
+    run_ffmpeg([
+        '-ss', f"{min(1.0, duration / 2):.3f}", '-i', video_path,
+        '-frames:v', '1', '-q:v', '3', '-y', os.path.join(stream_dir, POSTER)
+    ], should_cancel=should_cancel)
+    run_ffmpeg([
+        '-i', video_path,
+        '-vf', f"fps=1/{THUMBNAIL_INTERVAL:g},scale={THUMBNAIL_WIDTH}:{thumb_height},tile={SPRITE_COLUMNS}x{rows}",
+        '-frames:v', '1', '-q:v', '5', '-y', os.path.join(stream_dir, SPRITE)
+    ], should_cancel=should_cancel)
+    with open(os.path.join(stream_dir, THUMBNAILS), "w") as f:
+        f.write(thumbnail_track(duration, THUMBNAIL_WIDTH, thumb_height))
+
+    stream = {
+        "duration": duration,
+        "segment_seconds": STREAM_SEGMENT_SECONDS,
+        "renditions": [{"height": rung_height, "bitrate": bitrate} for rung_height, bitrate in ladder],
+        "hls": HLS_PLAYLIST,
+        "dash": DASH_MANIFEST,
+        "poster": POSTER,
+        "sprite": SPRITE,
+        "thumbnails": THUMBNAILS,
+    }
+    # Written last: its presence marks a complete package
+    with open(os.path.join(stream_dir, STREAM_INFO), "w") as f:
+        json.dump(stream, f)
+    logger.info(f"Packaged {video_path} for streaming in {len(ladder)} renditions")
+    return stream
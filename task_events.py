@@ -0,0 +1,67 @@
+import asyncio
+import logging
+import threading
+from typing import Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class TaskEventBroker:
+    """
+    Fans task updates out to server-sent event subscribers.
+
+    publish() may be called from any thread (job callbacks run outside the
+    event loop); updates are handed to the loop bound with bind(). Only
+    updates made in this process are seen, so subscribers should also
+    re-read the task store periodically when several workers share it.
+    """
+
+    def __init__(self):
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def bind(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Set the event loop subscriber queues belong to"""
+        self._loop = loop
+
+    def subscribe(self, task_id: str) -> asyncio.Queue:
+        # Only the latest few updates matter; older ones are superseded
+        queue = asyncio.Queue(maxsize=16)
+        with self._lock:
+            self._subscribers.setdefault(task_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, task_id: str, queue: asyncio.Queue) -> None:
+        with self._lock:
+            queues = self._subscribers.get(task_id)
+            if queues:
+                queues.discard(queue)
+                if not queues:
+                    del self._subscribers[task_id]
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return sum(len(queues) for queues in self._subscribers.values())
+
+    def publish(self, task: Dict) -> None:
+        """Deliver a task update to everyone watching it"""
+        with self._lock:
+            queues = list(self._subscribers.get(task["id"], ()))
+        if not queues or not self._loop:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._deliver, queues, dict(task))
+        except RuntimeError:
+            # The loop has been closed during shutdown
+            pass
+
+    @staticmethod
+    def _deliver(queues, task: Dict) -> None:
+        for queue in queues:
+            if queue.full():
+                try:
+                    queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    pass
+            queue.put_nowait(task)
@@ -1,8 +1,14 @@
 import os
 import time
+import uuid
+import shutil
+import socket
+import threading
 from enum import Enum
-from typing import Dict, Optional, List
+from typing import Callable, Dict, Optional, List
 import logging
+from task_store import TaskStore, create_task_store
+from metrics import count_transition
 
 logger = logging.getLogger(__name__)
 
@@ -11,99 +17,229 @@ class TaskStatus(Enum):
     PROCESSING = "processing"
     COMPLETED = "completed"
     FAILED = "failed"
+    CANCELLED = "cancelled"
+
+# Statuses a task never leaves
+FINAL_STATUSES = (TaskStatus.COMPLETED.value, TaskStatus.FAILED.value, TaskStatus.CANCELLED.value)
+
+# Seconds between lease renewals of an API process, and after which an unrenewed lease lapses
+OWNER_HEARTBEAT_INTERVAL = float(os.getenv('OWNER_HEARTBEAT_INTERVAL', '10'))
+OWNER_TIMEOUT = float(os.getenv('OWNER_TIMEOUT', '60'))
+
+def current_owner() -> Dict:
+    """Identifies this API process as the owner of the tasks it ingests and queues"""
+    return {"id": uuid.uuid4().hex, "host": socket.gethostname(), "pid": os.getpid()}
 
 class TaskManager:
-    def __init__(self, output_dir: str):
-        self.tasks: Dict[str, Dict] = {}
+    def __init__(self, output_dir: str, result_cache=None, store: Optional[TaskStore] = None):
         self.output_dir = output_dir
-        self.download_history: List[Dict] = []
+        self.result_cache = result_cache
         os.makedirs(output_dir, exist_ok=True)
+        self.store = store or create_task_store(output_dir)
+        self.owner = current_owner()
+        self.listeners: List[Callable[[Dict], None]] = []
+        self._lease_stop = threading.Event()
+        self._lease_thread: Optional[threading.Thread] = None
+        
+    def start_lease(self, on_renew: Optional[Callable[[], None]] = None) -> None:
+        """
+        Take a lease on this process's tasks and renew it in the background.
+
+        The task store may be shared by API processes on several hosts, so
+        an owner counts as alive only while it keeps renewing its lease.
+        on_renew runs after every renewal, e.g. to take over the tasks of
+        owners whose lease lapsed.
+        """
+        self.store.heartbeat_owner(self.owner["id"], time.time())
+        if self._lease_thread and self._lease_thread.is_alive():
+            return
+        self._lease_stop.clear()
+        self._lease_thread = threading.Thread(target=self._renew_lease, args=(on_renew,), name="owner-lease", daemon=True)
+        self._lease_thread.start()
+
+    def stop_lease(self) -> None:
+        """Stop renewing and give the lease up, so another process can take over at once"""
+        self._lease_stop.set()
+        if self._lease_thread:
+            self._lease_thread.join(timeout=5)
+        self.store.remove_owner(self.owner["id"])
+
+    def _renew_lease(self, on_renew: Optional[Callable[[], None]]) -> None:
+        while not self._lease_stop.wait(OWNER_HEARTBEAT_INTERVAL):
+            try:
+                self.store.heartbeat_owner(self.owner["id"], time.time())
+                if on_renew:
+                    on_renew()
+            except Exception as e:
+                logger.error(f"Error renewing the task lease: {e}")
+
+    def owner_alive(self, owner: Optional[Dict]) -> bool:
+        """Whether the process that owns a task still holds its lease"""
+        if not owner or not owner.get("id"):
+            return False
+        if owner["id"] == self.owner["id"]:
+            return True
+        renewed_at = self.store.owner_heartbeat(owner["id"])
+        return renewed_at is not None and time.time() - renewed_at < OWNER_TIMEOUT
+
+    def owns(self, task: Dict) -> bool:
+        """Whether this process owns a task"""
+        return (task.get("owner") or {}).get("id") == self.owner["id"]
+        
+    def add_listener(self, listener: Callable[[Dict], None]) -> None:
+        """Register a callback invoked with the task after every change"""
+        self.listeners.append(listener)
+    
+    def _notify(self, task: Dict) -> None:
+        for listener in self.listeners:
+            try:
+                listener(task)
+            except Exception as e:
+                logger.error(f"Error in task listener: {e}")
         
-    def create_task(self, task_id: str, wwe_filename: str, fan_filename: str) -> Dict:
+    def create_task(self, task_id: str, wwe_filename: str, fan_filename: str, engine: Optional[str] = None,
+                    profile: Optional[str] = None, client_id: Optional[str] = None) -> Dict:
         """Create a new task and return its initial status"""
         task = {
             "id": task_id,
             "status": TaskStatus.PENDING.value,
             "progress": 0,
+            "stage": "ingest",
             "wwe_filename": wwe_filename,
             "fan_filename": fan_filename,
+            "engine": engine,
+            "profile": profile,
+            "client_id": client_id,
+            "owner": self.owner,
             "output_filename": f"output_{task_id}.mp4",
             "created_at": time.time(),
             "error": None,
             "downloads": 0
         }
-        self.tasks[task_id] = task
+        self.store.insert(task)
+        count_transition(task["status"])
         logger.info(f"Created new task: {task_id}")
+        self._notify(task)
         return task
     
     def update_task_status(self, task_id: str, status: TaskStatus, progress: int = 0, error: Optional[str] = None) -> Dict:
         """Update the status of a task"""
-        if task_id not in self.tasks:
-            raise KeyError(f"Task {task_id} not found")
-            
-        task = self.tasks[task_id]
-        task["status"] = status.value
-        task["progress"] = progress
+        fields = {"status": status.value, "progress": progress}
+        if status.value in FINAL_STATUSES:
+            # A finished task is no longer in any processing stage
+            fields.update(stage="done", eta=None)
         if error:
-            task["error"] = error
-            
+            fields["error"] = error
+        
+        task = self.store.update(task_id, fields)
+        if task is None:
+            raise KeyError(f"Task {task_id} not found")
+        
+        count_transition(status.value)
         logger.info(f"Updated task {task_id} status to {status.value}")
+        self._notify(task)
         return task
     
+    def update_task(self, task_id: str, **fields) -> Dict:
+        """Set additional fields on a task"""
+        task = self.store.update(task_id, fields)
+        if task is None:
+            raise KeyError(f"Task {task_id} not found")
+        self._notify(task)
+        return task
+    
+    def claim_task(self, task: Dict) -> Optional[Dict]:
+        """Take over a task from its previous owner; None if another process claimed it first"""
+        claimed = self.store.update(task["id"], {"owner": self.owner}, expected={"owner": task.get("owner")})
+        if claimed:
+            self._notify(claimed)
+        return claimed
+
+    def get_unfinished_tasks(self) -> List[Dict]:
+        """Pending and processing tasks, oldest first"""
+        tasks = []
+        for status in (TaskStatus.PENDING, TaskStatus.PROCESSING):
+            tasks += self.store.query(status=status.value, descending=False)
+        return sorted(tasks, key=lambda task: task["created_at"])
+
+    def bind_idempotency_key(self, key: str, task_id: str) -> str:
+        """Bind a client's idempotency key to a new task, returning the task that owns the key"""
+        return self.store.bind_idempotency_key(key, task_id)
+
+    def get_idempotency_key(self, key: str) -> Optional[str]:
+        """The ID of the task a key is bound to, which may not be created yet"""
+        return self.store.get_idempotency_key(key)
+
+    def release_idempotency_key(self, key: str, task_id: str) -> None:
+        """Free a key whose request was not accepted, so the client can retry with it"""
+        self.store.release_idempotency_key(key, task_id)
+
     def get_task(self, task_id: str) -> Optional[Dict]:
         """Get the current status of a task"""
-        return self.tasks.get(task_id)
+        return self.store.get(task_id)
     
     def get_all_tasks(self) -> list:
         """Get all tasks"""
-        return list(self.tasks.values())
+        return self.store.query()
     
+    def list_tasks(self, status: Optional[str] = None, limit: int = 100, offset: int = 0) -> List[Dict]:
+        """Get a page of tasks, newest first, optionally filtered by status"""
+        return self.store.query(status=status, limit=limit, offset=offset)
+    
+    def get_waiting_tasks(self) -> List[Dict]:
+        """Pending tasks held back until they can be queued, oldest first"""
+        tasks = self.store.query(status=TaskStatus.PENDING.value, descending=False)
+        return [task for task in tasks if task.get("stage") == "waiting"]
+
     def get_output_path(self, task_id: str) -> str:
         """Get the output path for a task's video"""
-        return os.path.join(self.output_dir, self.tasks[task_id]["output_filename"])
+        task = self.store.get(task_id)
+        if task is None:
+            raise KeyError(f"Task {task_id} not found")
+        return os.path.join(self.output_dir, task["output_filename"])
     
     def record_download(self, task_id: str) -> None:
         """Record a download for a task"""
-        if task_id not in self.tasks:
-            return
-            
-        task = self.tasks[task_id]
-        task["downloads"] = task.get("downloads", 0) + 1
-        
-        # Add to download history
-        self.download_history.append({
-            "task_id": task_id,
-            "timestamp": time.time(),
-            "filename": task["output_filename"]
-        })
-        
-        # Keep only last 100 downloads
-        if len(self.download_history) > 100:
-            self.download_history = self.download_history[-100:]
+        timestamp = time.time()
+        task = self.store.increment_downloads(task_id, timestamp)
+        if task:
+            # Recently downloaded outputs are the last to be evicted
+            task = self.store.update(task_id, {"last_downloaded_at": timestamp})
+            self._notify(task)
     
     def get_recent_downloads(self, limit: int = 10) -> List[Dict]:
         """Get recent downloads"""
-        return sorted(self.download_history, key=lambda x: x["timestamp"], reverse=True)[:limit]
+        return self.store.recent_downloads(limit)
     
     def get_popular_downloads(self, limit: int = 10) -> List[Dict]:
         """Get most downloaded videos"""
-        return sorted(
-            [task for task in self.tasks.values() if task["status"] == TaskStatus.COMPLETED.value],
-            key=lambda x: x.get("downloads", 0),
-            reverse=True
-        )[:limit]
+        return self.store.query(status=TaskStatus.COMPLETED.value, order_by="downloads", limit=limit)
     
     def cleanup_old_tasks(self, max_age_hours: int = 24):
-        """Remove tasks and their output files older than max_age_hours"""
-        current_time = time.time()
-        for task_id, task in list(self.tasks.items()):
-            if current_time - task["created_at"] > max_age_hours * 3600:
-                output_path = self.get_output_path(task_id)
-                if os.path.exists(output_path):
+        """Remove tasks and their output, preview and leftover input files older than max_age_hours"""
+        cutoff = time.time() - max_age_hours * 3600
+        for task in self.store.query(created_before=cutoff):
+            task_id = task["id"]
+            paths = [os.path.join(self.output_dir, task["output_filename"])]
+            if task.get("preview_filename"):
+                paths.append(os.path.join(self.output_dir, task["preview_filename"]))
+            if task.get("stream_dirname"):
+                paths.append(os.path.join(self.output_dir, task["stream_dirname"]))
+            # Inputs are kept while a deferred full render waits for a download
+            paths += task.get("temp_inputs") or []
+            for path in paths:
+                if os.path.exists(path):
                     try:
-                        os.remove(output_path)
-                        logger.info(f"Removed old output file: {output_path}")
+                        if os.path.isdir(path):
+                            shutil.rmtree(path)
+                        else:
+                            os.remove(path)
+                        logger.info(f"Removed old file: {path}")
                     except Exception as e:
-                        logger.error(f"Error removing old output file: {e}")
-                del self.tasks[task_id]
-                logger.info(f"Removed old task: {task_id}") 
\ No newline at end of file
+                        logger.error(f"Error removing old file: {e}")
+            self.store.delete(task_id)
+            logger.info(f"Removed old task: {task_id}")
+        
+        # Trim the result cache along with the tasks it serves
+        if self.result_cache:
+            self.result_cache.evict()
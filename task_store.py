@@ -0,0 +1,375 @@
+import os
+import json
+import sqlite3
+import logging
+import threading
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Number of entries kept in the download history
+DOWNLOAD_HISTORY_SIZE = 100
+
+# Task fields stored in their own indexed columns rather than in the JSON blob
+INDEXED_FIELDS = ("status", "created_at", "downloads")
+
+
+class TaskStore:
+    """
+    Storage backend interface for TaskManager.
+
+    Tasks are plain dicts keyed by their "id". Every method is safe to call
+    from any thread.
+    """
+
+    def insert(self, task: Dict) -> None:
+        raise NotImplementedError
+
+    def get(self, task_id: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def update(self, task_id: str, fields: Dict, expected: Optional[Dict] = None) -> Optional[Dict]:
+        """
+        Merge fields into a task atomically, returning the updated task.
+
+        With expected, the update only happens if the task currently has
+        those values, which lets one process claim a task. Returns None if
+        the task does not exist or does not match.
+        """
+        raise NotImplementedError
+
+    def delete(self, task_id: str) -> None:
+        """Delete a task and the idempotency keys bound to it"""
+        raise NotImplementedError
+
+    def bind_idempotency_key(self, key: str, task_id: str) -> str:
+        """Bind key to task_id unless it is already bound; returns the task the key belongs to"""
+        raise NotImplementedError
+
+    def get_idempotency_key(self, key: str) -> Optional[str]:
+        """The task bound to key, if any"""
+        raise NotImplementedError
+
+    def release_idempotency_key(self, key: str, task_id: str) -> None:
+        """Unbind key if it still belongs to task_id"""
+        raise NotImplementedError
+
+    def query(self, status: Optional[str] = None, created_before: Optional[float] = None,
+              order_by: str = "created_at", descending: bool = True,
+              limit: Optional[int] = None, offset: int = 0) -> List[Dict]:
+        """Tasks filtered by status and age, ordered by created_at or downloads"""
+        raise NotImplementedError
+
+    def increment_downloads(self, task_id: str, timestamp: float) -> Optional[Dict]:
+        """Atomically count a download and append it to the history"""
+        raise NotImplementedError
+
+    def recent_downloads(self, limit: int) -> List[Dict]:
+        raise NotImplementedError
+
+    def heartbeat_owner(self, owner_id: str, timestamp: float) -> None:
+        """Renew the lease of the API process owner_id on its tasks"""
+        raise NotImplementedError
+
+    def owner_heartbeat(self, owner_id: str) -> Optional[float]:
+        """When owner_id last renewed its lease; None if it never did or gave it up"""
+        raise NotImplementedError
+
+    def remove_owner(self, owner_id: str) -> None:
+        """Give up the lease of owner_id, so its tasks can be taken over at once"""
+        raise NotImplementedError
+
+
+class MemoryTaskStore(TaskStore):
+    """Process-local store; tasks are lost on restart and not shared between workers"""
+
+    def __init__(self):
+        self.tasks: Dict[str, Dict] = {}
+        self.download_history: List[Dict] = []
+        self.idempotency_keys: Dict[str, str] = {}
+        self.owners: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def insert(self, task: Dict) -> None:
+        with self._lock:
+            self.tasks[task["id"]] = dict(task)
+
+    def get(self, task_id: str) -> Optional[Dict]:
+        with self._lock:
+            task = self.tasks.get(task_id)
+            return dict(task) if task else None
+
+    def update(self, task_id: str, fields: Dict, expected: Optional[Dict] = None) -> Optional[Dict]:
+        with self._lock:
+            task = self.tasks.get(task_id)
+            if task is None:
+                return None
+            if expected and any(task.get(k) != v for k, v in expected.items()):
+                return None
+            task.update(fields)
+            return dict(task)
+
+    def delete(self, task_id: str) -> None:
+        with self._lock:
+            self.tasks.pop(task_id, None)
+            self.idempotency_keys = {k: v for k, v in self.idempotency_keys.items() if v != task_id}
+
+    def bind_idempotency_key(self, key: str, task_id: str) -> str:
+        with self._lock:
+            return self.idempotency_keys.setdefault(key, task_id)
+
+    def get_idempotency_key(self, key: str) -> Optional[str]:
+        with self._lock:
+            return self.idempotency_keys.get(key)
+
+    def release_idempotency_key(self, key: str, task_id: str) -> None:
+        with self._lock:
+            if self.idempotency_keys.get(key) == task_id:
+                del self.idempotency_keys[key]
+
+    def query(self, status=None, created_before=None, order_by="created_at", descending=True, limit=None, offset=0):
+        with self._lock:
+            tasks = [
+                dict(task) for task in self.tasks.values()
+                if (status is None or task["status"] == status)
+                and (created_before is None or task["created_at"] < created_before)
+            ]
+        tasks.sort(key=lambda x: x.get(order_by, 0), reverse=descending)
+        end = offset + limit if limit is not None else None
+        return tasks[offset:end]
+
+    def increment_downloads(self, task_id: str, timestamp: float) -> Optional[Dict]:
+        with self._lock:
+            task = self.tasks.get(task_id)
+            if task is None:
+                return None
+            task["downloads"] = task.get("downloads", 0) + 1
+            self.download_history.append({
+                "task_id": task_id,
+                "timestamp": timestamp,
+                "filename": task["output_filename"]
+            })
+            self.download_history = self.download_history[-DOWNLOAD_HISTORY_SIZE:]
+            return dict(task)
+
+    def heartbeat_owner(self, owner_id: str, timestamp: float) -> None:
+        with self._lock:
+            self.owners[owner_id] = timestamp
+
+    def owner_heartbeat(self, owner_id: str) -> Optional[float]:
+        with self._lock:
+            return self.owners.get(owner_id)
+
+    def remove_owner(self, owner_id: str) -> None:
+        with self._lock:
+            self.owners.pop(owner_id, None)
+
+    def recent_downloads(self, limit: int) -> List[Dict]:
+        with self._lock:
+            return sorted(self.download_history, key=lambda x: x["timestamp"], reverse=True)[:limit]
+
+
+class SQLiteTaskStore(TaskStore):
+    """
+    SQLite store shared by every process that opens the same file.
+
+    Status, creation time and download count live in indexed columns; all
+    other task fields are kept as JSON. Each thread gets its own connection.
+    The file is in WAL mode unless it is shared across hosts, since WAL
+    only works among processes on one host; a shared file uses a rollback
+    journal and needs a filesystem with working POSIX locks.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS tasks (
+            id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            downloads INTEGER NOT NULL DEFAULT 0,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_tasks_status_created ON tasks(status, created_at);
+        CREATE INDEX IF NOT EXISTS idx_tasks_created ON tasks(created_at);
+        CREATE INDEX IF NOT EXISTS idx_tasks_status_downloads ON tasks(status, downloads);
+        CREATE TABLE IF NOT EXISTS downloads (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            task_id TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            timestamp REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            key TEXT PRIMARY KEY,
+            task_id TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_idempotency_keys_task ON idempotency_keys(task_id);
+        CREATE TABLE IF NOT EXISTS owners (
+            id TEXT PRIMARY KEY,
+            heartbeat_at REAL NOT NULL
+        );
+    """
+
+    ORDER_COLUMNS = ("created_at", "downloads")
+
+    def __init__(self, db_path: str, shared_across_hosts: bool = False):
+        self.db_path = db_path
+        self.shared_across_hosts = shared_across_hosts
+        self._local = threading.local()
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        conn = self._connect()
+        conn.executescript(self.SCHEMA)
+        logger.info(f"Using SQLite task store at {db_path}")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit mode; writes that read first open explicit transactions
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            if self.shared_across_hosts:
+                conn.execute("PRAGMA journal_mode=DELETE")
+            else:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _row_to_task(row: sqlite3.Row) -> Dict:
+        task = {"id": row["id"], "status": row["status"]}
+        task.update(json.loads(row["data"]))
+        task.update(created_at=row["created_at"], downloads=row["downloads"])
+        return task
+
+    @staticmethod
+    def _split(task: Dict) -> str:
+        return json.dumps({k: v for k, v in task.items() if k not in INDEXED_FIELDS and k != "id"})
+
+    def insert(self, task: Dict) -> None:
+        self._connect().execute(
+            "INSERT INTO tasks (id, status, created_at, downloads, data) VALUES (?, ?, ?, ?, ?)",
+            (task["id"], task["status"], task["created_at"], task.get("downloads", 0), self._split(task))
+        )
+
+    def get(self, task_id: str) -> Optional[Dict]:
+        row = self._connect().execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone()
+        return self._row_to_task(row) if row else None
+
+    def update(self, task_id: str, fields: Dict, expected: Optional[Dict] = None) -> Optional[Dict]:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone()
+            if row is None:
+                conn.execute("ROLLBACK")
+                return None
+            task = self._row_to_task(row)
+            if expected and any(task.get(k) != v for k, v in expected.items()):
+                conn.execute("ROLLBACK")
+                return None
+            task.update(fields)
+            conn.execute(
+                "UPDATE tasks SET status = ?, created_at = ?, downloads = ?, data = ? WHERE id = ?",
+                (task["status"], task["created_at"], task["downloads"], self._split(task), task_id)
+            )
+            conn.execute("COMMIT")
+            return task
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def delete(self, task_id: str) -> None:
+        conn = self._connect()
+        conn.execute("DELETE FROM tasks WHERE id = ?", (task_id,))
+        conn.execute("DELETE FROM idempotency_keys WHERE task_id = ?", (task_id,))
+
+    def bind_idempotency_key(self, key: str, task_id: str) -> str:
+        conn = self._connect()
+        # The primary key makes the first binding win across processes
+        conn.execute("INSERT OR IGNORE INTO idempotency_keys (key, task_id) VALUES (?, ?)", (key, task_id))
+        return self.get_idempotency_key(key) or task_id
+
+    def get_idempotency_key(self, key: str) -> Optional[str]:
+        row = self._connect().execute("SELECT task_id FROM idempotency_keys WHERE key = ?", (key,)).fetchone()
+        return row["task_id"] if row else None
+
+    def release_idempotency_key(self, key: str, task_id: str) -> None:
+        self._connect().execute("DELETE FROM idempotency_keys WHERE key = ? AND task_id = ?", (key, task_id))
+
+    def query(self, status=None, created_before=None, order_by="created_at", descending=True, limit=None, offset=0):
+        if order_by not in self.ORDER_COLUMNS:
+            raise ValueError(f"Cannot order tasks by {order_by}")
+        clauses, params = [], []
+        if status is not None:
+            clauses.append("status = ?")
+            params.append(status)
+        if created_before is not None:
+            clauses.append("created_at < ?")
+            params.append(created_before)
+        sql = "SELECT * FROM tasks"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += f" ORDER BY {order_by} {'DESC' if descending else 'ASC'}"
+        sql += " LIMIT ? OFFSET ?"
+        params += [limit if limit is not None else -1, offset]
+        return [self._row_to_task(row) for row in self._connect().execute(sql, params)]
+
+    def increment_downloads(self, task_id: str, timestamp: float) -> Optional[Dict]:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = conn.execute("UPDATE tasks SET downloads = downloads + 1 WHERE id = ?", (task_id,))
+            if cursor.rowcount == 0:
+                conn.execute("ROLLBACK")
+                return None
+            task = self._row_to_task(conn.execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone())
+            conn.execute(
+                "INSERT INTO downloads (task_id, filename, timestamp) VALUES (?, ?, ?)",
+                (task_id, task["output_filename"], timestamp)
+            )
+            conn.execute(
+                "DELETE FROM downloads WHERE id <= (SELECT MAX(id) FROM downloads) - ?",
+                (DOWNLOAD_HISTORY_SIZE,)
+            )
+            conn.execute("COMMIT")
+            return task
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def recent_downloads(self, limit: int) -> List[Dict]:
+        rows = self._connect().execute(
+            "SELECT task_id, timestamp, filename FROM downloads ORDER BY id DESC LIMIT ?", (limit,)
+        )
+        return [dict(row) for row in rows]
+
+    def heartbeat_owner(self, owner_id: str, timestamp: float) -> None:
+        self._connect().execute(
+            "INSERT INTO owners (id, heartbeat_at) VALUES (?, ?)"
+            " ON CONFLICT(id) DO UPDATE SET heartbeat_at = excluded.heartbeat_at",
+            (owner_id, timestamp)
+        )
+
+    def owner_heartbeat(self, owner_id: str) -> Optional[float]:
+        row = self._connect().execute("SELECT heartbeat_at FROM owners WHERE id = ?", (owner_id,)).fetchone()
+        return row["heartbeat_at"] if row else None
+
+    def remove_owner(self, owner_id: str) -> None:
+        self._connect().execute("DELETE FROM owners WHERE id = ?", (owner_id,))
+
+
+def create_task_store(output_dir: str) -> TaskStore:
+    """
+    Build the store selected by TASK_STORE (sqlite or memory).
+
+    With BROKER_URL, API processes on several hosts share OUTPUT_DIR and
+    the task database in it.
+    """
+    backend = os.getenv('TASK_STORE', 'sqlite').lower()
+    if backend == 'memory':
+        return MemoryTaskStore()
+    if backend == 'sqlite':
+        return SQLiteTaskStore(os.getenv('TASK_DB_PATH', os.path.join(output_dir, 'tasks.db')),
+                               shared_across_hosts=bool(os.getenv('BROKER_URL')))
+    raise ValueError(f"Unknown TASK_STORE '{backend}', expected sqlite or memory")
@@ -0,0 +1,60 @@
+import hashlib
+
+import pytest
+
+import audio_track
+from audio_track import bits_per_second, copy_source, measure_loudness
+
+
+def source(**overrides):
+    return dict({"duration": 30.0, "has_audio": True, "audio_codec": "aac", "audio_sample_rate": 48000,
+                 "audio_channels": 2, "audio_bitrate": 128_000}, **overrides)
+
+
+FULL_RANGE = {"source": "fan", "in": 0.0, "out": None, "start": 0.0, "duration": 30.0}
+
+
+@pytest.mark.parametrize("rate, expected", [("128k", 128_000), ("1.5M", 1_500_000), ("96000", 96_000)])
+def test_bits_per_second(rate, expected):
+    assert bits_per_second(rate) == expected
+
+
+def test_audio_that_fits_the_output_is_copied():
+    assert copy_source([FULL_RANGE], {"fan": source()}, 30.0, "128k") == FULL_RANGE
+
+
+@pytest.mark.parametrize("info", [
+    source(audio_codec="mp3"),
+    source(audio_sample_rate=22050),
+    source(audio_channels=6),
+    source(audio_bitrate=320_000),
+    source(duration=20.0),
+])
+def test_audio_that_needs_work_is_reencoded(info):
+    assert copy_source([FULL_RANGE], {"fan": info}, 30.0, "128k") is None
+
+
+def test_placed_or_split_ranges_are_reencoded():
+    late = dict(FULL_RANGE, start=1.0, duration=29.0)
+    assert copy_source([late], {"fan": source()}, 30.0, "128k") is None
+    first, second = dict(FULL_RANGE, out=10.0, duration=10.0), dict(FULL_RANGE, start=10.0, duration=20.0)
+    assert copy_source([first, second], {"fan": source()}, 30.0, "128k") is None
+
+
+def test_loudness_normalization_always_reencodes(monkeypatch):
+    monkeypatch.setattr(audio_track, "LOUDNESS_NORMALIZATION", True)
+    assert copy_source([FULL_RANGE], {"fan": source()}, 30.0, "128k") is None
+
+
+def test_loudness_is_measured_once_per_input(make_clip, tmp_path, monkeypatch):
+    monkeypatch.setattr(audio_track, "LOUDNESS_CACHE_DIR", str(tmp_path))
+    path = make_clip("320x180@25:3", "fan")
+    with open(path, "rb") as f:
+        sha256 = hashlib.sha256(f.read()).hexdigest()
+    measured = measure_loudness(path)
+    assert (tmp_path / f"{sha256}.json").exists()
+
+    # A known checksum is used as is, without reading the file again
+    monkeypatch.setattr(audio_track, "file_sha256", lambda path: pytest.fail("input was hashed again"))
+    monkeypatch.setattr(audio_track, "run_ffmpeg", lambda *args, **kwargs: pytest.fail("input was measured again"))
+    assert measure_loudness(path, sha256=sha256) == measured
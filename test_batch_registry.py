@@ -0,0 +1,33 @@
+import os
+import time
+
+from batch_registry import BatchRegistry
+
+
+def test_batches_persist_across_instances(tmp_path):
+    registry = BatchRegistry(str(tmp_path))
+    registry.create_batch("b1", "source", "smart", "standard")
+    registry.add_task("b1", "t1")
+    registry.add_task("b1", "t2")
+    batch = BatchRegistry(str(tmp_path)).get_batch("b1")
+    assert (batch["wwe_source_id"], batch["engine"], batch["task_ids"]) == ("source", "smart", ["t1", "t2"])
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+
+def test_unknown_and_malformed_ids_name_no_batch(tmp_path):
+    registry = BatchRegistry(str(tmp_path))
+    assert registry.add_task("missing", "t1") is None
+    assert registry.get_batch("missing") is None
+    assert registry.get_batch("../b1") is None
+
+
+def test_batches_are_listed_newest_first_and_cleaned_up_by_age(tmp_path, monkeypatch):
+    registry = BatchRegistry(str(tmp_path))
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now - 48 * 3600)
+    registry.create_batch("old", "source", "ffmpeg", "standard")
+    monkeypatch.setattr(time, "time", lambda: now)
+    registry.create_batch("new", "source", "ffmpeg", "standard")
+    assert [batch["id"] for batch in registry.get_all_batches()] == ["new", "old"]
+    registry.cleanup_old_batches(max_age_hours=24)
+    assert [batch["id"] for batch in registry.get_all_batches()] == ["new"]
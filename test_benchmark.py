@@ -0,0 +1,28 @@
+import argparse
+
+import pytest
+
+from benchmark import compare_with_baseline, parse_fixture
+
+
+def test_parse_fixture():
+    assert parse_fixture("1920x1080@59.94:35:noaudio") == {
+        "spec": "1920x1080@59.94:35:noaudio", "width": 1920, "height": 1080, "fps": 59.94, "duration": 35.0,
+        "audio": False,
+    }
+    assert parse_fixture("640x360@25:32")["audio"]
+
+
+@pytest.mark.parametrize("spec", ["640x360", "640x360@25", "640x360@25:32:mute", "x360@25:32"])
+def test_parse_fixture_rejects_malformed_specs(spec):
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_fixture(spec)
+
+
+def test_compare_with_baseline_flags_regressions_beyond_tolerance():
+    baseline = {"cases": [{"id": "a", "wall_time": 10.0, "psnr": 40.0, "ssim": 0.98}]}
+    report = {"cases": [{"id": "a", "wall_time": 10.4, "psnr": 36.0, "ssim": 0.99}, {"id": "new", "wall_time": 1.0}]}
+    regressions = compare_with_baseline(report, baseline, tolerance=5)
+    assert [(r["case"], r["metric"]) for r in regressions] == [("a", "psnr")]
+    assert report["cases"][0]["baseline_change_pct"] == {"wall_time": 4.0, "psnr": -10.0, "ssim": 1.02}
+    assert "baseline_change_pct" not in report["cases"][1]
@@ -0,0 +1,93 @@
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+import downloads
+from downloads import download_response, parse_range
+
+
+def make_request(**headers):
+    raw = [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()]
+    return Request({"type": "http", "method": "GET", "headers": raw})
+
+
+@pytest.fixture
+def video(tmp_path):
+    path = tmp_path / "output.mp4"
+    path.write_bytes(bytes(range(256)) * 4)
+    return str(path)
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 1023)),
+    ("bytes=1000-5000", (1000, 1023)),
+    ("bytes=-24", (1000, 1023)),
+    ("bytes=-5000", (0, 1023)),
+    ("items=0-1", None),
+    ("bytes=0-1,5-6", None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 1024) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=1024-", "bytes=10-5", "bytes=-0", "bytes=a-b"])
+def test_parse_range_rejects_unsatisfiable_ranges(header):
+    with pytest.raises(ValueError):
+        parse_range(header, 1024)
+
+
+@pytest.mark.parametrize("headers, status, full", [
+    ({}, 200, True),
+    ({"range": "bytes=0-1023"}, 206, True),
+    ({"range": "bytes=0-"}, 206, True),
+    ({"range": "bytes=0-99"}, 206, False),
+    ({"range": "bytes=512-"}, 206, False),
+    ({"range": "bytes=4096-"}, 416, False),
+])
+def test_only_whole_file_transfers_count_as_downloads(video, headers, status, full):
+    response, full_download = download_response(make_request(**headers), video, "output.mp4")
+    assert response.status_code == status
+    assert full_download is full
+
+
+def test_revalidation_is_not_a_download(video):
+    response, _ = download_response(make_request(), video, "output.mp4")
+    revalidated, full_download = download_response(make_request(if_none_match=response.headers["etag"]),
+                                                    video, "output.mp4")
+    assert revalidated.status_code == 304
+    assert not full_download
+
+
+def test_stale_if_range_sends_the_whole_file(video):
+    response, full_download = download_response(make_request(range="bytes=0-99", if_range='"stale"'),
+                                                video, "output.mp4")
+    assert response.status_code == 200
+    assert full_download
+
+
+@pytest.mark.parametrize("mode, header", [("nginx", "x-accel-redirect"), ("sendfile", "x-sendfile")])
+def test_accel_modes_only_count_whole_file_requests(video, monkeypatch, mode, header):
+    monkeypatch.setattr(downloads, "DOWNLOAD_ACCEL_MODE", mode)
+    response, full_download = download_response(make_request(), video, "output.mp4")
+    assert header in response.headers
+    assert full_download
+    _, full_download = download_response(make_request(range="bytes=0-99"), video, "output.mp4")
+    assert not full_download
+    _, full_download = download_response(make_request(range="bytes=0-"), video, "output.mp4")
+    assert full_download
+
+
+def test_range_response_sends_only_the_range(video):
+    app = FastAPI()
+
+    @app.get("/file")
+    async def get_file(request: Request):
+        return download_response(request, video, "output.mp4")[0]
+
+    client = TestClient(app)
+    assert client.get("/file").content == open(video, "rb").read()
+    response = client.get("/file", headers={"range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.headers["content-range"] == "bytes 10-19/1024"
+    assert response.content == bytes(range(10, 20))
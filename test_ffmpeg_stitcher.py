@@ -0,0 +1,58 @@
+import re
+import subprocess
+from typing import List
+
+import pytest
+
+from stitch_plan import compile_timeline
+
+# Timeline over a 25 fps clip rendered at 30 fps, with cuts and a fade
+TIMELINE = {
+    "segments": [
+        {"source": "wwe", "in": 0, "out": 2},
+        {"source": "fan", "in": 1.3, "out": 3.3, "transition": {"type": "fade", "duration": 0.5}},
+        {"source": "wwe", "in": 3.5, "out": 5},
+    ],
+    "audio": [{"source": "fan", "in": 0, "start": 0}],
+}
+
+
+def frame_psnr(ffmpeg: str, output: str, reference: str) -> List[float]:
+    """Luma PSNR of every frame of output against the same frame of reference"""
+    result = subprocess.run(
+        [ffmpeg, '-hide_banner', '-nostdin', '-i', output, '-i', reference,
+         '-lavfi', '[0:v][1:v]psnr=stats_file=-', '-f', 'null', '-'],
+        capture_output=True, text=True, check=True
+    )
+    # Identical frames, such as black ones mid-fade, have an infinite PSNR
+    return [float(value) if value != "inf" else 100.0 for value in re.findall(r"psnr_y:(\S+)", result.stdout)]
+
+
+def test_matches_the_frame_path_frame_by_frame(ffmpeg, make_clip, small_output, tmp_path):
+    pytest.importorskip("cv2")
+    from ffmpeg_stitcher import FFmpegStitcher
+    from video_stitcher import VideoStitcher
+
+    # A moving pattern, so showing a neighbouring source frame costs a lot of PSNR
+    clip = make_clip("320x180@25:6")
+    timeline = compile_timeline(TIMELINE)
+    FFmpegStitcher(clip, clip, "archive", timeline).stitch_videos(str(tmp_path / "ffmpeg.mp4"))
+    VideoStitcher(clip, clip, "archive", timeline).stitch_videos(str(tmp_path / "frames.mp4"))
+
+    psnr = frame_psnr(ffmpeg, str(tmp_path / "ffmpeg.mp4"), str(tmp_path / "frames.mp4"))
+    assert len(psnr) == round(timeline["duration"] * 30)
+    # The same source frame differs only by encoding, around 40 dB; a neighbouring one is near 22 dB
+    assert min(psnr) > 35
+
+
+def test_rejects_segments_past_the_end_of_a_source(make_clip, small_output):
+    from ffmpeg_stitcher import FFmpegStitcher
+
+    clip = make_clip("320x180@25:6")
+    timeline = compile_timeline({"segments": [{"source": "wwe", "in": 7, "out": 9}]})
+    stitcher = FFmpegStitcher(clip, clip, "archive", timeline)
+    try:
+        with pytest.raises(ValueError, match="too short"):
+            stitcher.build_command("out.mp4")
+    finally:
+        stitcher.cleanup()
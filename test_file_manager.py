@@ -0,0 +1,132 @@
+import asyncio
+import hashlib
+import io
+import os
+import time
+
+import pytest
+from fastapi import UploadFile
+
+import file_manager
+from file_manager import StorageManager, StorageQuotaError, UploadTooLargeError, save_upload
+from result_cache import ResultCache
+from task_manager import TaskManager, TaskStatus
+from task_store import MemoryTaskStore
+
+MB = 1024 * 1024
+
+
+def upload(data: bytes, size=None) -> UploadFile:
+    return UploadFile(file=io.BytesIO(data), filename="clip.mp4", size=size)
+
+
+def test_save_upload_copies_in_chunks_and_hashes(tmp_path):
+    data = os.urandom(10_000)
+    dest = str(tmp_path / "clip.mp4")
+    saved = asyncio.run(save_upload(upload(data), dest, max_bytes=len(data), chunk_size=999))
+    assert saved == {"path": dest, "size": len(data), "sha256": hashlib.sha256(data).hexdigest()}
+    with open(dest, "rb") as f:
+        assert f.read() == data
+
+
+def test_save_upload_stops_past_the_limit_and_removes_the_partial_file(tmp_path):
+    dest = tmp_path / "clip.mp4"
+    with pytest.raises(UploadTooLargeError):
+        asyncio.run(save_upload(upload(b"x" * 5000), str(dest), max_bytes=4096, chunk_size=1024))
+    assert not dest.exists()
+
+
+def test_save_upload_rejects_a_known_size_before_reading(tmp_path):
+    dest = tmp_path / "clip.mp4"
+    with pytest.raises(UploadTooLargeError):
+        asyncio.run(save_upload(upload(b"x", size=10_000), str(dest), max_bytes=4096))
+    assert not dest.exists()
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    # Keep reap_orphans away from the real scratch directories in the system temp dir
+    monkeypatch.setattr(file_manager, "SCRATCH_DIR", str(tmp_path / "scratch"))
+    output_dir, temp_dir = tmp_path / "output", tmp_path / "temp"
+    temp_dir.mkdir()
+    cache = ResultCache(str(output_dir / "cache"), 100 * MB)
+    task_manager = TaskManager(str(output_dir), result_cache=cache, store=MemoryTaskStore())
+    return StorageManager(str(temp_dir), task_manager, temp_quota=1, output_quota=1)
+
+
+def completed_task(storage, task_id, size, downloads=0, cache_key=None):
+    task_manager = storage.task_manager
+    task = task_manager.create_task(task_id, "wwe.mp4", "fan.mp4")
+    path = os.path.join(storage.output_dir, task["output_filename"])
+    if cache_key and task_manager.result_cache.link_to(cache_key, path):
+        task_manager.update_task(task_id, cache_key=cache_key)
+    else:
+        with open(path, "wb") as f:
+            f.write(b"x" * size)
+        if cache_key:
+            task_manager.result_cache.store(cache_key, path)
+            task_manager.update_task(task_id, cache_key=cache_key)
+    task_manager.update_task(task_id, downloads=downloads)
+    task_manager.update_task_status(task_id, TaskStatus.COMPLETED, progress=100)
+    return path
+
+
+def test_usage_counts_hard_linked_outputs_once(storage):
+    completed_task(storage, "a", 300_000, cache_key="k")
+    completed_task(storage, "b", 300_000, cache_key="k")
+    completed_task(storage, "c", 100_000)
+    assert storage.usage()["output"] == 400_000
+
+
+def test_quota_evicts_the_least_downloaded_outputs_first(storage):
+    popular = completed_task(storage, "popular", 600_000, downloads=5)
+    unpopular = completed_task(storage, "unpopular", 600_000, downloads=1)
+    assert storage.enforce_output_quota() == 600_000
+    assert os.path.exists(popular) and not os.path.exists(unpopular)
+    assert storage.task_manager.get_task("unpopular")["evicted"]
+    assert storage.usage()["output"] <= MB
+
+
+def test_evicting_a_cached_output_drops_its_cache_entry(storage):
+    cache = storage.task_manager.result_cache
+    cached = completed_task(storage, "cached", 700_000, cache_key="k")
+    completed_task(storage, "other", 700_000, downloads=3)
+    assert storage.enforce_output_quota() == 700_000
+    assert not os.path.exists(cached)
+    assert cache.lookup("k") is None
+
+
+def test_removing_a_hard_linked_file_frees_nothing(tmp_path):
+    path, link = tmp_path / "a", tmp_path / "b"
+    path.write_bytes(b"x" * 1000)
+    os.link(path, link)
+    assert file_manager._remove(str(path), "test") == 0
+    assert file_manager._remove(str(link), "test") == 1000
+
+
+def test_orphans_are_reaped_once_old(storage):
+    claimed = completed_task(storage, "a", 10)
+    orphan = os.path.join(storage.output_dir, "output_gone.mp4")
+    upload = os.path.join(storage.temp_dir, "upload.mp4")
+    scratch = file_manager.make_scratch_dir()
+    frames = os.path.join(scratch, "frames.raw")
+    for path in (orphan, upload, frames):
+        with open(path, "wb") as f:
+            f.write(b"x" * 10)
+    assert storage.reap_orphans() == 0
+
+    old = time.time() - file_manager.ORPHAN_MAX_AGE - 60
+    for path in (claimed, orphan, upload, frames, scratch):
+        os.utime(path, (old, old))
+    storage.add_claim(lambda: [upload])
+    assert storage.reap_orphans() == 20
+    assert os.path.exists(claimed) and os.path.exists(upload)
+    assert not os.path.exists(orphan) and not os.path.exists(scratch)
+
+
+def test_ensure_temp_space_refuses_uploads_over_the_quota(storage):
+    storage.ensure_temp_space(MB)
+    with open(os.path.join(storage.temp_dir, "upload.mp4"), "wb") as f:
+        f.write(b"x" * 600_000)
+    with pytest.raises(StorageQuotaError):
+        storage.ensure_temp_space(600_000)
@@ -0,0 +1,59 @@
+import itertools
+import threading
+
+import pytest
+
+from frame_pipeline import FramePipeline, FramePool
+from job_executor import JobCancelledError
+
+
+def test_items_pass_every_stage_in_order():
+    pipeline = FramePipeline(depth=2)
+    seen = []
+    pipeline.run(("source", range(100)), [("double", lambda x: x * 2), ("collect", seen.append)])
+    assert seen == [x * 2 for x in range(100)]
+    assert set(pipeline.busy) == {"source", "double", "collect"}
+
+
+def test_pooled_frames_are_reused():
+    pipeline = FramePipeline(depth=2)
+    pool = pipeline.make_pool((4, 4, 3))
+    buffers = set()
+
+    def fill(i):
+        frame = pool.acquire()
+        frame.fill(i)
+        return frame
+
+    def release(frame):
+        buffers.add(id(frame))
+        pool.release(frame)
+
+    pipeline.run(("decode", map(fill, range(50))), [("scale", lambda frame: frame), ("encode", release)])
+    assert len(buffers) <= 2 * 2 + 3
+
+
+def test_a_failing_stage_stops_the_pipeline():
+    def fail(x):
+        if x == 5:
+            raise RuntimeError("encoder died")
+        return x
+
+    with pytest.raises(RuntimeError, match="encoder died"):
+        FramePipeline(depth=2).run(("source", itertools.count()), [("encode", fail)])
+
+
+def test_cancelling_stops_an_endless_source():
+    with pytest.raises(JobCancelledError):
+        FramePipeline(depth=2).run(("source", itertools.count()), [("encode", lambda x: x)],
+                                   should_cancel=lambda: True)
+
+
+def test_acquire_gives_up_once_stopped():
+    stop = threading.Event()
+    pool = FramePool((2, 2), 1, stop)
+    pool.acquire()
+    stop.set()
+    with pytest.raises(Exception) as excinfo:
+        pool.acquire()
+    assert type(excinfo.value).__name__ == "PipelineStopped"
@@ -0,0 +1,93 @@
+import pytest
+
+import job_broker
+from job_broker import JobState, SQLiteBroker
+
+
+@pytest.fixture
+def broker(tmp_path):
+    return SQLiteBroker(str(tmp_path / "broker.db"))
+
+
+def enqueue(broker, task_id, priority="standard", client_id="a", max_jobs=10):
+    return broker.enqueue(task_id, "job_executor:run_stitch_job", [task_id], priority, client_id, "api", max_jobs)
+
+
+def test_broker_does_not_use_wal(broker):
+    # WAL needs shared memory on one host, and the broker file is shared across nodes
+    assert broker._connect().execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+
+
+def test_enqueue_respects_the_job_limit(broker):
+    assert enqueue(broker, "t1", max_jobs=1)["state"] == JobState.PENDING
+    assert enqueue(broker, "t2", max_jobs=1) is None
+    assert broker.get_job("t1")["args"] == ["t1"]
+
+
+def test_claims_follow_the_scheduler(broker):
+    enqueue(broker, "bulk", priority="bulk")
+    enqueue(broker, "standard")
+    enqueue(broker, "preview", priority="preview")
+    claimed = [broker.claim("w1")["task_id"] for _ in range(3)]
+    assert claimed == ["preview", "standard", "bulk"]
+    assert broker.claim("w1") is None
+    assert broker.counts()[JobState.RUNNING] == 3
+
+
+def test_finish_sends_the_outcome_to_the_submitter(broker):
+    job = enqueue(broker, "t1")
+    broker.claim("w1")
+    broker.add_event(job["id"], "progress", {"progress": 50})
+    assert not broker.finish(job["id"], "w2", {"result": "out.mp4"})
+    assert broker.finish(job["id"], "w1", {"result": "out.mp4"})
+    assert broker.get_job("t1") is None
+    assert broker.fetch_events("api") == [("t1", "progress", {"progress": 50}), ("t1", "done", {"result": "out.mp4"})]
+    assert broker.fetch_events("api") == []
+
+
+def test_cancel_drops_pending_jobs_and_flags_running_ones(broker):
+    running = enqueue(broker, "running")
+    assert broker.claim("w1")["task_id"] == "running"
+    pending = enqueue(broker, "pending")
+    assert broker.cancel(pending["id"])
+    assert broker.get_job("pending") is None
+    assert not broker.is_cancel_requested(running["id"], "w1")
+    assert not broker.cancel(running["id"])
+    assert broker.get_job("running")
+    assert broker.is_cancel_requested(running["id"], "w1")
+
+
+def test_jobs_of_silent_workers_are_requeued(broker, monkeypatch):
+    job = enqueue(broker, "t1")
+    broker.claim("w1")
+    broker.heartbeat("w1", 2)
+    assert broker.counts()["slots"] == 2
+    monkeypatch.setattr(job_broker, "WORKER_TIMEOUT", -1)
+    broker.requeue_stale()
+    assert broker.get_job("t1")["state"] == JobState.PENDING
+    # The worker that lost the job must stop it
+    assert broker.is_cancel_requested(job["id"], "w1")
+    assert broker.fetch_events("api") == [("t1", "progress", {"stage": "queued", "progress": 0})]
+    assert broker.claim("w2")["attempts"] == 2
+
+
+def test_jobs_fail_once_out_of_attempts(broker, monkeypatch):
+    monkeypatch.setattr(job_broker, "MAX_JOB_ATTEMPTS", 2)
+    monkeypatch.setattr(job_broker, "WORKER_TIMEOUT", -1)
+    enqueue(broker, "t1")
+    for worker in ("w1", "w2"):
+        broker.claim(worker)
+        broker.requeue_stale()
+    assert broker.get_job("t1") is None
+    (task_id, kind, data), = [event for event in broker.fetch_events("api") if event[1] == "done"]
+    assert data == {"error": "Worker w2 stopped responding on all 2 attempts", "cancelled": False}
+
+
+def test_adopt_moves_jobs_and_events_to_a_new_submitter(broker):
+    job = enqueue(broker, "t1")
+    broker.add_event(job["id"], "queued", {})
+    assert broker.adopt("t1", "api2")["submitter"] == "api2"
+    assert broker.adopted_away(["t1", "t2"], "api") == ["t1"]
+    assert broker.fetch_events("api") == []
+    assert broker.fetch_events("api2") == [("t1", "queued", {})]
+    assert broker.adopt("missing", "api2") is None
@@ -0,0 +1,158 @@
+import time
+import queue
+import threading
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+import job_executor
+from job_executor import JobCancelledError, JobContext, JobExecutor, QueueFullError
+
+
+@pytest.fixture
+def context():
+    return JobContext("task", threading.Event(), queue.Queue())
+
+
+def events(context):
+    reported = []
+    while not context._events.empty():
+        task_id, kind, data = context._events.get_nowait()
+        assert task_id == "task"
+        reported.append((kind, data))
+    return reported
+
+
+def test_progress_maps_stages_to_overall_percent(context):
+    context.progress("normalize")
+    context.progress("encode", 0, 100)
+    context.progress("encode", 100, 100)
+    context.progress("mux")
+    context.progress("package", 10, 10)
+    assert [data["progress"] for _, data in events(context)] == [0, 5, 95, 95, 99]
+
+
+def test_progress_is_throttled_within_a_stage(context, monkeypatch):
+    monkeypatch.setattr(job_executor, "PROGRESS_INTERVAL", 60)
+    context.progress("encode", 1, 100)
+    context.progress("encode", 50, 100)
+    context.progress("encode", 100, 100)
+    context.progress("mux")
+    assert [(data["stage"], data["frames_done"]) for _, data in events(context)] == [
+        ("encode", 1), ("encode", 100), ("mux", 0)
+    ]
+
+
+def test_progress_reports_an_eta_while_encoding(context):
+    context.progress("encode", 0, 100)
+    context._encode_started -= 10
+    context._last_progress -= 10
+    context.progress("encode", 25, 100)
+    eta = events(context)[-1][1]["eta"]
+    assert eta == pytest.approx(30, rel=0.05)
+
+
+def test_check_cancelled_raises_once_cancelled(context):
+    context.check_cancelled()
+    context._cancel_event.set()
+    assert context.is_cancelled()
+    with pytest.raises(JobCancelledError):
+        context.check_cancelled()
+
+
+def add(context, a, b):
+    context.progress("encode", 1, 1)
+    return a + b
+
+
+def wait_for_cancel(context):
+    while True:
+        context.check_cancelled()
+        time.sleep(0.05)
+
+
+@pytest.fixture
+def executor(monkeypatch):
+    monkeypatch.setattr(job_executor, "WARM_POOL", False)
+    executor = JobExecutor(max_workers=1, max_queue_size=1)
+    executor.start()
+    yield executor
+    executor.shutdown()
+
+
+def test_submit_runs_the_job_and_calls_on_done(executor):
+    done = []
+    progress = []
+    executor.on_event("progress", lambda task_id, data: progress.append((task_id, data["stage"])))
+    future = executor.submit("task", add, 2, 3, on_done=lambda task_id, fut: done.append((task_id, fut.result())))
+    assert future.result(timeout=60) == 5
+    deadline = time.time() + 5
+    while not (done and progress) and time.time() < deadline:
+        time.sleep(0.05)
+    assert done == [("task", 5)]
+    assert progress == [("task", "encode")]
+    assert not executor.holds("task")
+
+
+def test_submit_refuses_jobs_beyond_capacity(executor):
+    executor.submit("running", wait_for_cancel)
+    queued = executor.submit("waiting", wait_for_cancel)
+    with pytest.raises(ValueError):
+        executor.submit("waiting", wait_for_cancel)
+    with pytest.raises(QueueFullError):
+        executor.submit("refused", wait_for_cancel)
+    assert not executor.has_capacity()
+    assert executor.cancel("waiting")
+    assert queued.cancelled()
+    assert executor.has_capacity()
+
+
+def test_cancel_stops_a_running_job(executor):
+    future = executor.submit("task", wait_for_cancel)
+    deadline = time.time() + 60
+    while not future.running() and time.time() < deadline:
+        time.sleep(0.05)
+    assert executor.cancel("task")
+    with pytest.raises(JobCancelledError):
+        future.result(timeout=60)
+    assert not executor.cancel("task")
+
+
+class FinishedPool:
+    """A pool whose futures are already settled when submit returns"""
+
+    def __init__(self, error=None):
+        self.error = error
+
+    def submit(self, fn, context, *args):
+        if self.error:
+            raise self.error
+        future = Future()
+        future.set_result(fn(context, *args))
+        return future
+
+
+@pytest.fixture
+def finished_pool(executor):
+    """Swap the executor's pool for a FinishedPool, restoring it before the executor shuts down"""
+    pool = executor._pool
+    executor._pool = FinishedPool()
+    yield executor._pool
+    executor._pool = pool
+
+
+def test_jobs_that_finish_during_dispatch_do_not_deadlock(executor, finished_pool):
+    done = []
+    future = executor.submit("task", add, 2, 3, on_done=lambda task_id, fut: done.append(task_id))
+    assert future.result(timeout=5) == 5
+    assert done == ["task"]
+    assert not executor.holds("task")
+
+
+def test_a_job_the_pool_refuses_fails_instead_of_running_forever(executor, finished_pool):
+    finished_pool.error = BrokenProcessPool("pool is broken")
+    future = executor.submit("task", add, 2, 3)
+    with pytest.raises(BrokenProcessPool):
+        future.result(timeout=5)
+    assert not executor.holds("task")
@@ -0,0 +1,101 @@
+import time
+
+import pytest
+
+import queue_manager
+
+API = "/api/v1"
+
+
+@pytest.fixture
+def tester(monkeypatch):
+    """Headers of requests from a client named by its API key"""
+    monkeypatch.setattr(queue_manager, "API_KEYS", {"key": "tester"})
+    return {"x-api-key": "key"}
+
+
+def test_oversized_uploads_are_refused_from_their_content_length(api):
+    # MAX_UPLOAD_SIZE is 1MB per video and a stitch takes two
+    response = api.post(f"{API}/stitch", content=b"x" * (3 * 1024 * 1024),
+                        headers={"content-type": "multipart/form-data; boundary=x"})
+    assert response.status_code == 413
+
+
+def test_non_mp4_uploads_are_refused(api):
+    files = {"wwe_video": ("clip.avi", b"x", "video/x-msvideo"), "fan_video": ("fan.mp4", b"x", "video/mp4")}
+    assert api.post(f"{API}/stitch", files=files).status_code == 400
+
+
+def test_repeated_idempotency_keys_replay_the_first_task(api, tester):
+    import main
+    task = main.task_manager.create_task("replayed", "wwe.mp4", "fan.mp4")
+    main.task_manager.bind_idempotency_key("tester:retry", task["id"])
+    # The body is not read, so a repeat need not upload the videos again
+    response = api.post(f"{API}/stitch", headers=dict(tester, **{"idempotency-key": "retry"}))
+    assert response.status_code == 200
+    assert response.headers["idempotent-replayed"] == "true"
+    assert response.json()["id"] == "replayed"
+
+
+def test_keys_of_requests_still_being_accepted_answer_409(api, tester):
+    import main
+    main.task_manager.bind_idempotency_key("tester:inflight", "not-created-yet")
+    response = api.post(f"{API}/stitch", headers=dict(tester, **{"idempotency-key": "inflight"}))
+    assert response.status_code == 409
+    assert response.headers["retry-after"] == "1"
+
+
+def test_rejected_requests_do_not_use_up_their_key(api, tester):
+    import main
+    # Bytes that are no video fail preflight after the key was bound
+    files = {"wwe_video": ("wwe.mp4", b"x", "video/mp4"), "fan_video": ("fan.mp4", b"x", "video/mp4")}
+    response = api.post(f"{API}/stitch", files=files, headers=dict(tester, **{"idempotency-key": "rejected"}))
+    assert response.status_code == 422
+    assert main.task_manager.get_idempotency_key("tester:rejected") is None
+
+
+def test_unknown_engines_are_refused(api):
+    files = {"wwe_video": ("wwe.mp4", b"x", "video/mp4"), "fan_video": ("fan.mp4", b"x", "video/mp4")}
+    response = api.post(f"{API}/stitch", files=files, data={"engine": "moviepy2"})
+    assert response.status_code == 400
+    assert "frames, ffmpeg, smart" in response.json()["detail"]
+
+
+def test_jobs_get_the_checksums_of_the_files_they_read(api):
+    import main
+    task = {"wwe_sha256": "w", "fan_sha256": "f"}
+    assert main.input_checksums(task) == {"wwe": "w", "fan": "f"}
+    # A registered source is read from its mezzanine copy, which the checksum does not describe
+    assert main.input_checksums(dict(task, wwe_source_id="source")) == {"fan": "f"}
+
+
+def test_ready_once_the_workers_are_warm(api):
+    assert api.get("/status").status_code == 200
+    deadline = time.monotonic() + 60
+    while (response := api.get("/ready")).status_code == 503 and time.monotonic() < deadline:
+        time.sleep(0.2)
+    assert response.status_code == 200
+    assert response.json()["ready"]
+
+
+def test_recovery_takes_over_only_tasks_whose_owner_lease_lapsed(api):
+    import main
+    from task_manager import TaskManager, TaskStatus
+    other = TaskManager(main.OUTPUT_DIR, store=main.task_manager.store)
+    other.start_lease()
+    try:
+        for task_id in ("live", "gone", "deferred"):
+            other.create_task(task_id, "wwe.mp4", "fan.mp4")
+            other.update_task_status(task_id, TaskStatus.PROCESSING)
+            other.update_task(task_id, stage="encode")
+        main.task_manager.update_task("deferred", stage="preview_ready", owner={"id": "gone"})
+        main.task_manager.update_task("gone", owner={"id": "gone"})
+        main.recover_interrupted_tasks()
+        live, gone, deferred = (main.task_manager.get_task(task_id) for task_id in ("live", "gone", "deferred"))
+        assert live["status"] == "processing" and live["owner"] == other.owner
+        assert gone["status"] == "failed" and main.task_manager.owns(gone)
+        assert deferred["status"] == "processing" and main.task_manager.owns(deferred)
+    finally:
+        other.stop_lease()
+        for task_id in ("live", "gone", "deferred"):
+            main.task_manager.store.delete(task_id)
@@ -0,0 +1,37 @@
+from prometheus_client import REGISTRY
+
+import metrics
+from metrics import StageTimer, count_transition, directory_size, observe_stage
+
+
+def test_stage_timer_accumulates_time_per_stage(monkeypatch):
+    clock = iter([0.0, 1.5, 1.5, 2.0, 2.0, 4.25])
+    monkeypatch.setattr(metrics.time, "perf_counter", lambda: next(clock))
+    timer = StageTimer()
+    timer.start("probe")
+    timer.start("encode")
+    timer.start("probe")
+    timer.stop()
+    timer.stop()
+    assert timer.timings == {"probe": 3.75, "encode": 0.5}
+
+
+def test_observe_stage_labels_missing_engines():
+    labels = {"stage": "test", "engine": "none"}
+    before = REGISTRY.get_sample_value("video_stitcher_stage_seconds_count", labels) or 0
+    observe_stage("test", 0.2)
+    assert REGISTRY.get_sample_value("video_stitcher_stage_seconds_count", labels) == before + 1
+
+
+def test_count_transition():
+    labels = {"status": "test"}
+    before = REGISTRY.get_sample_value("video_stitcher_task_transitions_total", labels) or 0
+    count_transition("test")
+    assert REGISTRY.get_sample_value("video_stitcher_task_transitions_total", labels) == before + 1
+
+
+def test_directory_size_sums_nested_files(tmp_path):
+    (tmp_path / "a").write_bytes(b"x" * 10)
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "b").write_bytes(b"x" * 5)
+    assert directory_size(str(tmp_path)) == 15
@@ -0,0 +1,76 @@
+import pytest
+
+import preflight
+from preflight import PreflightError, check_input, preflight_inputs
+from stitch_plan import compile_timeline
+
+SHORT_TIMELINE = compile_timeline({
+    "segments": [{"source": "wwe", "in": 0, "out": 2}, {"source": "fan", "in": 0, "out": 2}],
+    "audio": [{"source": "fan", "in": 0, "start": 0}],
+})
+
+
+def probe(**overrides):
+    return dict({"video_codec": "h264", "duration": 40.0, "width": 1280, "height": 720, "fps": 30.0,
+                 "has_audio": True}, **overrides)
+
+
+def test_accepts_inputs_within_limits():
+    assert check_input("wwe", probe()) == ([], [])
+    assert check_input("fan", probe()) == ([], [])
+
+
+def test_reports_every_problem_with_an_input():
+    errors, warnings = check_input("wwe", probe(video_codec=None, duration=12.0, width=7680, height=4320, fps=None))
+    assert errors == [
+        "WWE video has no video stream",
+        "WWE video is 12.00s long, the timeline needs 30s",
+        "WWE video is 7680x4320, the limit is 3840x2160",
+    ]
+    assert warnings == ["WWE video has no frame rate in its metadata"]
+
+
+def test_rejects_inputs_over_the_duration_limit(monkeypatch):
+    monkeypatch.setattr(preflight, "MAX_INPUT_DURATION", 60)
+    errors, _ = check_input("fan", probe(duration=61.0))
+    assert errors == ["Fan video is 61s long, the limit is 60s"]
+
+
+def test_required_duration_follows_the_timeline():
+    assert check_input("wwe", probe(duration=2.0), SHORT_TIMELINE) == ([], [])
+
+
+def test_missing_fan_audio_is_an_error_unless_allowed(monkeypatch):
+    assert check_input("fan", probe(has_audio=False))[0] == ["Fan video has no audio track for the commentary"]
+    monkeypatch.setattr(preflight, "REQUIRE_FAN_AUDIO", False)
+    assert check_input("fan", probe(has_audio=False)) == ([], ["Fan video has no audio track for the commentary"])
+
+
+def test_wwe_audio_only_matters_when_the_timeline_plays_it():
+    assert check_input("wwe", probe(has_audio=False)) == ([], [])
+    timeline = compile_timeline({"segments": [{"source": "wwe", "in": 0, "out": 2}],
+                                 "audio": [{"source": "wwe", "in": 0, "start": 0}]})
+    assert check_input("wwe", probe(has_audio=False), timeline)[0] == [
+        "WWE video has no audio track for the timeline's audio ranges"
+    ]
+
+
+def test_preflight_inputs_probes_real_files(make_clip):
+    wwe, fan = make_clip("320x180@25:3", "wwe"), make_clip("320x180@25:3", "fan")
+    result = preflight_inputs(SHORT_TIMELINE, wwe=wwe, fan=fan)
+    assert result["warnings"] == []
+    assert (result["wwe"]["width"], result["fan"]["height"]) == (320, 180)
+
+    with pytest.raises(PreflightError) as excinfo:
+        preflight_inputs(wwe=wwe, fan=fan)
+    assert len(excinfo.value.errors) == 2
+    assert excinfo.value.probe["wwe"]["duration"] == pytest.approx(3, abs=0.1)
+
+
+def test_preflight_inputs_rejects_unreadable_files(tmp_path):
+    broken = tmp_path / "broken.mp4"
+    broken.write_bytes(b"not a video")
+    with pytest.raises(PreflightError) as excinfo:
+        preflight_inputs(SHORT_TIMELINE, fan=str(broken))
+    assert excinfo.value.errors == ["Fan video could not be read"]
+    assert excinfo.value.probe["fan"] is None
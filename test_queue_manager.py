@@ -0,0 +1,92 @@
+import time
+
+import pytest
+from fastapi import Request
+
+import queue_manager
+from queue_manager import JobScheduler, client_for_key, priority_for
+
+
+@pytest.fixture
+def clients(monkeypatch):
+    monkeypatch.setattr(queue_manager, "API_KEYS", {"secret": "acme", "other": "globex"})
+    monkeypatch.setattr(queue_manager, "PRIORITY_CLIENTS", {"acme"})
+
+
+# Scheduler times are offsets from the start of the test run; usage decays from real time
+T0 = time.time()
+
+
+def make_request(host="10.0.0.1", **headers):
+    raw = [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()]
+    return Request({"type": "http", "method": "POST", "headers": raw, "client": (host, 5000)})
+
+
+def test_priority_classes(clients):
+    assert priority_for("acme", preview=True) == "preview"
+    assert priority_for("acme", bulk=True) == "bulk"
+    assert priority_for("acme") == "paid"
+    assert priority_for("globex") == "standard"
+    assert priority_for(None) == "standard"
+
+
+def test_only_known_api_keys_name_a_client(clients):
+    assert client_for_key("secret") == "acme"
+    assert client_for_key("guess") is None
+    assert client_for_key(None) is None
+
+
+def test_requests_cannot_claim_a_client_by_header(api, clients):
+    import main
+    assert main.client_id_for(make_request(x_api_key="secret")) == "acme"
+    assert main.client_id_for(make_request(x_client_id="acme")) == "10.0.0.1"
+    assert main.client_id_for(make_request(x_api_key="guess")) == "10.0.0.1"
+    assert priority_for(main.client_id_for(make_request(x_client_id="acme"))) == "standard"
+
+
+def test_jobs_run_by_priority_class_then_age():
+    scheduler = JobScheduler(aging_seconds=1000)
+    scheduler.push("bulk", "bulk", enqueued_at=T0 + 1)
+    scheduler.push("late", "standard", "a", enqueued_at=T0 + 3)
+    scheduler.push("early", "standard", "b", enqueued_at=T0 + 2)
+    scheduler.push("preview", "preview", enqueued_at=T0 + 4)
+    assert [job["task_id"] for job in scheduler.order(now=T0 + 10)] == ["preview", "early", "late", "bulk"]
+    with pytest.raises(ValueError):
+        scheduler.push("x", "urgent")
+
+
+def test_waiting_jobs_are_promoted_by_aging():
+    scheduler = JobScheduler(aging_seconds=60)
+    scheduler.push("bulk", "bulk", enqueued_at=T0 + 0)
+    scheduler.push("standard", "standard", enqueued_at=T0 + 50)
+    assert [job["task_id"] for job in scheduler.order(now=T0 + 50)] == ["standard", "bulk"]
+    # After one aging period the bulk job has reached the standard class and is older
+    assert [job["task_id"] for job in scheduler.order(now=T0 + 60)] == ["bulk", "standard"]
+
+
+def test_clients_take_turns_within_a_class():
+    scheduler = JobScheduler(aging_seconds=1000)
+    for i in range(3):
+        scheduler.push(f"busy{i}", "standard", "busy", enqueued_at=T0 + i)
+    scheduler.push("quiet", "standard", "quiet", enqueued_at=T0 + 10)
+    assert [job["task_id"] for job in scheduler.order(now=T0 + 20)] == ["busy0", "quiet", "busy1", "busy2"]
+
+
+def test_started_jobs_count_against_their_client():
+    scheduler = JobScheduler(aging_seconds=1000)
+    scheduler.push("a1", "standard", "a", enqueued_at=T0 + 1)
+    scheduler.push("a2", "standard", "a", enqueued_at=T0 + 2)
+    assert scheduler.pop_next()["task_id"] == "a1"
+    scheduler.push("b1", "standard", "b", enqueued_at=T0 + 3)
+    assert scheduler.pop_next()["task_id"] == "b1"
+    assert scheduler.pop_next()["task_id"] == "a2"
+    assert scheduler.pop_next() is None
+
+
+def test_estimates_fill_free_workers_in_queue_order():
+    scheduler = JobScheduler(aging_seconds=1000, estimated_job_seconds=60)
+    for i in range(3):
+        scheduler.push(f"t{i}", "standard", f"c{i}", enqueued_at=T0 + i)
+    estimates = scheduler.estimates(running_started=[T0 + 80], workers=2, now=T0 + 100)
+    assert [(e["task_id"], e["queue_position"]) for e in estimates] == [("t0", 1), ("t1", 2), ("t2", 3)]
+    assert [e["estimated_start"] - T0 for e in estimates] == pytest.approx([100, 140, 160], abs=0.1)
@@ -0,0 +1,49 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.templating import Jinja2Templates
+from fastapi.testclient import TestClient
+
+from queue_ui import client_label, create_queue_router
+from task_manager import TaskManager
+from task_store import MemoryTaskStore
+
+
+class QueueSnapshot:
+    """A job executor that only answers snapshot()"""
+
+    def snapshot(self):
+        return {
+            "workers": 1,
+            "capacity": 2,
+            "average_job_seconds": 60.0,
+            "running": [{"task_id": "a", "priority": "standard", "client_id": "10.0.0.7", "started_at": 0}],
+            "queued": [{"task_id": "b", "priority": "bulk", "client_id": "partner", "queue_position": 1,
+                        "estimated_start": 60}],
+        }
+
+
+@pytest.fixture
+def queue_api(tmp_path):
+    task_manager = TaskManager(str(tmp_path), store=MemoryTaskStore())
+    task_manager.create_task("a", "wwe.mp4", "fan.mp4")
+    app = FastAPI()
+    app.include_router(create_queue_router(QueueSnapshot(), task_manager, Jinja2Templates(directory="templates"),
+                                           "/api/v1", lambda request: request.headers.get("x-caller")))
+    return TestClient(app)
+
+
+def test_client_labels_are_stable_and_opaque():
+    assert client_label("10.0.0.7") == client_label("10.0.0.7")
+    assert client_label("10.0.0.7") != client_label("10.0.0.8")
+    assert "10.0.0.7" not in client_label("10.0.0.7")
+    assert client_label(None) is None
+
+
+def test_queue_snapshot_hides_client_ids(queue_api):
+    response = queue_api.get("/api/v1/queue", headers={"x-caller": "partner"})
+    assert response.status_code == 200
+    assert "10.0.0.7" not in response.text and "partner" not in response.text
+    running, queued = response.json()["running"][0], response.json()["queued"][0]
+    assert running["client"] == client_label("10.0.0.7") and not running["mine"]
+    assert queued["client"] == client_label("partner") and queued["mine"]
+    assert running["wwe_filename"] == "wwe.mp4"
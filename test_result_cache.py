@@ -0,0 +1,63 @@
+import os
+import time
+
+from result_cache import ResultCache
+from stitch_plan import compile_timeline, default_timeline
+
+
+def write(path, size: int) -> str:
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    return str(path)
+
+
+def test_key_depends_on_inputs_and_encode_settings():
+    key = ResultCache.make_key("a", "b", "ffmpeg", "standard")
+    assert key == ResultCache.make_key("a", "b", "ffmpeg", "standard", default_timeline())
+    assert key != ResultCache.make_key("b", "a", "ffmpeg", "standard")
+    assert key != ResultCache.make_key("a", "b", "smart", "standard")
+    assert key != ResultCache.make_key("a", "b", "ffmpeg", "archive")
+    timeline = compile_timeline({"segments": [{"source": "wwe", "in": 0, "out": 5}]})
+    assert key != ResultCache.make_key("a", "b", "ffmpeg", "standard", timeline)
+
+
+def test_key_follows_output_settings(monkeypatch):
+    key = ResultCache.make_key("a", "b", "ffmpeg", "standard")
+    monkeypatch.setenv('VIDEO_BITRATE', '4000k')
+    assert key != ResultCache.make_key("a", "b", "ffmpeg", "standard")
+
+
+def test_store_and_link_share_the_data(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), max_bytes=1024)
+    output = write(tmp_path / "output.mp4", 100)
+    cache.store("k", output)
+    assert cache.lookup("k")
+    assert os.stat(cache.lookup("k")).st_ino == os.stat(output).st_ino
+
+    # The entry outlives the task output it came from
+    os.remove(output)
+    assert cache.link_to("k", str(tmp_path / "again.mp4"))
+    assert os.path.getsize(tmp_path / "again.mp4") == 100
+    assert not cache.link_to("missing", str(tmp_path / "none.mp4"))
+
+
+def test_evicts_least_recently_used_entries_past_the_limit(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), max_bytes=250)
+    for i, key in enumerate(("old", "used", "new")):
+        cache.store(key, write(tmp_path / f"{key}.mp4", 100))
+        # mtimes are the LRU clock
+        os.utime(cache.lookup(key), (time.time() - 100 + i * 10,) * 2)
+    assert {entry["key"] for entry in cache.entries()} == {"used", "new"}
+
+    os.utime(cache.lookup("used"), (time.time() - 1000,) * 2)
+    cache.lookup("used")
+    cache.store("newest", write(tmp_path / "newest.mp4", 100))
+    assert {entry["key"] for entry in cache.entries()} == {"used", "newest"}
+
+
+def test_remove_drops_an_entry(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), max_bytes=1024)
+    cache.store("k", write(tmp_path / "output.mp4", 10))
+    assert cache.remove("k")
+    assert cache.lookup("k") is None
+    assert not cache.remove("k")
@@ -0,0 +1,57 @@
+import pytest
+
+from result_cache import ResultCache
+from source_registry import normalize_source
+from stitch_plan import keyframe_times
+from test_ffmpeg_stitcher import frame_psnr
+
+
+@pytest.fixture
+def inputs(make_clip, small_output, tmp_path):
+    """A mezzanine copy of a WWE clip, as a registered source has, and a 25 fps fan clip"""
+    clip = make_clip("320x180@25:32")
+    mezzanine = str(tmp_path / "mezzanine.mp4")
+    normalize_source(clip, mezzanine)
+    # A moving pattern for the fan clip too, so a wrong frame choice shows
+    return mezzanine, clip
+
+
+def test_copies_the_middle_of_wwe_segments_between_keyframes(inputs):
+    from smart_stitcher import SmartStitcher
+
+    stitcher = SmartStitcher(*inputs, "standard")
+    try:
+        pieces = stitcher.plan_pieces()
+    finally:
+        stitcher.cleanup()
+    copied = [piece for piece in pieces if piece["copy"]]
+    assert copied and all(piece["source"] == "wwe" for piece in copied)
+    keyframes = keyframe_times("wwe", 30)
+    for piece in copied:
+        assert any(abs(piece["start"] - t) < 1e-6 for t in keyframes)
+        assert any(abs(piece["end"] - t) < 1e-6 for t in keyframes)
+    # The pieces cover the timeline without gaps
+    assert all(abs(a["end"] - b["start"]) < 1e-6 for a, b in zip(pieces, pieces[1:]) if a["source"] == b["source"])
+
+
+def test_matches_the_frame_path_frame_by_frame(ffmpeg, inputs, tmp_path):
+    pytest.importorskip("cv2")
+    from smart_stitcher import SmartStitcher
+    from video_stitcher import VideoStitcher
+
+    SmartStitcher(*inputs, "standard").stitch_videos(str(tmp_path / "smart.mp4"))
+    VideoStitcher(*inputs, "archive").stitch_videos(str(tmp_path / "frames.mp4"))
+    psnr = frame_psnr(ffmpeg, str(tmp_path / "smart.mp4"), str(tmp_path / "frames.mp4"))
+    assert len(psnr) == 900
+    assert min(psnr) > 35
+
+
+def test_renders_from_a_source_are_keyed_by_the_mezzanine_settings():
+    upload = ResultCache.make_key("a", "b", "smart", "standard")
+    source = ResultCache.make_key("a", "b", "smart", "standard", from_source=True)
+    assert upload != source
+    # Other engines and the smaller preview use the profile's own settings either way
+    assert ResultCache.make_key("a", "b", "ffmpeg", "standard", from_source=True) == \
+        ResultCache.make_key("a", "b", "ffmpeg", "standard")
+    assert ResultCache.make_key("a", "b", "smart", "preview", from_source=True) == \
+        ResultCache.make_key("a", "b", "smart", "preview")
@@ -0,0 +1,56 @@
+import re
+import subprocess
+
+from ffmpeg_utils import probe_media
+from source_registry import SourceRegistry, SourceStatus, mezzanine_tag, normalize_source
+from stitch_plan import keyframe_times
+
+
+def keyframes(ffmpeg: str, path: str):
+    """Timestamps of the keyframes of path"""
+    result = subprocess.run([ffmpeg, '-hide_banner', '-nostdin', '-skip_frame', 'nokey', '-i', path,
+                             '-vf', 'showinfo', '-f', 'null', '-'], capture_output=True, text=True, check=True)
+    return [float(t) for t in re.findall(r"pts_time:(\S+)", result.stderr)]
+
+
+def test_registering_the_same_clip_returns_the_existing_source(tmp_path):
+    registry = SourceRegistry(str(tmp_path))
+    source, created = registry.register("abc123", "wwe.mp4", upload_path="/tmp/upload.mp4")
+    assert created and source["status"] == SourceStatus.PROCESSING
+    again, created = registry.register("abc123", "other.mp4")
+    assert not created and again["filename"] == "wwe.mp4"
+
+    # A failed source can be registered again
+    registry.update_status("abc123", SourceStatus.FAILED, error="boom")
+    source, created = registry.register("abc123", "wwe.mp4")
+    assert created and source["error"] is None
+
+
+def test_records_survive_a_new_registry(tmp_path):
+    SourceRegistry(str(tmp_path)).register("abc123", "wwe.mp4")
+    registry = SourceRegistry(str(tmp_path))
+    assert [source["id"] for source in registry.get_all_sources()] == ["abc123"]
+    assert registry.get_source("../abc123") is None
+
+
+def test_only_the_recorded_owner_can_be_claimed_from(tmp_path):
+    registry = SourceRegistry(str(tmp_path))
+    source, _ = registry.register("abc123", "wwe.mp4", owner={"pid": 1})
+    assert registry.claim(source, {"pid": 2})["owner"] == {"pid": 2}
+    # The record changed since source was read
+    assert registry.claim(source, {"pid": 3}) is None
+    assert [s["id"] for s in registry.get_processing_sources()] == ["abc123"]
+
+
+def test_normalized_copy_has_keyframes_at_every_cut(ffmpeg, make_clip, small_output, tmp_path):
+    clip = make_clip("320x180@25:32")
+    mezzanine = str(tmp_path / "mezzanine.mp4")
+    normalize_source(clip, mezzanine)
+
+    info = probe_media(mezzanine)
+    assert (info["width"], info["height"], info["fps"]) == (320, 180, 30)
+    assert not info["has_audio"]
+    assert info["comment"] == mezzanine_tag()
+    found = keyframes(ffmpeg, mezzanine)
+    for t in keyframe_times("wwe", 30):
+        assert any(abs(t - k) < 1e-3 for k in found), t
@@ -0,0 +1,132 @@
+import pytest
+
+import stitch_plan
+from stitch_plan import (TimelineError, compile_timeline, default_profile, default_timeline, keyframe_times,
+                         output_settings, rate_control_params, required_duration)
+
+
+@pytest.fixture(autouse=True)
+def default_settings(monkeypatch):
+    for name in ("TARGET_WIDTH", "TARGET_HEIGHT", "TARGET_FPS", "VIDEO_BITRATE", "ENCODER_PRESET",
+                 "ENCODER_THREADS", "ENCODING_PROFILE", "STITCH_ENGINE"):
+        monkeypatch.delenv(name, raising=False)
+
+
+def test_standard_profile_uses_the_environment(monkeypatch):
+    monkeypatch.setenv("VIDEO_BITRATE", "3000k")
+    settings = output_settings("standard")
+    assert settings["target_size"] == (1280, 720)
+    assert (settings["video_bitrate"], settings["crf"], settings["tune"]) == ("3000k", None, None)
+    assert rate_control_params(settings) == ["-b:v", "3000k"]
+
+
+def test_preview_profile_scales_down_keeping_the_aspect_ratio(monkeypatch):
+    monkeypatch.setenv("TARGET_WIDTH", "1920")
+    monkeypatch.setenv("TARGET_HEIGHT", "1080")
+    settings = output_settings("preview")
+    assert settings["target_size"] == (640, 360)
+    assert (settings["encoder_preset"], settings["encoder_threads"]) == ("veryfast", 2)
+    assert rate_control_params(settings) == ["-crf", "30", "-tune", "fastdecode"]
+
+
+def test_profile_height_never_scales_up(monkeypatch):
+    monkeypatch.setenv("TARGET_WIDTH", "320")
+    monkeypatch.setenv("TARGET_HEIGHT", "180")
+    assert output_settings("preview")["target_size"] == (320, 180)
+
+
+def test_archive_profile_replaces_the_bitrate_with_a_crf():
+    settings = output_settings("archive")
+    assert settings["video_bitrate"] is None
+    assert rate_control_params(settings) == ["-crf", "18", "-tune", "film"]
+
+
+def test_default_profile_comes_from_the_environment(monkeypatch):
+    assert output_settings()["profile"] == "standard"
+    monkeypatch.setenv("ENCODING_PROFILE", "Archive")
+    assert default_profile() == "archive"
+    monkeypatch.setenv("ENCODING_PROFILE", "lossless")
+    with pytest.raises(ValueError):
+        default_profile()
+    with pytest.raises(ValueError):
+        output_settings("lossless")
+
+
+def test_compile_timeline_places_segments_and_fades():
+    timeline = compile_timeline('''{
+        "segments": [{"source": "wwe", "in": 0, "out": 4},
+                     {"source": "fan", "in": 4, "out": 7, "transition": {"type": "fade", "duration": 0.5}},
+                     {"source": "wwe", "in": 10, "out": 12, "transition": {"type": "cut"}}],
+        "audio": [{"source": "fan", "in": 1, "out": 3, "start": 2}, {"source": "wwe", "start": 0, "out": 2}]
+    }''')
+    assert timeline["duration"] == 9
+    assert [(s["at"], s["fade_in"], s["fade_out"]) for s in timeline["segments"]] == [
+        (0, 0, 0.5), (4, 0.5, 0), (7, 0, 0)
+    ]
+    assert [(r["source"], r["start"], r["duration"]) for r in timeline["audio"]] == [("wwe", 0, 2), ("fan", 2, 2)]
+
+
+def test_compile_timeline_defaults_to_the_fan_audio():
+    timeline = compile_timeline({"segments": [{"source": "wwe", "in": 0, "out": 3}]})
+    assert timeline["audio"] == [{"source": "fan", "in": 0, "out": None, "start": 0, "duration": 3}]
+
+
+def test_open_audio_ranges_stop_at_the_end_of_the_output():
+    timeline = compile_timeline({"segments": [{"source": "wwe", "in": 0, "out": 5}],
+                                 "audio": [{"source": "fan", "in": 2, "start": 1}]})
+    assert timeline["audio"][0]["duration"] == 4
+
+
+@pytest.mark.parametrize("spec, message", [
+    ("not json", "not valid JSON"),
+    ([], "must be a JSON object"),
+    ({"segments": []}, "at least one segment"),
+    ({"segments": [{"source": "crowd", "in": 0, "out": 1}]}, "segments[0].source"),
+    ({"segments": [{"source": "wwe", "in": "0", "out": 1}]}, "segments[0].in must be a number"),
+    ({"segments": [{"source": "wwe", "in": 0, "out": float("nan")}]}, "segments[0].out must be a number"),
+    ({"segments": [{"source": "wwe", "in": 2, "out": 2}]}, "0 <= in < out"),
+    ({"segments": [{"source": "wwe", "in": 0, "out": 1, "transition": {"type": "wipe"}}]}, "transition.type"),
+    ({"segments": [{"source": "wwe", "in": 0, "out": 1, "transition": {"duration": 0}}]}, "must be positive"),
+    ({"segments": [{"source": "wwe", "in": 0, "out": 1},
+                   {"source": "fan", "in": 0, "out": 1, "transition": {"duration": 1.2}}]}, "shorter than its fades"),
+    ({"segments": [{"source": "wwe", "in": 0, "out": 301}]}, "limit is 300s"),
+    ({"segments": [{"source": "wwe", "in": 0, "out": 2}], "audio": {}}, "audio must be a list"),
+    ({"segments": [{"source": "wwe", "in": 0, "out": 2}], "audio": [{"source": "fan", "start": 2}]},
+     "audio[0].start must fall within"),
+    ({"segments": [{"source": "wwe", "in": 0, "out": 4}],
+      "audio": [{"source": "fan", "start": 0, "out": 2}, {"source": "wwe", "start": 1}]}, "must not overlap"),
+])
+def test_compile_timeline_rejects_invalid_descriptions(spec, message):
+    with pytest.raises(TimelineError) as excinfo:
+        compile_timeline(spec)
+    assert message in str(excinfo.value)
+
+
+def test_timeline_limits_come_from_settings(monkeypatch):
+    monkeypatch.setattr(stitch_plan, "MAX_TIMELINE_SEGMENTS", 2)
+    with pytest.raises(TimelineError):
+        compile_timeline({"segments": [{"source": "wwe", "in": i, "out": i + 1} for i in range(3)]})
+
+
+def test_default_timeline_matches_the_segment_plan():
+    timeline = default_timeline()
+    assert timeline["duration"] == stitch_plan.FINAL_DURATION
+    assert [(s["in"], s["out"], s["source"]) for s in timeline["segments"]] == stitch_plan.SEGMENT_TIMINGS
+    assert (required_duration(timeline, "wwe"), required_duration(timeline, "fan")) == (30, 25)
+
+
+def test_keyframe_times_mark_cuts_and_fade_edges():
+    timeline = compile_timeline({"segments": [{"source": "wwe", "in": 0, "out": 4},
+                                              {"source": "fan", "in": 0, "out": 2, "transition": {"duration": 0.5}},
+                                              {"source": "wwe", "in": 6, "out": 9, "transition": {"duration": 0.5}}]})
+    assert keyframe_times("wwe", timeline=timeline) == [0, 3.5, 4, 6, 6.5, 9]
+    assert keyframe_times("wwe", fps=3, timeline=timeline) == pytest.approx([0, 11 / 3, 4, 6, 20 / 3, 9])
+
+
+def test_moviepy_is_an_alias_of_the_frames_engine(monkeypatch):
+    assert stitch_plan.default_engine() == "frames"
+    monkeypatch.setenv("STITCH_ENGINE", "MoviePy")
+    assert stitch_plan.default_engine() == "frames"
+    monkeypatch.setenv("STITCH_ENGINE", "moviepy2")
+    with pytest.raises(ValueError):
+        stitch_plan.default_engine()
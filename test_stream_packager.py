@@ -0,0 +1,43 @@
+import os
+
+import pytest
+
+from stream_packager import (DASH_MANIFEST, HLS_PLAYLIST, STREAM_INFO, SPRITE, THUMBNAILS, ladder_for, package_stream,
+                             parse_ladder, thumbnail_track)
+
+
+def test_parse_ladder_sorts_rungs_tallest_first():
+    assert parse_ladder("360:800k, 1080:5000k,bad,720:2800k") == [(1080, "5000k"), (720, "2800k"), (360, "800k")]
+
+
+def test_ladder_never_upscales():
+    spec = "1080:5000k,720:2800k,360:800k"
+    assert ladder_for(720, spec) == [(720, "2800k"), (360, "800k")]
+    assert ladder_for(240, spec) == [(360, "800k")]
+
+
+def test_thumbnail_track_indexes_sprite_tiles():
+    track = thumbnail_track(25, 160, 90)
+    cues = track.strip().split("\n\n")[1:]
+    assert len(cues) == 13
+    assert cues[0] == "00:00:00.000 --> 00:00:02.000\nsprite.jpg#xywh=0,0,160,90"
+    assert cues[10] == "00:00:20.000 --> 00:00:22.000\nsprite.jpg#xywh=0,90,160,90"
+    assert cues[-1].startswith("00:00:24.000 --> 00:00:25.000")
+
+
+def test_package_stream_writes_hls_and_dash(make_clip, tmp_path, monkeypatch):
+    import stream_packager
+    monkeypatch.setattr(stream_packager, "STREAM_LADDER", "180:300k,120:150k,720:2800k")
+    stream_dir = str(tmp_path / "stream")
+    progress = []
+    stream = package_stream(make_clip("320x180@25:5", "fan"), stream_dir, threads=2,
+                            on_progress=lambda stage, done, total: progress.append((stage, done, total)))
+
+    assert [rung["height"] for rung in stream["renditions"]] == [180, 120]
+    files = set(os.listdir(stream_dir))
+    assert {HLS_PLAYLIST, DASH_MANIFEST, STREAM_INFO, SPRITE, THUMBNAILS, "poster.jpg"} <= files
+    assert {"init-0.m4s", "init-1.m4s", "init-2.m4s"} <= files
+    with open(os.path.join(stream_dir, HLS_PLAYLIST)) as f:
+        assert f.read().count("#EXT-X-STREAM-INF") == 2
+    assert progress and progress[-1][0] == "package" and progress[-1][2] == 125
+    assert stream["duration"] == pytest.approx(5, abs=0.1)
@@ -0,0 +1,79 @@
+import os
+import socket
+import threading
+
+import pytest
+
+import task_manager
+from task_manager import TaskManager, TaskStatus
+from task_store import MemoryTaskStore
+
+
+@pytest.fixture
+def manager(tmp_path):
+    return TaskManager(str(tmp_path), store=MemoryTaskStore())
+
+
+@pytest.mark.parametrize("status", [TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.CANCELLED])
+def test_finished_tasks_leave_their_processing_stage(manager, status):
+    manager.create_task("a", "wwe.mp4", "fan.mp4")
+    manager.update_task("a", stage="mux", progress=95, eta=3.0)
+    task = manager.update_task_status("a", status, progress=100)
+    assert task["stage"] == "done"
+    assert task["eta"] is None
+
+
+def test_processing_keeps_the_reported_stage(manager):
+    manager.create_task("a", "wwe.mp4", "fan.mp4")
+    manager.update_task("a", stage="encode")
+    assert manager.update_task_status("a", TaskStatus.PROCESSING)["stage"] == "encode"
+
+
+def test_owners_are_alive_while_they_hold_their_lease(manager, monkeypatch):
+    other = TaskManager(manager.output_dir, store=manager.store)
+    assert manager.owner_alive(manager.owner)
+    assert not manager.owner_alive(other.owner)
+    assert not manager.owner_alive(None)
+
+    other.start_lease()
+    assert manager.owner_alive(other.owner)
+    # An owner on another host is judged by its lease alone
+    assert manager.owner_alive(dict(other.owner, host="elsewhere"))
+    monkeypatch.setattr(task_manager, "OWNER_TIMEOUT", 0)
+    assert not manager.owner_alive(other.owner)
+    monkeypatch.undo()
+
+    other.stop_lease()
+    assert not manager.owner_alive(other.owner)
+
+
+def test_the_lease_is_renewed_in_the_background(manager, monkeypatch):
+    monkeypatch.setattr(task_manager, "OWNER_HEARTBEAT_INTERVAL", 0.01)
+    renewals = threading.Semaphore(0)
+    manager.start_lease(on_renew=renewals.release)
+    try:
+        first = manager.store.owner_heartbeat(manager.owner["id"])
+        assert renewals.acquire(timeout=5) and renewals.acquire(timeout=5)
+        assert manager.store.owner_heartbeat(manager.owner["id"]) > first
+    finally:
+        manager.stop_lease()
+    assert manager.store.owner_heartbeat(manager.owner["id"]) is None
+
+
+def test_only_one_process_claims_an_orphaned_task(manager):
+    task = manager.create_task("a", "wwe.mp4", "fan.mp4")
+    gone = {"id": "gone", "host": socket.gethostname(), "pid": os.getpid()}
+    task = manager.store.update("a", {"owner": gone})
+    other = TaskManager(manager.output_dir, store=manager.store)
+    assert manager.claim_task(task)["owner"] == manager.owner
+    assert manager.owns(manager.get_task("a"))
+    assert other.claim_task(task) is None
+
+
+def test_unfinished_tasks_are_listed_oldest_first(manager):
+    for task_id in ("a", "b", "c", "d"):
+        manager.create_task(task_id, "wwe.mp4", "fan.mp4")
+        manager.store.update(task_id, {"created_at": {"a": 3, "b": 1, "c": 2, "d": 0}[task_id]})
+    manager.update_task_status("b", TaskStatus.PROCESSING)
+    manager.update_task_status("d", TaskStatus.COMPLETED)
+    assert [task["id"] for task in manager.get_unfinished_tasks()] == ["b", "c", "a"]
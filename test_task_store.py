@@ -0,0 +1,108 @@
+import pytest
+
+from task_store import MemoryTaskStore, SQLiteTaskStore, create_task_store
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemoryTaskStore()
+    return SQLiteTaskStore(str(tmp_path / "tasks.db"))
+
+
+def make_task(task_id, status="pending", created_at=0.0, downloads=0):
+    return {"id": task_id, "status": status, "created_at": created_at, "downloads": downloads,
+            "output_filename": f"{task_id}.mp4", "progress": 0}
+
+
+def test_insert_and_get_round_trip(store):
+    store.insert(make_task("a"))
+    assert store.get("a") == make_task("a")
+    assert store.get("missing") is None
+
+
+def test_update_merges_fields(store):
+    store.insert(make_task("a"))
+    updated = store.update("a", {"status": "processing", "progress": 40})
+    assert updated["status"] == "processing" and updated["progress"] == 40
+    assert store.get("a") == updated
+    assert store.update("missing", {"status": "failed"}) is None
+
+
+def test_update_with_expected_claims_once(store):
+    store.insert(make_task("a"))
+    assert store.update("a", {"status": "processing", "owner": "w1"}, expected={"status": "pending"})
+    assert store.update("a", {"status": "processing", "owner": "w2"}, expected={"status": "pending"}) is None
+    assert store.get("a")["owner"] == "w1"
+
+
+def test_query_filters_orders_and_pages(store):
+    for i, (status, downloads) in enumerate([("completed", 5), ("pending", 0), ("completed", 9), ("completed", 1)]):
+        store.insert(make_task(f"t{i}", status=status, created_at=float(i), downloads=downloads))
+    assert [t["id"] for t in store.query()] == ["t3", "t2", "t1", "t0"]
+    assert [t["id"] for t in store.query(status="completed", descending=False)] == ["t0", "t2", "t3"]
+    assert [t["id"] for t in store.query(created_before=2.0)] == ["t1", "t0"]
+    assert [t["id"] for t in store.query(status="completed", order_by="downloads")] == ["t2", "t0", "t3"]
+    assert [t["id"] for t in store.query(limit=2, offset=1)] == ["t2", "t1"]
+
+
+def test_delete_releases_idempotency_keys(store):
+    store.insert(make_task("a"))
+    assert store.bind_idempotency_key("key", "a") == "a"
+    store.delete("a")
+    assert store.get("a") is None
+    assert store.get_idempotency_key("key") is None
+
+
+def test_first_idempotency_binding_wins(store):
+    assert store.bind_idempotency_key("key", "a") == "a"
+    assert store.bind_idempotency_key("key", "b") == "a"
+    store.release_idempotency_key("key", "b")
+    assert store.get_idempotency_key("key") == "a"
+    store.release_idempotency_key("key", "a")
+    assert store.bind_idempotency_key("key", "b") == "b"
+
+
+def test_increment_downloads_records_history(store):
+    store.insert(make_task("a"))
+    store.insert(make_task("b"))
+    assert store.increment_downloads("a", 1.0)["downloads"] == 1
+    assert store.increment_downloads("b", 2.0)["downloads"] == 1
+    assert store.increment_downloads("a", 3.0)["downloads"] == 2
+    assert store.increment_downloads("missing", 4.0) is None
+    recent = store.recent_downloads(2)
+    assert [(d["task_id"], d["timestamp"], d["filename"]) for d in recent] == [("a", 3.0, "a.mp4"), ("b", 2.0, "b.mp4")]
+
+
+def test_owner_leases_are_renewed_and_given_up(store):
+    assert store.owner_heartbeat("api-1") is None
+    store.heartbeat_owner("api-1", 1.0)
+    store.heartbeat_owner("api-1", 2.0)
+    store.heartbeat_owner("api-2", 3.0)
+    assert store.owner_heartbeat("api-1") == 2.0
+    store.remove_owner("api-1")
+    assert store.owner_heartbeat("api-1") is None
+    assert store.owner_heartbeat("api-2") == 3.0
+
+
+def test_sqlite_store_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / "tasks.db")
+    SQLiteTaskStore(path).insert(make_task("a"))
+    other = SQLiteTaskStore(path)
+    assert other.update("a", {"status": "processing"}, expected={"status": "pending"})
+    assert SQLiteTaskStore(path).get("a")["status"] == "processing"
+
+
+@pytest.mark.parametrize("shared_across_hosts, journal_mode", [(False, "wal"), (True, "delete")])
+def test_only_stores_on_one_host_use_wal(tmp_path, shared_across_hosts, journal_mode):
+    store = SQLiteTaskStore(str(tmp_path / "tasks.db"), shared_across_hosts=shared_across_hosts)
+    assert store._connect().execute("PRAGMA journal_mode").fetchone()[0] == journal_mode
+
+
+def test_task_stores_are_shared_across_hosts_with_a_broker(tmp_path, monkeypatch):
+    monkeypatch.setenv("TASK_STORE", "sqlite")
+    monkeypatch.delenv("TASK_DB_PATH", raising=False)
+    monkeypatch.delenv("BROKER_URL", raising=False)
+    assert not create_task_store(str(tmp_path / "local")).shared_across_hosts
+    monkeypatch.setenv("BROKER_URL", f"sqlite:///{tmp_path}/broker.db")
+    assert create_task_store(str(tmp_path / "shared")).shared_across_hosts
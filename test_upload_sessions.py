@@ -0,0 +1,113 @@
+import asyncio
+import hashlib
+import os
+import time
+
+import pytest
+
+import upload_sessions
+from upload_sessions import UploadSessionError, UploadSessionStore, UploadStatus, merge_ranges
+
+DATA = os.urandom(10_000)
+SHA256 = hashlib.sha256(DATA).hexdigest()
+
+
+@pytest.fixture
+def store(tmp_path):
+    return UploadSessionStore(str(tmp_path), chunk_size=999)
+
+
+def write(store, upload_id, offset, *chunks):
+    async def body():
+        for chunk in chunks:
+            yield chunk
+    return asyncio.run(store.write_chunk(upload_id, offset, body()))
+
+
+@pytest.mark.parametrize("ranges, merged", [
+    ([], []),
+    ([[0, 10], [10, 20]], [[0, 20]]),
+    ([[30, 40], [0, 10], [5, 15]], [[0, 15], [30, 40]]),
+    ([[0, 100], [20, 30]], [[0, 100]]),
+])
+def test_merge_ranges(ranges, merged):
+    assert merge_ranges(ranges) == merged
+
+
+def test_chunks_in_any_order_complete_the_upload(store):
+    session = store.create("clip.mp4", len(DATA))
+    write(store, session["id"], 6000, DATA[6000:])
+    assert UploadSessionStore.describe(store.get(session["id"]))["next_offset"] == 0
+    write(store, session["id"], 0, DATA[:2000], DATA[2000:3000])
+    described = UploadSessionStore.describe(store.get(session["id"]))
+    assert described["received"] == [[0, 3000], [6000, 10_000]]
+    assert described["next_offset"] == 3000
+    # Resent bytes overlap what already arrived
+    write(store, session["id"], 2500, DATA[2500:6500])
+    assert store.finalize(session["id"], SHA256.upper())["status"] == UploadStatus.COMPLETE
+    with open(store.part_path(session["id"]), "rb") as f:
+        assert f.read() == DATA
+
+
+def test_finalize_needs_every_byte(store):
+    session = store.create("clip.mp4", len(DATA))
+    write(store, session["id"], 0, DATA[:5000])
+    with pytest.raises(UploadSessionError):
+        store.finalize(session["id"], SHA256)
+
+
+def test_a_checksum_mismatch_discards_the_received_ranges(store):
+    session = store.create("clip.mp4", len(DATA))
+    write(store, session["id"], 0, DATA[:-1] + b"?")
+    with pytest.raises(UploadSessionError):
+        store.finalize(session["id"], SHA256)
+    assert store.get(session["id"])["received"] == []
+
+
+def test_finalize_is_idempotent_for_the_same_checksum(store):
+    session = store.create("clip.mp4", len(DATA))
+    write(store, session["id"], 0, DATA)
+    store.finalize(session["id"], SHA256)
+    assert store.finalize(session["id"], SHA256)["sha256"] == SHA256
+    with pytest.raises(UploadSessionError):
+        store.finalize(session["id"], hashlib.sha256(b"other").hexdigest())
+    with pytest.raises(UploadSessionError):
+        write(store, session["id"], 0, DATA[:10])
+
+
+def test_chunks_must_fit_the_upload(store):
+    session = store.create("clip.mp4", 100)
+    with pytest.raises(UploadSessionError):
+        write(store, session["id"], 101, b"x")
+    with pytest.raises(UploadSessionError):
+        write(store, session["id"], 60, b"x" * 30, b"x" * 30)
+    # The chunk that did fit is kept, so the client can resume after it
+    assert store.get(session["id"])["received"] == [[60, 90]]
+    with pytest.raises(KeyError):
+        write(store, "missing", 0, b"x")
+
+
+def test_link_to_needs_a_finalized_upload(store, tmp_path):
+    session = store.create("clip.mp4", len(DATA))
+    dest = str(tmp_path / "wwe.mp4")
+    with pytest.raises(UploadSessionError):
+        store.link_to(session["id"], dest)
+    write(store, session["id"], 0, DATA)
+    store.finalize(session["id"], SHA256)
+    assert store.link_to(session["id"], dest) == {"path": dest, "size": len(DATA), "sha256": SHA256}
+    with open(dest, "rb") as f:
+        assert f.read() == DATA
+
+
+def test_expired_sessions_are_cleaned_up(store, monkeypatch):
+    old = store.create("old.mp4", 10)
+    new = store.create("new.mp4", 10)
+    monkeypatch.setattr(upload_sessions, "UPLOAD_SESSION_TTL", 60)
+    record = store.get(old["id"])
+    record["updated_at"] = time.time() - 120
+    store._save(record)
+    assert store.part_path(old["id"]) not in store.active_files()
+    store.cleanup_expired()
+    assert store.get(old["id"]) is None and not os.path.exists(store.part_path(old["id"]))
+    assert store.get(new["id"])
+    assert store.get("../new") is None
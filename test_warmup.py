@@ -0,0 +1,33 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+import warmup
+from warmup import REQUIRED_ENCODERS, probe_encoders, warm_pool, warm_process
+
+
+def test_bundled_ffmpeg_has_the_required_encoders(ffmpeg):
+    version, missing = probe_encoders()
+    assert version != "unknown"
+    assert missing == []
+
+
+def test_warm_process_records_problems_instead_of_raising(monkeypatch):
+    monkeypatch.setattr(warmup, "WARMUP_MODULES", ("no_such_module",))
+    monkeypatch.setattr(warmup, "probe_encoders", lambda: ("7.0", list(REQUIRED_ENCODERS[:1])))
+    warm_process()
+    assert warmup._report["ffmpeg"] == "7.0"
+    assert warmup._report["errors"][0].startswith("Could not import no_such_module")
+    assert warmup._report["errors"][1] == f"ffmpeg has no {REQUIRED_ENCODERS[0]} encoder"
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_warm_pool_starts_every_process(ffmpeg, workers):
+    context = multiprocessing.get_context("spawn")
+    with context.Manager() as manager, ProcessPoolExecutor(workers, mp_context=context,
+                                                           initializer=warm_process) as pool:
+        report = warm_pool(pool, workers, manager)
+    assert report["warm_workers"] == workers
+    assert report["errors"] == []
+    assert report["ffmpeg"]
@@ -0,0 +1,219 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from typing import AsyncIterator, Dict, List, Optional
+
+import aiofiles
+
+from result_cache import link_or_copy
+
+logger = logging.getLogger(__name__)
+
+# Seconds an unfinished or unused upload session is kept
+UPLOAD_SESSION_TTL = float(os.getenv('UPLOAD_SESSION_TTL', str(24 * 3600)))
+
+
+class UploadStatus:
+    UPLOADING = "uploading"
+    COMPLETE = "complete"
+
+
+class UploadSessionError(ValueError):
+    """Raised when a chunk or a finalize request does not fit the session"""
+
+
+def merge_ranges(ranges: List[List[int]]) -> List[List[int]]:
+    """Merge overlapping and adjacent [start, end) byte ranges"""
+    merged: List[List[int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+class UploadSessionStore:
+    """
+    Resumable uploads written chunk by chunk into TEMP_DIR.
+
+    A session is created with the final size of the file. Chunks can be
+    sent in any order and resent after a dropped connection. Each chunk is
+    written at its offset into a preallocated part file, and the byte
+    ranges received so far are recorded. Finalizing checks that every byte
+    arrived and that the SHA-256 matches. The blob can then be used by a
+    stitch request, and the session is removed once a task takes it. Each
+    session is a JSON record next to its part file.
+    """
+
+    def __init__(self, temp_dir: str, chunk_size: int = 1024 * 1024):
+        self.temp_dir = temp_dir
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+        os.makedirs(temp_dir, exist_ok=True)
+
+    def _record_path(self, upload_id: str) -> str:
+        return os.path.join(self.temp_dir, f"upload_{upload_id}.json")
+
+    def part_path(self, upload_id: str) -> str:
+        return os.path.join(self.temp_dir, f"upload_{upload_id}.part")
+
+    def _save(self, session: Dict) -> None:
+        tmp_path = f"{self._record_path(session['id'])}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(session, f)
+        os.replace(tmp_path, self._record_path(session["id"]))
+
+    @staticmethod
+    def describe(session: Dict) -> Dict:
+        """The session with the offset a client should resume from"""
+        received = session["received"]
+        next_offset = received[0][1] if received and received[0][0] == 0 else 0
+        return dict(session, next_offset=next_offset)
+
+    def create(self, filename: str, size: int) -> Dict:
+        """Start a session for a file of size bytes"""
+        session = {
+            "id": str(uuid.uuid4()),
+            "filename": filename,
+            "size": size,
+            "received": [],
+            "status": UploadStatus.UPLOADING,
+            "sha256": None,
+            "created_at": time.time(),
+            "updated_at": time.time(),
+        }
+        # Reserve the whole file up front so chunks can land anywhere in it
+        with open(self.part_path(session["id"]), "wb") as f:
+            f.truncate(size)
+        with self._lock:
+            self._save(session)
+        logger.info(f"Created upload session {session['id']} for {filename} ({size} bytes)")
+        return session
+
+    def get(self, upload_id: str) -> Optional[Dict]:
+        """Get a session by ID"""
+        # IDs are UUIDs; anything else cannot name a record
+        if not upload_id.replace("-", "").isalnum():
+            return None
+        try:
+            with open(self._record_path(upload_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def get_all(self) -> List[Dict]:
+        sessions = []
+        for name in os.listdir(self.temp_dir):
+            if name.startswith("upload_") and name.endswith(".json"):
+                session = self.get(name[len("upload_"):-len(".json")])
+                if session:
+                    sessions.append(session)
+        return sessions
+
+    async def write_chunk(self, upload_id: str, offset: int, chunks: AsyncIterator[bytes]) -> Dict:
+        """
+        Write a request body into the part file at offset.
+
+        The body is streamed straight to disk. Bytes that did arrive are
+        recorded even if the connection drops, so the client can resume
+        right after them.
+        """
+        session = self.get(upload_id)
+        if not session:
+            raise KeyError(upload_id)
+        if session["status"] != UploadStatus.UPLOADING:
+            raise UploadSessionError("Upload is already finalized")
+        if not 0 <= offset <= session["size"]:
+            raise UploadSessionError(f"Offset {offset} is outside the {session['size']} byte upload")
+
+        position = offset
+        try:
+            async with aiofiles.open(self.part_path(upload_id), "r+b") as f:
+                await f.seek(offset)
+                async for chunk in chunks:
+                    if position + len(chunk) > session["size"]:
+                        raise UploadSessionError(f"Chunk runs past the end of the {session['size']} byte upload")
+                    await f.write(chunk)
+                    position += len(chunk)
+        finally:
+            if position > offset:
+                session = self._add_range(upload_id, offset, position)
+        return session
+
+    def _add_range(self, upload_id: str, start: int, end: int) -> Dict:
+        with self._lock:
+            session = self.get(upload_id)
+            session["received"] = merge_ranges(session["received"] + [[start, end]])
+            session["updated_at"] = time.time()
+            self._save(session)
+            return session
+
+    def finalize(self, upload_id: str, sha256: str) -> Dict:
+        """Check that every byte arrived and matches sha256, then mark the upload complete"""
+        session = self.get(upload_id)
+        if not session:
+            raise KeyError(upload_id)
+        if session["status"] == UploadStatus.COMPLETE:
+            if session["sha256"] != sha256.lower():
+                raise UploadSessionError("Upload was finalized with a different checksum")
+            return session
+        if session["received"] != [[0, session["size"]]]:
+            raise UploadSessionError("Upload is missing bytes; resume from next_offset")
+
+        digest = hashlib.sha256()
+        with open(self.part_path(upload_id), "rb") as f:
+            while True:
+                chunk = f.read(self.chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+        if digest.hexdigest() != sha256.lower():
+            # Every range has to be sent again
+            with self._lock:
+                session["received"] = []
+                self._save(session)
+            raise UploadSessionError("Checksum does not match the uploaded bytes")
+
+        with self._lock:
+            session.update(status=UploadStatus.COMPLETE, sha256=digest.hexdigest(), updated_at=time.time())
+            self._save(session)
+        logger.info(f"Finalized upload session {upload_id}")
+        return session
+
+    def link_to(self, upload_id: str, dest_path: str) -> Dict:
+        """Materialise a finalized upload at dest_path; returns its size and SHA-256 like save_upload"""
+        session = self.get(upload_id)
+        if not session or session["status"] != UploadStatus.COMPLETE:
+            raise UploadSessionError("Upload is not finalized")
+        link_or_copy(self.part_path(upload_id), dest_path)
+        return {"path": dest_path, "size": session["size"], "sha256": session["sha256"]}
+
+    def delete(self, upload_id: str) -> None:
+        """Remove a session and its part file"""
+        for path in (self.part_path(upload_id), self._record_path(upload_id)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def active_files(self) -> List[str]:
+        """Part files and records of sessions that have not expired"""
+        cutoff = time.time() - UPLOAD_SESSION_TTL
+        return [
+            path
+            for session in self.get_all() if session["updated_at"] >= cutoff
+            for path in (self.part_path(session["id"]), self._record_path(session["id"]))
+        ]
+
+    def cleanup_expired(self) -> None:
+        """Remove sessions untouched for UPLOAD_SESSION_TTL seconds"""
+        cutoff = time.time() - UPLOAD_SESSION_TTL
+        for session in self.get_all():
+            if session["updated_at"] < cutoff:
+                self.delete(session["id"])
+                logger.info(f"Removed expired upload session {session['id']}")
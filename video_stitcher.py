@@ -1,82 +1,106 @@
 import cv2
 import numpy as np
-from moviepy.editor import VideoFileClip, AudioFileClip, concatenate_videoclips, CompositeVideoClip
 import os
 import logging
-import tempfile
 import shutil
-from pathlib import Path
+import sys
+import subprocess
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterator, Tuple
+from audio_track import render_audio
+from stitch_plan import FFMPEG_OUTPUT_PARAMS, default_timeline, output_settings, rate_control_params
+from ffmpeg_utils import get_ffmpeg_binary, probe_media, run_ffmpeg
+from file_manager import make_scratch_dir
+from frame_pipeline import FramePipeline
+from metrics import StageTimer
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class VideoStitcher:
-    def __init__(self, wwe_video_path, fan_video_path):
+    """
+    Stitcher that renders the timeline frame by frame in Python.
+
+    Frames flow through a pipeline of threads connected by bounded queues.
+    One thread decodes the source frames each segment needs with OpenCV.
+    One scales them to the target size and applies the fades. One pipes
+    them to an ffmpeg encoder. Frames live in preallocated buffers that
+    are reused. The audio track is copied or encoded by ffmpeg while the
+    video encodes, and the two are muxed at the end.
+    """
+
+    def __init__(self, wwe_video_path, fan_video_path, profile=None, timeline=None, checksums=None):
         """
-        Initialize the VideoStitcher with paths to input videos
+        Initialize the VideoStitcher with paths to input videos, an encoding
+        profile, a compiled timeline (the default plan if omitted) and the
+        known SHA-256 of each input by source name
         """
+        # Per-stage wall time, reported back with the job
+        self.timer = StageTimer()
+        self.timer.start("probe")
+        self.captures: Dict[str, cv2.VideoCapture] = {}
         try:
             # Create a temporary directory for processing
-            self.temp_dir = tempfile.mkdtemp()
+            self.temp_dir = make_scratch_dir()
             logger.info(f"Created temporary directory: {self.temp_dir}")
             
             # Get environment variables with defaults
-            self.target_size = (
-                int(os.getenv('TARGET_WIDTH', '1280')),
-                int(os.getenv('TARGET_HEIGHT', '720'))
-            )
-            self.target_fps = int(os.getenv('TARGET_FPS', '30'))
-            self.video_bitrate = os.getenv('VIDEO_BITRATE', '2000k')
-            self.audio_bitrate = os.getenv('AUDIO_BITRATE', '128k')
-            
-            logger.info(f"Loading WWE video from: {wwe_video_path}")
-            self.wwe_video = VideoFileClip(wwe_video_path)
-            
-            logger.info(f"Loading fan video from: {fan_video_path}")
-            self.fan_video = VideoFileClip(fan_video_path)
+            settings = output_settings(profile)
+            self.profile = settings["profile"]
+            self.target_size = settings["target_size"]
+            self.target_fps = settings["target_fps"]
+            self.video_bitrate = settings["video_bitrate"]
+            self.audio_bitrate = settings["audio_bitrate"]
+            self.encoder_threads = settings["encoder_threads"]
+            self.encoder_preset = settings["encoder_preset"]
+            self.rate_control = rate_control_params(settings)
             
-            # Extract audio from fan video
-            logger.info("Extracting audio from fan video")
-            self.commentary = self.fan_video.audio
+            # Open each source for decoding and read its first frame, which
+            # also gives the decoded frame shape after any rotation
+            self.sources = {"wwe": wwe_video_path, "fan": fan_video_path}
+            self.source_info = {}
+            for name, path in self.sources.items():
+                logger.info(f"Loading {name} video from: {path}")
+                info = probe_media(path)
+                capture = cv2.VideoCapture(path)
+                self.captures[name] = capture
+                ok, frame = capture.read()
+                if not ok:
+                    raise ValueError(f"Could not decode the {name} video")
+                info["fps"] = capture.get(cv2.CAP_PROP_FPS) or self.target_fps
+                info["shape"] = frame.shape
+                info["sha256"] = (checksums or {}).get(name)
+                self.source_info[name] = info
             
-            # Get frame rates
-            self.wwe_fps = self.wwe_video.fps
-            self.fan_fps = self.fan_video.fps
-            
-            # Ensure all videos are the same size and frame rate
-            logger.info("Resizing videos to target size")
-            self.wwe_video = self.wwe_video.resize(self.target_size).set_fps(self.target_fps)
-            self.fan_video = self.fan_video.resize(self.target_size).set_fps(self.target_fps)
+            # Segments, fades and audio ranges to render
+            self.timeline = timeline or default_timeline()
             
             # Set the duration of the final video
-            self.final_duration = 30
-            
-            # Set transition duration
-            self.transition_duration = 0.5  # seconds
+            self.final_duration = self.timeline["duration"]
             
             # Print video information for debugging
-            logger.info(f"WWE Video FPS: {self.wwe_fps}")
-            logger.info(f"Fan Video FPS: {self.fan_fps}")
+            logger.info(f"WWE Video FPS: {self.source_info['wwe']['fps']}")
+            logger.info(f"Fan Video FPS: {self.source_info['fan']['fps']}")
             logger.info(f"Target FPS: {self.target_fps}")
-            logger.info(f"WWE Video Duration: {self.wwe_video.duration:.2f} seconds")
-            logger.info(f"Fan Video Duration: {self.fan_video.duration:.2f} seconds")
+            logger.info(f"WWE Video Duration: {self.source_info['wwe']['duration']:.2f} seconds")
+            logger.info(f"Fan Video Duration: {self.source_info['fan']['duration']:.2f} seconds")
             
         except Exception as e:
             logger.error(f"Error initializing VideoStitcher: {str(e)}")
             self.cleanup()
             raise
+        finally:
+            self.timer.stop()
 
     def cleanup(self):
         """Clean up temporary files and resources"""
         try:
-            # Close video clips if they exist
-            if hasattr(self, 'wwe_video'):
-                self.wwe_video.close()
-            if hasattr(self, 'fan_video'):
-                self.fan_video.close()
-            if hasattr(self, 'commentary'):
-                self.commentary.close()
+            # Release decoders if they exist
+            for capture in getattr(self, 'captures', {}).values():
+                capture.release()
             
             # Remove temporary directory if it exists
             if hasattr(self, 'temp_dir') and os.path.exists(self.temp_dir):
@@ -85,118 +109,186 @@ class VideoStitcher:
         except Exception as e:
             logger.error(f"Error during cleanup: {str(e)}")
 
-    def create_video_segments(self):
+    def frame_plan(self) -> Iterator[Tuple[str, int, float]]:
         """
-        Create video segments according to the specified timing with fade transitions
+        Source, source frame index and fade level of every output frame.
+
+        Segments are cut short where their source ends. The fade level
+        falls linearly to 0 (black) across each fade.
         """
-        try:
-            segments = []
-            
-            # Calculate the duration of each segment
-            wwe_duration = self.wwe_video.duration
-            fan_duration = self.fan_video.duration
-            
-            # Define segment timings
-            segment_timings = [
-                (0, 4, "wwe"),    # 0s - 4s: Intro (WWE video)
-                (4, 7, "fan"),    # 4s - 7s: Fan video
-                (7, 10, "wwe"),   # 7s - 10s: WWE video
-                (10, 13, "fan"),  # 10s - 13s: Fan video
-                (13, 22, "wwe"),  # 13s - 22s: WWE video
-                (22, 25, "fan"),  # 22s - 25s: Fan video
-                (25, 30, "wwe")   # 25s - 30s: Final WWE video
-            ]
-            
-            # Create segments based on timing
-            for i, (start_time, end_time, video_type) in enumerate(segment_timings):
-                logger.info(f"Creating segment {i+1}: {video_type} video from {start_time}s to {end_time}s")
-                if video_type == "wwe":
-                    segment = self.wwe_video.subclip(start_time, min(end_time, wwe_duration))
-                else:  # fan video
-                    segment = self.fan_video.subclip(start_time, min(end_time, fan_duration))
-                
-                # Ensure consistent frame rate
-                segment = segment.set_fps(self.target_fps)
-                
-                # Add fade in to all segments except the first one
-                if i > 0:
-                    segment = segment.fadein(self.transition_duration)
-                
-                # Add fade out to all segments except the last one
-                if i < len(segment_timings) - 1:
-                    segment = segment.fadeout(self.transition_duration)
-                
-                segments.append(segment)
-            
-            # Print segment durations for debugging
-            logger.info("\nSegment durations:")
-            for i, segment in enumerate(segments):
-                logger.info(f"Segment {i}: {segment.duration:.2f} seconds (FPS: {segment.fps})")
-            
-            return segments
-            
-        except Exception as e:
-            logger.error(f"Error creating video segments: {str(e)}")
-            raise
+        for i, segment in enumerate(self.timeline["segments"]):
+            info = self.source_info[segment["source"]]
+            duration = min(segment["out"], info["duration"]) - segment["in"]
+            logger.info(f"Creating segment {i+1}: {segment['source']} video from {segment['in']}s to {segment['in'] + duration:.2f}s")
+            for k in range(round(duration * self.target_fps)):
+                t = k / self.target_fps
+                fade = 1.0
+                if segment["fade_in"]:
+                    fade = min(fade, t / segment["fade_in"])
+                if segment["fade_out"]:
+                    fade = min(fade, (duration - t) / segment["fade_out"])
+                # Same frame choice as MoviePy: the source frame showing at time t
+                yield segment["source"], int((segment["in"] + t) * info["fps"] + 0.00001), max(0.0, fade)
 
-    def stitch_videos(self, output_path):
+    def decode_frames(self, plan, pools) -> Iterator:
         """
-        Stitch all video segments together with commentary audio
+        Pipeline source: copy each planned source frame into a pooled buffer.
+
+        Frames are decoded in place into one buffer per source. Frames the
+        plan skips are only grabbed. The decoder seeks when the plan jumps
+        back, or more than two seconds ahead.
         """
+        frames = {name: None for name in self.captures}
+        positions = {name: 0 for name in self.captures}
+        for name, index, fade in plan:
+            capture = self.captures[name]
+            frame, position = frames[name], positions[name]
+            if frame is None or index < position or index > position + 2 * self.source_info[name]["fps"]:
+                capture.set(cv2.CAP_PROP_POS_FRAMES, index)
+                position = index - 1
+            while position < index:
+                position += 1
+                if position < index:
+                    ok = capture.grab()
+                else:
+                    ok, decoded = capture.read(frame)
+                    if ok:
+                        frame = decoded
+                if not ok:
+                    # Past the last frame: hold the one before it
+                    position = index
+                    break
+            frames[name], positions[name] = frame, position
+            if frame is None:
+                raise RuntimeError(f"Could not decode frame {index} of the {name} video")
+            buffer = pools[name].acquire()
+            np.copyto(buffer, frame)
+            yield buffer, pools[name], fade
+
+    def scale_frame(self, item):
+        """Pipeline stage: resize to the target size into a pooled buffer and apply the fade in place"""
+        frame, pool, fade = item
+        width, height = self.target_size
+        if frame.shape[:2] != (height, width):
+            scaled = self.output_pool.acquire()
+            interpolation = cv2.INTER_AREA if frame.shape[1] > width else cv2.INTER_LINEAR
+            cv2.resize(frame, self.target_size, dst=scaled, interpolation=interpolation)
+            pool.release(frame)
+            frame, pool = scaled, self.output_pool
+        if fade <= 0:
+            frame.fill(0)
+        elif fade < 1:
+            cv2.convertScaleAbs(frame, dst=frame, alpha=fade)
+        return frame, pool
+
+    def encode_frame(self, item):
+        """Pipeline stage: pipe the frame to the encoder and return its buffer"""
+        frame, pool = item
+        self.encoder.stdin.write(frame.data)
+        pool.release(frame)
+        self.frames_encoded += 1
+
+    def start_encoder(self, video_path: str) -> subprocess.Popen:
+        """Start an ffmpeg that encodes raw BGR frames from stdin to video_path"""
+        width, height = self.target_size
+        command = [
+            get_ffmpeg_binary(), '-hide_banner',
+            '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f"{width}x{height}", '-r', str(self.target_fps),
+            '-i', 'pipe:0',
+            '-an',
+            '-c:v', 'libx264',
+            '-preset', self.encoder_preset,
+            *self.rate_control,
+            '-threads', str(self.encoder_threads),
+            *FFMPEG_OUTPUT_PARAMS,
+            video_path
+        ]
+        encoder = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+        # Drain stderr in the background so a chatty ffmpeg never blocks on a full pipe
+        self.encoder_log = deque(maxlen=20)
+
+        def _drain():
+            for line in encoder.stderr:
+                self.encoder_log.append(line.decode('utf-8', errors='replace').rstrip())
+
+        threading.Thread(target=_drain, daemon=True).start()
+        return encoder
+
+    def stitch_videos(self, output_path, should_cancel=None, on_progress=None):
+        """
+        Stitch all video segments together with commentary audio.
+
+        should_cancel is an optional callable polled while encoding; when it
+        returns True the write is aborted with JobCancelledError.
+        on_progress(stage, done, total) receives frame progress.
+        """
+        audio_thread = None
+        self.encoder = None
         try:
             # Ensure output directory exists
             os.makedirs(os.path.dirname(output_path), exist_ok=True)
             
-            # Create video segments
+            # Plan every output frame
+            self.timer.start("segments")
             logger.info("Creating video segments")
-            segments = self.create_video_segments()
-            
-            # Concatenate all video segments
-            logger.info("Concatenating video segments")
-            final_video = concatenate_videoclips(segments)
+            plan = list(self.frame_plan())
+            logger.info(f"Final video: {len(plan)} frames at {self.target_fps} fps, size {self.target_size}")
             
-            # Ensure final video has correct frame rate
-            final_video = final_video.set_fps(self.target_fps)
+            # Copy or encode the audio track while the video encodes
+            audio_path = os.path.join(self.temp_dir, 'temp-audio.m4a')
+            audio_result = {}
+            def _write_audio():
+                started = time.perf_counter()
+                try:
+                    audio_result["written"] = render_audio(
+                        self.timeline, self.sources, self.source_info, len(plan) / self.target_fps,
+                        audio_path, self.audio_bitrate, should_cancel=should_cancel
+                    )
+                except Exception as e:
+                    audio_result["error"] = e
+                self.timer.timings["audio"] = round(time.perf_counter() - started, 3)
+            audio_thread = threading.Thread(target=_write_audio, name="audio", daemon=True)
+            audio_thread.start()
             
-            # Set the commentary audio for the entire duration
-            logger.info("Setting commentary audio")
-            final_video = final_video.set_audio(self.commentary)
-            
-            # Print final video information for debugging
-            logger.info(f"\nFinal video information:")
-            logger.info(f"Duration: {final_video.duration:.2f} seconds")
-            logger.info(f"FPS: {final_video.fps}")
-            logger.info(f"Size: {final_video.size}")
+            # Decode, scale and encode on separate threads
+            self.timer.start("encode")
+            video_path = os.path.join(self.temp_dir, "temp-video.mp4")
+            logger.info(f"Writing video to: {video_path}")
+            pipeline = FramePipeline()
+            pools = {name: pipeline.make_pool(info["shape"]) for name, info in self.source_info.items()}
+            width, height = self.target_size
+            self.output_pool = pipeline.make_pool((height, width, 3), stages=2)
+            self.frames_encoded = 0
+            self.encoder = self.start_encoder(video_path)
+            pipeline.run(
+                ("decode", self.decode_frames(plan, pools)),
+                [("scale", self.scale_frame), ("encode", self.encode_frame)],
+                should_cancel=should_cancel,
+                on_poll=(lambda: on_progress("encode", self.frames_encoded, len(plan))) if on_progress else None
+            )
+            self.encoder.stdin.close()
+            self.encoder.wait()
+            if self.encoder.returncode != 0:
+                raise RuntimeError(f"ffmpeg exited with code {self.encoder.returncode}: {' | '.join(self.encoder_log)}")
+            logger.info("Pipeline busy time: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in pipeline.busy.items()))
             
-            # Create temporary file path for processing
+            # Mux the video with the audio track
+            self.timer.start("mux")
+            if on_progress:
+                on_progress("mux")
             temp_output = os.path.join(self.temp_dir, "temp_output.mp4")
-            
-            # Write the final video with optimized parameters for Railway
-            logger.info(f"Writing final video to: {temp_output}")
-            final_video.write_videofile(
-                temp_output,
-                codec='libx264',
-                audio_codec='aac',
-                temp_audiofile=os.path.join(self.temp_dir, 'temp-audio.m4a'),
-                remove_temp=True,
-                fps=self.target_fps,
-                threads=4,  # Use multiple threads for better performance
-                preset='medium',  # Better quality preset
-                bitrate=self.video_bitrate,
-                audio_bitrate=self.audio_bitrate,
-                logger=None,  # Disable FFMPEG logging
-                ffmpeg_params=[
-                    '-max_muxing_queue_size', '1024',
-                    '-movflags', '+faststart',  # Enable fast start for web playback
-                    '-profile:v', 'high',       # Use high profile for better quality
-                    '-level', '4.0',           # Set H.264 level for compatibility
-                    '-pix_fmt', 'yuv420p',     # Ensure pixel format compatibility
-                    '-colorspace', 'bt709',    # Set standard colorspace
-                    '-color_primaries', 'bt709',
-                    '-color_trc', 'bt709',
-                    '-y'                       # Overwrite output file if exists
-                ]
-            )
+            audio_thread.join()
+            if "error" in audio_result:
+                raise audio_result["error"]
+            if audio_result["written"]:
+                run_ffmpeg([
+                    '-i', video_path, '-i', audio_path,
+                    '-map', '0:v:0', '-map', '1:a:0', '-c', 'copy',
+                    '-movflags', '+faststart', '-y', temp_output
+                ], should_cancel=should_cancel)
+            else:
+                os.replace(video_path, temp_output)
             
             # Move the temporary file to the final location
             shutil.move(temp_output, output_path)
@@ -208,7 +300,14 @@ class VideoStitcher:
             logger.error(f"Error stitching videos: {str(e)}")
             raise
         finally:
+            # Stop the encoder if the pipeline did not finish
+            if self.encoder and self.encoder.poll() is None:
+                self.encoder.kill()
+                self.encoder.wait()
+            if audio_thread:
+                audio_thread.join()
             # Clean up resources
+            self.timer.stop()
             self.cleanup()
 
 def main():
@@ -221,4 +320,8 @@ def main():
     stitcher.stitch_videos(output_path)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    # python -m video_stitcher worker runs an encoder worker for distributed mode
+    if sys.argv[1:2] == ["worker"]:
+        from worker import main as worker_main
+        sys.exit(worker_main(sys.argv[2:]))
+    main()
@@ -0,0 +1,113 @@
+import os
+import re
+import time
+import logging
+import importlib
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from ffmpeg_utils import PROBE_TIMEOUT, get_ffmpeg_binary
+
+logger = logging.getLogger(__name__)
+
+# Start and warm every encoder process at boot instead of on the first jobs
+WARM_POOL = os.getenv('WARM_POOL', 'true').lower() == 'true'
+
+# Modules job functions import lazily: the engines, and with them OpenCV and NumPy
+WARMUP_MODULES = ("video_stitcher", "ffmpeg_stitcher", "smart_stitcher", "stream_packager", "source_registry")
+
+# Encoders every engine's output needs from ffmpeg
+REQUIRED_ENCODERS = ("libx264", "aac")
+
+# Seconds to wait for every pool process to be up and warm
+WARMUP_TIMEOUT = float(os.getenv('WARMUP_TIMEOUT', '120'))
+
+# What warm_process found in this pool process
+_report: Optional[Dict] = None
+
+
+class WarmupError(RuntimeError):
+    """Raised when encoder processes cannot run jobs, e.g. ffmpeg lacks an encoder"""
+
+
+def probe_encoders() -> Tuple[str, List[str]]:
+    """ffmpeg's version and which of REQUIRED_ENCODERS it lacks"""
+    binary = get_ffmpeg_binary()
+    version = subprocess.run([binary, '-hide_banner', '-version'], capture_output=True, text=True,
+                             timeout=PROBE_TIMEOUT, check=True).stdout
+    encoders = subprocess.run([binary, '-hide_banner', '-encoders'], capture_output=True, text=True,
+                              timeout=PROBE_TIMEOUT, check=True).stdout
+    # Encoder lines are " V....D libx264   description"
+    available = {line.split()[1] for line in encoders.splitlines() if len(line.split()) > 1}
+    match = re.match(r"ffmpeg version (\S+)", version)
+    return (match.group(1) if match else "unknown"), [name for name in REQUIRED_ENCODERS if name not in available]
+
+
+def warm_process() -> None:
+    """
+    Pool initializer: prepare a worker process before it takes its first job.
+
+    Imports WARMUP_MODULES and checks that ffmpeg runs and has
+    REQUIRED_ENCODERS. Problems are recorded rather than raised, since an
+    initializer that raises breaks the whole pool.
+    """
+    global _report
+    started = time.perf_counter()
+    errors = []
+    for module in WARMUP_MODULES:
+        try:
+            importlib.import_module(module)
+        except Exception as e:
+            errors.append(f"Could not import {module}: {e}")
+    version = None
+    try:
+        version, missing = probe_encoders()
+        errors += [f"ffmpeg has no {name} encoder" for name in missing]
+    except Exception as e:
+        errors.append(f"ffmpeg is not usable: {e}")
+    _report = {"pid": os.getpid(), "seconds": round(time.perf_counter() - started, 3), "ffmpeg": version,
+               "errors": errors}
+
+
+def warm_report(barrier) -> Dict:
+    """
+    The warm_process report of the pool process this runs in.
+
+    Waiting at the barrier keeps this process busy until every other one
+    has taken a report task too, so no process reports twice.
+    """
+    barrier.wait(WARMUP_TIMEOUT)
+    return _report or {"pid": os.getpid(), "seconds": 0.0, "ffmpeg": None, "errors": ["Process was not warmed"]}
+
+
+def warm_pool(pool: ProcessPoolExecutor, workers: int, manager) -> Dict:
+    """
+    Start every process of a pool created with initializer=warm_process and wait until all are warm.
+
+    The pool spawns a process for each task submitted while none is idle,
+    so one warm_report per worker starts them all at once; manager (a
+    multiprocessing Manager) provides the barrier they meet at. Returns
+    the number of warm processes, the time taken in seconds, the ffmpeg
+    version and any errors.
+    """
+    started = time.perf_counter()
+    barrier = manager.Barrier(workers)
+    futures = [pool.submit(warm_report, barrier) for _ in range(workers)]
+    pids, versions, errors = set(), set(), []
+    for future in futures:
+        try:
+            report = future.result()
+        except Exception as e:
+            errors.append(f"Worker process failed to start: {e!r}")
+            continue
+        pids.add(report["pid"])
+        if report["ffmpeg"]:
+            versions.add(report["ffmpeg"])
+        errors += [error for error in report["errors"] if error not in errors]
+    return {
+        "warm_workers": len(pids),
+        "seconds": round(time.perf_counter() - started, 3),
+        "ffmpeg": ", ".join(sorted(versions)) or None,
+        "errors": errors,
+    }
@@ -0,0 +1,164 @@
+"""
+Encoder worker for distributed mode.
+
+Claims jobs from the broker the API processes queue on, runs each in a
+process of its own, heartbeats while they run and reports their events
+and outcome back through the broker. Its pool processes are warmed
+(see warmup) before the worker offers any slots. Inputs and outputs are read and
+written at the paths the API recorded, so TEMP_DIR, OUTPUT_DIR and
+SOURCES_DIR must be shared storage mounted at the same paths on every
+node, and a SQLite broker file must be on a filesystem with working
+POSIX locks. SIGTERM stops claiming and lets running jobs finish.
+
+    BROKER_URL=sqlite:////shared/broker.db python -m video_stitcher worker
+    python -m video_stitcher worker --broker sqlite:////shared/broker.db --concurrency 2
+"""
+import os
+import sys
+import time
+import signal
+import socket
+import logging
+import argparse
+import importlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, Future
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from job_broker import BROKER_URL, WORKER_HEARTBEAT_INTERVAL, create_broker
+from job_executor import BrokerJobContext, JobCancelledError, default_worker_count
+from warmup import WARM_POOL, WarmupError, warm_pool, warm_process
+
+logger = logging.getLogger(__name__)
+
+# Seconds an idle worker waits before asking the broker for a job again
+CLAIM_INTERVAL = float(os.getenv('CLAIM_INTERVAL', '1'))
+
+
+def run_claimed_job(fn: str, context: BrokerJobContext, args: List):
+    """Import a job function by its module:name and run it in this pool process"""
+    module, _, name = fn.partition(":")
+    return getattr(importlib.import_module(module), name)(context, *args)
+
+
+class Worker:
+    """Runs up to concurrency claimed jobs at once in a pool of spawned processes"""
+
+    def __init__(self, broker_url: str, concurrency: int):
+        self.broker_url = broker_url
+        self.broker = create_broker(broker_url)
+        self.concurrency = concurrency
+        self.id = f"{socket.gethostname()}:{os.getpid()}"
+        self._running: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def stop(self, *_) -> None:
+        if not self._stopping.is_set():
+            logger.info("Stopping: finishing running jobs, claiming no more")
+        self._stopping.set()
+
+    def _heartbeat_loop(self) -> None:
+        while True:
+            # A draining worker offers no slots, so the API stops counting on it
+            slots = 0 if self._stopping.is_set() else self.concurrency
+            try:
+                self.broker.heartbeat(self.id, slots)
+            except Exception as e:
+                logger.error(f"Heartbeat failed: {e}")
+            with self._lock:
+                if self._stopping.is_set() and not self._running:
+                    return
+            time.sleep(WORKER_HEARTBEAT_INTERVAL)
+
+    def _finish(self, job: Dict, future: Future) -> None:
+        try:
+            outcome = {"result": future.result()}
+            logger.info(f"Finished task {job['task_id']}")
+        except JobCancelledError as e:
+            outcome = {"error": str(e), "cancelled": True}
+            logger.info(f"Cancelled task {job['task_id']}")
+        except Exception as e:
+            outcome = {"error": str(e), "cancelled": False}
+            logger.error(f"Task {job['task_id']} failed: {e}")
+        try:
+            if not self.broker.finish(job["id"], self.id, outcome):
+                logger.warning(f"Task {job['task_id']} was requeued meanwhile; its outcome is dropped")
+        except Exception as e:
+            logger.error(f"Could not report the outcome of task {job['task_id']}: {e}")
+        with self._lock:
+            self._running.pop(job["id"], None)
+
+    def run(self) -> None:
+        """
+        Claim and run jobs until stopped, then wait for the running ones.
+
+        With WARM_POOL the pool is warmed first, and WarmupError is raised
+        without joining the broker if its processes cannot encode.
+        """
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        # Spawn keeps job processes from inheriting this process's threads and connections
+        ctx = multiprocessing.get_context('spawn')
+        pool = ProcessPoolExecutor(max_workers=self.concurrency, mp_context=ctx, initializer=warm_process)
+        if WARM_POOL:
+            with ctx.Manager() as manager:
+                warmup = warm_pool(pool, self.concurrency, manager)
+            if warmup["errors"]:
+                pool.shutdown(wait=True, cancel_futures=True)
+                raise WarmupError("; ".join(warmup["errors"]))
+            logger.info(f"Warmed {warmup['warm_workers']} job processes in {warmup['seconds']}s (ffmpeg {warmup['ffmpeg']})")
+        self.broker.heartbeat(self.id, self.concurrency)
+        heartbeat = threading.Thread(target=self._heartbeat_loop, name="worker-heartbeat", daemon=True)
+        heartbeat.start()
+        logger.info(f"Worker {self.id} running {self.concurrency} jobs at once from {self.broker_url}")
+
+        while not self._stopping.is_set():
+            with self._lock:
+                free = len(self._running) < self.concurrency
+            job = None
+            if free:
+                try:
+                    job = self.broker.claim(self.id)
+                except Exception as e:
+                    logger.error(f"Could not claim a job: {e}")
+            if job is None:
+                self._stopping.wait(CLAIM_INTERVAL)
+                continue
+            logger.info(f"Claimed task {job['task_id']} (attempt {job['attempts']})")
+            context = BrokerJobContext(job["task_id"], job["id"], self.id, self.broker_url)
+            future = pool.submit(run_claimed_job, job["fn"], context, job["args"])
+            with self._lock:
+                self._running[job["id"]] = future
+            future.add_done_callback(lambda f, job=job: self._finish(job, f))
+
+        pool.shutdown(wait=True)
+        heartbeat.join()
+        self.broker.remove_worker(self.id)
+        logger.info(f"Worker {self.id} stopped")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(prog="python -m video_stitcher worker",
+                                     description="Run stitch jobs queued on a broker by the API")
+    parser.add_argument("--broker", default=BROKER_URL, help="Broker URL (default: BROKER_URL)")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv('MAX_WORKERS', str(default_worker_count()))),
+                        help="Jobs run at once (default: MAX_WORKERS, or the cores divided by ENCODER_THREADS)")
+    args = parser.parse_args(argv)
+    if not args.broker:
+        parser.error("set BROKER_URL or pass --broker")
+    try:
+        Worker(args.broker, max(1, args.concurrency)).run()
+    except WarmupError as e:
+        logger.error(f"Worker cannot run jobs: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())